@@ -1,30 +1,174 @@
 import os
+import json
 import pickle
+import logging
+import tempfile
+import threading
+from datetime import datetime, timedelta, timezone
+
+import google_auth_httplib2
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
-import logging
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import build_http
+
+import metrics
 
-SCOPES = ["https://www.googleapis.com/auth/youtube.upload"]
+# youtube.force-ssl covers the metadata calls in youtube_metadata (videos.list,
+# videos.update, playlistItems.insert); tokens granted before it was added
+# still upload, but need re-authorizing for those.
+SCOPES = [
+    "https://www.googleapis.com/auth/youtube.upload",
+    "https://www.googleapis.com/auth/youtube.force-ssl",
+]
 CREDENTIALS_FILE = "resources/client_secrets.json"
+TOKEN_FILE = "token.pickle"
 
-def get_authenticated_service():
-    """Authenticate with YouTube Data API."""
-    try:
+# Access tokens are refreshed this long before they expire, so a long chunked
+# upload never starts a request with a token about to lapse.
+REFRESH_MARGIN = timedelta(minutes=5)
+
+_discovery_document = None
+_discovery_lock = threading.Lock()
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+_local = threading.local()
+
+
+def _youtube_discovery_document() -> dict:
+    """
+    Returns the YouTube v3 discovery document bundled with googleapiclient,
+    parsed once per process instead of fetched and parsed on every build.
+    """
+    global _discovery_document
+    with _discovery_lock:
+        if _discovery_document is None:
+            document = discovery_cache.get_static_doc("youtube", "v3")
+            if document is None:
+                raise RuntimeError("googleapiclient ships no static discovery document for youtube v3")
+            _discovery_document = json.loads(document)
+        return _discovery_document
+
+
+def _utcnow() -> datetime:
+    # google-auth keeps expiry as a naive UTC datetime.
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
+class CredentialManager:
+    """
+    Owns the OAuth credentials of one token file, shared by every thread.
+
+    The token is read once. Refreshes happen ahead of expiry and under a
+    lock, so when several uploaders notice a stale token at the same time only
+    one of them refreshes it and writes the token file.
+    """
+
+    def __init__(self, credentials_file: str = CREDENTIALS_FILE, token_file: str = TOKEN_FILE,
+                 refresh_margin: timedelta = REFRESH_MARGIN):
+        self.credentials_file = credentials_file
+        self.token_file = token_file
+        self.refresh_margin = refresh_margin
+        self._lock = threading.Lock()
+        self.credentials = self._load()
+
+    def _load(self):
         credentials = None
-        if os.path.exists("token.pickle"):
-            with open("token.pickle", "rb") as token:
+        if os.path.exists(self.token_file):
+            with open(self.token_file, "rb") as token:
                 credentials = pickle.load(token)
-        if not credentials or not credentials.valid:
-            if credentials and credentials.expired and credentials.refresh_token:
-                credentials.refresh(Request())
-            else:
-                flow = InstalledAppFlow.from_client_secrets_file(CREDENTIALS_FILE, SCOPES)
-                credentials = flow.run_local_server(port=0)
-            with open("token.pickle", "wb") as token:
+        if credentials and (credentials.valid or credentials.refresh_token):
+            return credentials
+        flow = InstalledAppFlow.from_client_secrets_file(self.credentials_file, SCOPES)
+        credentials = flow.run_local_server(port=0)
+        self._save(credentials)
+        return credentials
+
+    def _save(self, credentials) -> None:
+        """Writes the token to a temp file and renames it over the old one."""
+        token_dir = os.path.dirname(self.token_file) or "."
+        os.makedirs(token_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=token_dir, prefix=".token-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as token:
                 pickle.dump(credentials, token)
+            os.replace(tmp_path, self.token_file)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def _needs_refresh(self) -> bool:
+        credentials = self.credentials
+        if not credentials.valid:
+            return True
+        expiry = getattr(credentials, "expiry", None)
+        return expiry is not None and expiry - self.refresh_margin <= _utcnow()
+
+    def ensure_fresh(self):
+        """Refreshes the token if it expires within the margin; single-flight."""
+        if self._needs_refresh():
+            with self._lock:
+                # Another thread may have refreshed while we waited.
+                if self._needs_refresh():
+                    with metrics.span("youtube_token_refresh"):
+                        self.credentials.refresh(Request())
+                    self._save(self.credentials)
+                    logging.info("Refreshed YouTube access token in %s.", self.token_file)
+        return self.credentials
+
+
+class _FreshAuthorizedHttp(google_auth_httplib2.AuthorizedHttp):
+    """AuthorizedHttp that refreshes through the shared manager before each request."""
+
+    def __init__(self, manager: CredentialManager):
+        # build_http() keeps 308 out of httplib2's redirect codes, which the
+        # resumable upload protocol relies on.
+        super().__init__(manager.credentials, http=build_http())
+        self._manager = manager
+
+    def request(self, *args, **kwargs):
+        self.credentials = self._manager.ensure_fresh()
+        return super().request(*args, **kwargs)
+
+
+def get_credential_manager(credentials_file=CREDENTIALS_FILE, token_file=TOKEN_FILE) -> CredentialManager:
+    key = (os.path.abspath(credentials_file), os.path.abspath(token_file))
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = CredentialManager(credentials_file, token_file)
+        return _managers[key]
+
+
+def clear_service_cache() -> None:
+    """Forgets cached credentials and this thread's services, e.g. after a token is revoked."""
+    with _managers_lock:
+        _managers.clear()
+    _local.__dict__.clear()
+
+
+def get_authenticated_service(credentials_file=CREDENTIALS_FILE, token_file=TOKEN_FILE):
+    """
+    Authenticate with YouTube Data API.
+
+    Services are cached per thread: httplib2 transports are not thread-safe,
+    so each thread gets its own, built from the bundled discovery document,
+    while all threads share one CredentialManager per token file.
+    """
+    services = _local.__dict__.setdefault("services", {})
+    key = (os.path.abspath(credentials_file), os.path.abspath(token_file))
+    if key in services:
+        return services[key]
+    try:
+        with metrics.span("youtube_auth"):
+            manager = get_credential_manager(credentials_file, token_file)
+            manager.ensure_fresh()
+            service = build_from_document(_youtube_discovery_document(), http=_FreshAuthorizedHttp(manager))
         logging.info("Successfully authenticated with YouTube API.")
-        return build("youtube", "v3", credentials=credentials)
     except Exception as e:
         logging.error(f"Error during authentication: {e}")
         raise
+    services[key] = service
+    return service
@@ -0,0 +1,81 @@
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import Callable, Optional, Sequence
+
+import metrics
+
+
+class BandwidthLimiter:
+    """
+    Token bucket capping the upload bytes per second of every uploader that
+    shares it.
+
+    Uploaders call `consume()` with the size of each chunk before sending it.
+    A chunk larger than what is in the bucket is let through once the bucket
+    has refilled enough to pay for it, so the average rate holds for any
+    chunk size and the bucket never needs to be as big as a chunk. Waiting
+    callers are served in the order they asked, as each one books its bytes
+    before it sleeps.
+
+    With `hours` = (start, end), local-time hours, the cap only applies from
+    start to end (e.g. (9, 18) for business hours; (22, 6) wraps midnight)
+    and uploads run at full speed the rest of the day.
+    """
+
+    def __init__(
+        self,
+        rate_bytes: float,
+        burst_bytes: Optional[float] = None,
+        hours: Optional[Sequence[int]] = None,
+        clock: Callable[[], float] = time.monotonic,
+        now: Callable[[], datetime] = datetime.now,
+    ):
+        if rate_bytes <= 0:
+            raise ValueError("BandwidthLimiter rate must be positive")
+        self.rate_bytes = rate_bytes
+        # One second of traffic by default.
+        self.burst_bytes = burst_bytes if burst_bytes is not None else rate_bytes
+        self.hours = tuple(hours) if hours is not None else None
+        self.clock = clock
+        self.now = now
+        self._lock = threading.Lock()
+        self._tokens = self.burst_bytes
+        self._updated = clock()
+
+    def active(self) -> bool:
+        """Whether the cap applies right now."""
+        if self.hours is None:
+            return True
+        start, end = self.hours
+        hour = self.now().hour
+        if start <= end:
+            return start <= hour < end
+        return hour >= start or hour < end
+
+    def _reserve(self, nbytes: int) -> float:
+        """Books `nbytes` and returns how long the caller has to wait for them."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(self.burst_bytes, self._tokens + (now - self._updated) * self.rate_bytes)
+            self._updated = now
+            self._tokens -= nbytes
+            return max(0.0, -self._tokens / self.rate_bytes)
+
+    def consume(self, nbytes: int, cancel: Optional[threading.Event] = None) -> float:
+        """
+        Blocks until `nbytes` may be sent; returns the seconds waited. Returns
+        early if `cancel` is set while waiting.
+        """
+        if nbytes <= 0 or not self.active():
+            return 0.0
+        delay = self._reserve(nbytes)
+        if delay > 0:
+            logging.debug("Throttling upload: waiting %.2fs for %d bytes", delay, nbytes)
+            metrics.inc("upload_throttle_wait_seconds_total", delay)
+            if cancel is not None:
+                cancel.wait(delay)
+            else:
+                time.sleep(delay)
+        return delay
@@ -0,0 +1,584 @@
+"""
+End-to-end throughput benchmark against local stand-ins for TikTok and the
+YouTube Data API.
+
+Runs download_tiktok_clips and process_and_upload_clips over synthetic
+catalogs and reports videos/s, bytes/s, p50/p99 per-video latency and peak
+RSS for each stage:
+
+    python benchmark.py --videos 10 100 1000 --video-size 262144 --latency 0.02
+
+Both fake servers can add latency, cap bandwidth and fail a share of requests
+with 503s; the YouTube one can also start answering quotaExceeded after a
+number of uploads.
+
+`python benchmark.py --startup` instead times how long each main.py
+command takes to import what it needs, each in a fresh interpreter, and
+the whole `main.py status` process.
+"""
+import os
+import csv
+import sys
+import json
+import time
+import copy
+import random
+import shutil
+import struct
+import asyncio
+import argparse
+import tempfile
+import resource
+import statistics
+import subprocess
+import threading
+import contextlib
+import urllib.error
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+from unittest import mock
+
+import pyktok as pyk
+from googleapiclient.discovery import build_from_document
+from googleapiclient.http import build_http
+
+import auth
+import tiktok_downloader
+import upload_executor
+import youtube_uploader
+from bandwidth import BandwidthLimiter
+from quota import QuotaScheduler
+from state_store import StateStore
+
+
+BENCH_USERNAME = "bench"
+FIRST_VIDEO_ID = 7300000000000000000
+
+
+@dataclass
+class FakeServerConfig:
+    latency: float = 0.0  # seconds added to every request
+    bandwidth: float = 0.0  # bytes per second for request and response bodies; 0 is unlimited
+    error_rate: float = 0.0  # share of requests answered with a 503
+    quota_after: Optional[int] = None  # YouTube only: uploads accepted before quotaExceeded
+    seed: int = 0
+
+
+class _FakeServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, config: FakeServerConfig):
+        super().__init__(("127.0.0.1", 0), handler)
+        self.config = config
+        self.lock = threading.Lock()
+        self.random = random.Random(config.seed)
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+
+class _FakeHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers and body go out in separate writes; without this, Nagle's
+    # algorithm and delayed ACKs add ~40 ms to every small response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _throttle(self, size: int) -> None:
+        if self.server.config.bandwidth:
+            time.sleep(size / self.server.config.bandwidth)
+
+    def _inject(self) -> bool:
+        """Applies latency and maybe answers with a 503. Returns True if it did."""
+        config = self.server.config
+        if config.latency:
+            time.sleep(config.latency)
+        with self.server.lock:
+            fail = self.server.random.random() < config.error_rate
+        if fail:
+            self._read_body()
+            self._send(503, b"injected error")
+        return fail
+
+    def _read_body(self) -> bytes:
+        body = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+        self._throttle(len(body))
+        return body
+
+    def _send(self, status: int, body: bytes = b"", content_type: str = "application/json", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self._throttle(len(body))
+        self.wfile.write(body)
+
+
+def _box(box_type: bytes, payload: bytes) -> bytes:
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _video_bytes(video_id: int, size: int) -> bytes:
+    # A minimal mp4 (one 1080x1920 track, 15 s) that passes the uploader's
+    # box probe, padded to `size`. The video id makes the media data unique,
+    # so the content dedupe in the uploader sees no repeats.
+    mvhd = _box(b"mvhd", struct.pack(">B3xIIII", 0, 0, 0, 1000, 15000) + b"\0" * 80)
+    tkhd = _box(b"tkhd", struct.pack(">B3xIIIII", 0, 0, 0, 1, 0, 15000) + b"\0" * 52
+                + struct.pack(">II", 1080 << 16, 1920 << 16))
+    header = _box(b"ftyp", b"isom\0\0\2\0isommp41") + _box(b"moov", mvhd + _box(b"trak", tkhd))
+    frames = f"fake frames {video_id}\n".encode()
+    frames += b"\0" * max(0, size - len(header) - 8 - len(frames))
+    return header + _box(b"mdat", frames)
+
+
+class FakeTikTokServer(_FakeServer):
+    """
+    Serves a catalog of `videos` synthetic videos of `video_size` bytes:
+
+        GET /api/list?count=N   newest N video URLs as a JSON list
+        GET /api/item/<id>      the video's metadata as JSON
+        GET /video/<id>.mp4     the video bytes
+    """
+
+    def __init__(self, videos: int, video_size: int, config: FakeServerConfig = None):
+        super().__init__(_TikTokHandler, config or FakeServerConfig())
+        self.video_size = video_size
+        self.video_ids = [FIRST_VIDEO_ID + n for n in range(videos, 0, -1)]
+
+
+class _TikTokHandler(_FakeHandler):
+    def do_GET(self):
+        if self._inject():
+            return
+        path, _, query = self.path.partition("?")
+        if path == "/api/list":
+            count = int(dict(p.split("=") for p in query.split("&") if p).get("count", 30))
+            urls = [
+                f"https://www.tiktok.com/@{BENCH_USERNAME}/video/{video_id}"
+                for video_id in self.server.video_ids[:count]
+            ]
+            self._send(200, json.dumps(urls).encode())
+        elif path.startswith("/api/item/"):
+            video_id = int(path.rsplit("/", 1)[-1])
+            item = {
+                "video_id": video_id,
+                "video_timestamp": "2024-01-01T00:00:00",
+                "video_duration": 15,
+                "video_description": f"Benchmark video {video_id} #fyp",
+                "video_playcount": video_id % 100000,
+                "author_username": BENCH_USERNAME,
+            }
+            self._send(200, json.dumps(item).encode())
+        elif path.startswith("/video/"):
+            video_id = int(path.rsplit("/", 1)[-1][:-len(".mp4")])
+            self._send(200, _video_bytes(video_id, self.server.video_size), "video/mp4")
+        else:
+            self._send(404)
+
+
+class FakeYouTubeServer(_FakeServer):
+    """
+    Implements the resumable upload protocol of videos.insert: a POST opens
+    a session, PUTs with Content-Range send chunks (308 until complete) and
+    an empty PUT with "bytes */size" reports how much the session holds.
+    """
+
+    def __init__(self, config: FakeServerConfig = None):
+        super().__init__(_YouTubeHandler, config or FakeServerConfig())
+        self.sessions: Dict[str, Dict] = {}
+        self.uploaded = 0
+
+
+class _YouTubeHandler(_FakeHandler):
+    def do_POST(self):
+        if self._inject():
+            return
+        self._read_body()
+        server = self.server
+        with server.lock:
+            # Like the real API, quota is spent by the insert call that opens a
+            # session, so parallel uploads cannot overshoot the limit.
+            quota_spent = server.config.quota_after is not None and len(server.sessions) >= server.config.quota_after
+            session_id = str(len(server.sessions) + 1)
+            if not quota_spent:
+                size = int(self.headers.get("X-Upload-Content-Length") or 0)
+                server.sessions[session_id] = {"size": size, "received": 0}
+        if quota_spent:
+            error = {"error": {"code": 403, "errors": [{"reason": "quotaExceeded"}]}}
+            self._send(403, json.dumps(error).encode())
+            return
+        self._send(200, b"{}", headers={"Location": f"{server.base_url}/upload/session/{session_id}"})
+
+    def do_PUT(self):
+        if self._inject():
+            return
+        body = self._read_body()
+        session_id = self.path.rsplit("/", 1)[-1]
+        server = self.server
+        with server.lock:
+            session = server.sessions.get(session_id)
+            if session is None:
+                received = done = None
+            else:
+                received, done = self._receive(session, body, session_id)
+        if session is None:
+            self._send(404)
+        elif done is not None:
+            self._send(200, done)
+        elif received:
+            self._send(308, headers={"Range": f"bytes=0-{received - 1}"})
+        else:
+            self._send(308)
+
+    def _receive(self, session: Dict, body: bytes, session_id: str):
+        """
+        Appends a chunk that starts where the session left off. Returns the
+        bytes held and the response body once complete. Caller holds the lock.
+        """
+        content_range = self.headers.get("Content-Range", "")
+        if body and content_range.startswith("bytes ") and "-" in content_range:
+            first = int(content_range[len("bytes "):].split("-")[0])
+            if first == session["received"]:
+                session["received"] += len(body)
+        if session["size"] and session["received"] >= session["size"]:
+            self.server.uploaded += 1
+            return session["received"], json.dumps({"id": f"yt{session_id}"}).encode()
+        return session["received"], None
+
+
+def fake_youtube_service(base_url: str):
+    """A YouTube client whose requests all go to base_url."""
+    document = copy.deepcopy(auth._youtube_discovery_document())
+    document["rootUrl"] = document["mtlsRootUrl"] = base_url + "/"
+    return build_from_document(document, http=build_http())
+
+
+# -- fake pyktok --------------------------------------------------------------
+
+_tiktok_base_url = None
+
+
+def _fetch(url: str) -> bytes:
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return response.read()
+    except urllib.error.HTTPError as e:
+        # HTTPError holds its socket and cannot be pickled back from a worker.
+        raise RuntimeError(f"{url}: HTTP {e.code}") from None
+
+
+async def _fake_get_video_urls(username, ent_type="user", video_ct=30, **kwargs):
+    return json.loads(await asyncio.to_thread(_fetch, f"{_tiktok_base_url}/api/list?count={video_ct}"))
+
+
+def _fake_save_tiktok(video_url, save_video=True, metadata_fn="", **kwargs):
+    """Mimics pyktok.save_tiktok against the fake server: writes into the cwd."""
+    video_id = video_url.rstrip("/").rsplit("/", 1)[-1]
+    item = json.loads(_fetch(f"{_tiktok_base_url}/api/item/{video_id}"))
+    if save_video:
+        with open(tiktok_downloader.tiktok_url_to_filename(video_url), "wb") as f:
+            f.write(_fetch(f"{_tiktok_base_url}/video/{video_id}.mp4"))
+    if metadata_fn:
+        with open(metadata_fn, "a", newline="", encoding="utf-8") as f:
+            writer = csv.DictWriter(f, fieldnames=list(item))
+            if f.tell() == 0:
+                writer.writeheader()
+            writer.writerow(item)
+
+
+def _install_fake_pyktok(base_url: str) -> None:
+    """Points pyktok at the fake server; also the download workers' initializer."""
+    global _tiktok_base_url
+    _tiktok_base_url = base_url
+    pyk.get_video_urls = _fake_get_video_urls
+    pyk.save_tiktok = _fake_save_tiktok
+
+
+# -- measurement --------------------------------------------------------------
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _peak_rss_mb() -> float:
+    """Peak RSS of this process or its largest download worker, in MiB."""
+    own = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    children = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    # ru_maxrss is in bytes on macOS and KiB elsewhere.
+    return max(own, children) / (1024 * 1024 if sys.platform == "darwin" else 1024)
+
+
+@dataclass
+class StageResult:
+    stage: str
+    videos: int
+    completed: int = 0
+    failed: int = 0
+    seconds: float = 0.0
+    bytes: int = 0
+    latencies: List[float] = field(default_factory=list, repr=False)
+    peak_rss_mb: float = 0.0
+
+    @property
+    def videos_per_second(self) -> float:
+        return self.completed / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self) -> float:
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> Dict:
+        result = asdict(self)
+        del result["latencies"]
+        result.update(
+            videos_per_second=round(self.videos_per_second, 2),
+            bytes_per_second=round(self.bytes_per_second),
+            p50_latency=round(_percentile(self.latencies, 50), 4),
+            p99_latency=round(_percentile(self.latencies, 99), 4),
+            seconds=round(self.seconds, 3),
+            peak_rss_mb=round(self.peak_rss_mb, 1),
+        )
+        return result
+
+
+def _timed(result: StageResult, func, size_of):
+    """Wraps `func` to record each call's latency and output size in `result`."""
+    lock = threading.Lock()
+
+    def record(value, started):
+        with lock:
+            result.latencies.append(time.perf_counter() - started)
+            if value:
+                result.completed += 1
+                result.bytes += size_of(value)
+            else:
+                result.failed += 1
+
+    if asyncio.iscoroutinefunction(func):
+        async def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                value = await func(*args, **kwargs)
+            except Exception:
+                record(None, started)
+                raise
+            record(value, started)
+            return value
+    else:
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                value = func(*args, **kwargs)
+            except Exception:
+                record(None, started)
+                raise
+            record(value, started)
+            return value
+    return wrapper
+
+
+def run_benchmark(
+    videos: int,
+    video_size: int = 256 * 1024,
+    work_dir: Optional[str] = None,
+    download_workers: int = tiktok_downloader.DEFAULT_MAX_WORKERS,
+    requests_per_second: float = 0.0,
+    tiktok: FakeServerConfig = None,
+    youtube: FakeServerConfig = None,
+    upload_workers: int = upload_executor.DEFAULT_UPLOAD_WORKERS,
+    upload_rate: float = 0.0,
+) -> Dict[str, StageResult]:
+    """
+    Downloads a catalog of `videos` synthetic videos from a fake TikTok
+    server and uploads them to a fake YouTube endpoint with `upload_workers`
+    uploaders (capped at `upload_rate` bytes/s in total if set), in a fresh
+    download dir under `work_dir`. Returns the measurements of both stages.
+    """
+    download_dir = tempfile.mkdtemp(prefix="tiktok-bench-", dir=work_dir)
+    results = {
+        "download": StageResult("download", videos),
+        "upload": StageResult("upload", videos),
+    }
+    try:
+        with FakeTikTokServer(videos, video_size, tiktok) as tiktok_server, \
+                FakeYouTubeServer(youtube) as youtube_server, \
+                contextlib.ExitStack() as patches:
+            _install_fake_pyktok(tiktok_server.base_url)
+            store = StateStore.for_download_dir(download_dir)
+            # Every thread gets its own client, as with the real per-thread auth cache.
+            local = threading.local()
+
+            def service():
+                if not hasattr(local, "youtube"):
+                    local.youtube = fake_youtube_service(youtube_server.base_url)
+                return local.youtube
+
+            patches.enter_context(mock.patch.object(
+                tiktok_downloader, "_download_with_retry",
+                _timed(results["download"], tiktok_downloader._download_with_retry, os.path.getsize),
+            ))
+            patches.enter_context(mock.patch.object(
+                upload_executor, "upload_video_record",
+                _timed(results["upload"], youtube_uploader.upload_video_record, lambda _: video_size),
+            ))
+            patches.enter_context(mock.patch.object(youtube_uploader, "get_authenticated_service", service))
+
+            started = time.perf_counter()
+            with ProcessPoolExecutor(
+                max_workers=download_workers,
+                initializer=_install_fake_pyktok,
+                initargs=(tiktok_server.base_url,),
+            ) as executor:
+                asyncio.run(tiktok_downloader.download_tiktok_clips(
+                    BENCH_USERNAME,
+                    download_dir,
+                    max_workers=download_workers,
+                    requests_per_second=requests_per_second,
+                    backoff_base=0.01,
+                    executor=executor,
+                    store=store,
+                    max_videos=videos,
+                ))
+            results["download"].seconds = time.perf_counter() - started
+            results["download"].peak_rss_mb = _peak_rss_mb()
+
+            # The fake endpoint enforces quota itself; keep the local budget out of the way.
+            scheduler = QuotaScheduler(store, project="benchmark", daily_budget=sys.maxsize)
+            started = time.perf_counter()
+            youtube_uploader.process_and_upload_clips(
+                download_dir, store=store, scheduler=scheduler, workers=upload_workers,
+                throttle=BandwidthLimiter(upload_rate) if upload_rate else None,
+            )
+            results["upload"].seconds = time.perf_counter() - started
+            results["upload"].peak_rss_mb = _peak_rss_mb()
+            store.close()
+    finally:
+        shutil.rmtree(download_dir, ignore_errors=True)
+    return results
+
+
+def _format_row(size: int, result: StageResult) -> str:
+    s = result.summary()
+    return (
+        f"{size:>7} {s['stage']:<8} {s['completed']:>6} {s['failed']:>6} {s['seconds']:>9.2f} "
+        f"{s['videos_per_second']:>9.1f} {s['bytes_per_second'] / 1e6:>8.2f} "
+        f"{s['p50_latency'] * 1000:>9.1f} {s['p99_latency'] * 1000:>9.1f} {s['peak_rss_mb']:>8.1f}"
+    )
+
+
+_IMPORT_TIMER = (
+    "import time, importlib; started = time.perf_counter(); import main; "
+    "[importlib.import_module(m) for m in main.COMMAND_MODULES.get({command!r}, ())]; "
+    "print(time.perf_counter() - started)"
+)
+
+
+def startup_benchmark(commands: Optional[List[str]] = None, repeat: int = 5) -> Dict[str, Dict]:
+    """
+    Times, in fresh interpreters, importing main.py plus the modules each
+    command loads ("main" alone is the baseline), and running the whole
+    `main.py status` process in an empty directory. Returns the median and
+    fastest of `repeat` runs in milliseconds.
+    """
+    import main
+
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    commands = ["main"] + list(commands or main.COMMAND_MODULES)
+    results = {}
+    for command in commands:
+        samples = []
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, "-c", _IMPORT_TIMER.format(command=command)],
+                cwd=repo_dir, check=True, capture_output=True, text=True,
+            ).stdout
+            samples.append(float(output.strip().splitlines()[-1]) * 1000)
+        results[command] = {"median_ms": statistics.median(samples), "min_ms": min(samples)}
+
+    samples = []
+    with tempfile.TemporaryDirectory() as scratch:
+        for _ in range(repeat):
+            started = time.perf_counter()
+            subprocess.run(
+                [sys.executable, os.path.join(repo_dir, "main.py"), "status"],
+                cwd=scratch, check=True, capture_output=True,
+            )
+            samples.append((time.perf_counter() - started) * 1000)
+    results["status (whole process)"] = {"median_ms": statistics.median(samples), "min_ms": min(samples)}
+    return results
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--videos", type=int, nargs="+", default=[10, 100, 1000], help="catalog sizes to run")
+    parser.add_argument("--video-size", type=int, default=256 * 1024, help="bytes per video")
+    parser.add_argument("--workers", type=int, default=tiktok_downloader.DEFAULT_MAX_WORKERS, help="download workers")
+    parser.add_argument("--upload-workers", type=int, default=upload_executor.DEFAULT_UPLOAD_WORKERS,
+                        help="uploads running at once")
+    parser.add_argument("--upload-rate", type=float, default=0.0, help="upload bytes/s in total (0: unlimited)")
+    parser.add_argument("--rps", type=float, default=0.0, help="TikTok requests per second (0: unlimited)")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to each fake request")
+    parser.add_argument("--bandwidth", type=float, default=0.0, help="bytes/s per fake transfer (0: unlimited)")
+    parser.add_argument("--tiktok-error-rate", type=float, default=0.0, help="share of TikTok requests failing")
+    parser.add_argument("--youtube-error-rate", type=float, default=0.0, help="share of YouTube requests failing")
+    parser.add_argument("--quota-after", type=int, default=None, help="uploads before YouTube reports quotaExceeded")
+    parser.add_argument("--work-dir", default=None, help="where to create the scratch download dirs")
+    parser.add_argument("--json", action="store_true", help="print results as JSON lines")
+    parser.add_argument("--startup", action="store_true", help="time main.py command imports instead")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per command with --startup")
+    return parser.parse_args(argv)
+
+
+def main(argv=None) -> None:
+    args = parse_args(argv)
+    if args.startup:
+        for command, timing in startup_benchmark(repeat=args.repeat).items():
+            if args.json:
+                print(json.dumps(dict(timing, command=command)))
+            else:
+                print(f"{command:<24} {timing['median_ms']:>8.1f} ms median {timing['min_ms']:>8.1f} ms min")
+        return
+    if not args.json:
+        print(f"{'videos':>7} {'stage':<8} {'done':>6} {'failed':>6} {'seconds':>9} "
+              f"{'videos/s':>9} {'MB/s':>8} {'p50 ms':>9} {'p99 ms':>9} {'RSS MB':>8}")
+    for size in args.videos:
+        results = run_benchmark(
+            size,
+            video_size=args.video_size,
+            work_dir=args.work_dir,
+            download_workers=args.workers,
+            requests_per_second=args.rps,
+            tiktok=FakeServerConfig(args.latency, args.bandwidth, args.tiktok_error_rate),
+            youtube=FakeServerConfig(args.latency, args.bandwidth, args.youtube_error_rate, args.quota_after),
+            upload_workers=args.upload_workers,
+            upload_rate=args.upload_rate,
+        )
+        for result in results.values():
+            if args.json:
+                print(json.dumps(dict(result.summary(), catalog=size)))
+            else:
+                print(_format_row(size, result))
+
+
+if __name__ == "__main__":
+    main()
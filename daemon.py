@@ -0,0 +1,334 @@
+import os
+import json
+import time
+import random
+import signal
+import asyncio
+import logging
+import threading
+import contextlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+
+import metrics
+from orchestrator import (
+    OrchestratorConfig,
+    SourceConfig,
+    build_bandwidth_limiter,
+    build_disk_cache,
+    channel_schedulers,
+    channel_service_factory,
+    load_config,
+)
+from pipeline import run_pipeline
+from scheduling import DEFAULT_REQUESTS_PER_SECOND, FairLimiter, HostRateLimiter
+from state_store import StateStore
+
+
+# How often the config file is checked for changes.
+CONFIG_CHECK_INTERVAL = 5.0
+
+# Settings that size the shared pools; changing them needs a restart.
+_RESTART_SETTINGS = ("download_workers", "upload_workers", "listing_concurrency", "transcode", "transcode_workers",
+                     "status_port", "status_host")
+
+
+@dataclass
+class AccountStatus:
+    """What the status endpoint reports for one TikTok source."""
+
+    tiktok_username: str
+    channel: str
+    poll_interval: float
+    syncing: bool = False
+    queue_depth: int = 0
+    next_sync: float = 0.0
+    last_sync_started: Optional[float] = None
+    last_sync_finished: Optional[float] = None
+    last_success: Optional[float] = None
+    last_uploaded: int = 0
+    last_error: Optional[str] = None
+
+
+def _source_key(source: SourceConfig) -> Tuple[str, str]:
+    return source.tiktok_username, source.channel
+
+
+class SyncDaemon:
+    """
+    Keeps every configured TikTok source mirrored, staying resident between
+    syncs.
+
+    Each source is synced every `poll_interval` seconds (its own, or the
+    config's), +/- `poll_jitter`, through the same pipeline as the one-shot
+    orchestrator. The download and transcode pools, the fair worker limits and
+    the authenticated YouTube clients (cached per thread by the auth module)
+    live as long as the daemon, so syncs after the first start warm.
+
+    The config file is reloaded when it changes (or on SIGHUP): sources and
+    channels are added, removed or updated for the syncs that start after
+    that; pool sizes and the status port only change on restart. SIGTERM or
+    SIGINT stop it gracefully: no new syncs, downloads or uploads start,
+    in-flight downloads finish and uploads stop after their current chunk, to
+    resume from there on the next start.
+
+    A new disk cache and bandwidth limit only take over once the syncs
+    running at reload time have finished, since their reservations are held
+    by the old ones; no new syncs start until then.
+
+    With `status_port` set, GET /health (or /status) on `status_host`
+    (localhost by default) returns JSON with the queue depth and last sync
+    times of every source.
+    """
+
+    def __init__(self, config_path: str, full_resync: bool = False):
+        self.config_path = config_path
+        self.full_resync = full_resync
+        self.started_at = time.time()
+        self.accounts: Dict[Tuple[str, str], AccountStatus] = {}
+        self.status_address: Optional[Tuple[str, int]] = None
+        self._sources: Dict[Tuple[str, str], SourceConfig] = {}
+        self._tasks: Dict[Tuple[str, str], asyncio.Task] = {}
+        self._stores: Dict[str, StateStore] = {}
+        self._running_stop_events = set()
+        self._cancel_uploads = threading.Event()
+        self._stop: Optional[asyncio.Event] = None
+        self._reload_requested = False
+        self._pending_limits = None
+        self._config_mtime = os.path.getmtime(config_path)
+        self._apply_config(load_config(config_path))
+
+    # -- config ---------------------------------------------------------------
+
+    def _store(self, download_dir: str) -> StateStore:
+        key = os.path.abspath(download_dir)
+        if key not in self._stores:
+            os.makedirs(download_dir, exist_ok=True)
+            self._stores[key] = StateStore.for_download_dir(download_dir)
+        return self._stores[key]
+
+    def _apply_config(self, config: OrchestratorConfig) -> None:
+        self.config = config
+        self.config_loaded_at = time.time()
+        self._channel_stores = {
+            name: self._store(channel.download_dir) for name, channel in config.channels.items()
+        }
+        self._factories = {name: channel_service_factory(channel) for name, channel in config.channels.items()}
+        self._schedulers = channel_schedulers(config, self._store(config.download_dir))
+        limits = (build_disk_cache(config, self._channel_stores), build_bandwidth_limiter(config))
+        if self._tasks:
+            self._pending_limits = limits
+        else:
+            self._cache, self._throttle = limits
+            self._pending_limits = None
+
+        now = time.time()
+        self._sources = {_source_key(source): source for source in config.sources}
+        for key, source in self._sources.items():
+            interval = source.poll_interval or config.poll_interval
+            status = self.accounts.get(key)
+            if status is None:
+                # Spread the first syncs out instead of starting them all at once.
+                self.accounts[key] = AccountStatus(
+                    source.tiktok_username, source.channel, interval,
+                    next_sync=now + random.uniform(0, interval * config.poll_jitter),
+                )
+            elif status.poll_interval != interval:
+                status.poll_interval = interval
+                if not status.syncing and status.last_sync_finished is not None:
+                    status.next_sync = status.last_sync_finished + self._delay(interval)
+        for key in list(self.accounts):
+            if key not in self._sources and key not in self._tasks:
+                del self.accounts[key]
+
+    def _delay(self, interval: float) -> float:
+        jitter = self.config.poll_jitter
+        return interval * random.uniform(1 - jitter, 1 + jitter)
+
+    def _check_config(self) -> None:
+        try:
+            mtime = os.path.getmtime(self.config_path)
+        except OSError as e:
+            logging.error("Cannot stat config %s: %s", self.config_path, e)
+            return
+        if mtime == self._config_mtime and not self._reload_requested:
+            return
+        self._config_mtime = mtime
+        self._reload_requested = False
+        try:
+            config = load_config(self.config_path)
+        except (OSError, ValueError, TypeError, KeyError) as e:
+            logging.error("Config %s is invalid, keeping the current one: %s", self.config_path, e)
+            return
+        changed = [name for name in _RESTART_SETTINGS if getattr(config, name) != getattr(self.config, name)]
+        if changed:
+            logging.warning("Changes to %s take effect after a restart.", ", ".join(changed))
+        self._apply_config(config)
+        logging.info("Reloaded %s: %d sources, %d channels.", self.config_path, len(config.sources), len(config.channels))
+
+    # -- syncing --------------------------------------------------------------
+
+    async def _sync(self, source: SourceConfig, status: AccountStatus) -> None:
+        channel = self.config.channels[source.channel]
+        full_resync = self.full_resync and status.last_sync_started is None
+        stop_uploads = asyncio.Event()
+        self._running_stop_events.add(stop_uploads)
+        status.syncing = True
+        status.last_sync_started = time.time()
+
+        def on_queue_depth(depth):
+            status.queue_depth = depth
+
+        try:
+            status.last_uploaded = await run_pipeline(
+                source.tiktok_username,
+                channel.download_dir,
+                upload_workers=self.config.upload_workers,
+                queue_size=self.config.queue_size,
+                store=self._channel_stores[source.channel],
+                upload_slots=self._upload_slots,
+                service_factory=self._factories[source.channel],
+                stop_uploads=stop_uploads,
+                backlog_author=source.tiktok_username,
+                executor=self._executor,
+                slots=self._download_slots,
+                listing_semaphore=self._listing_semaphore,
+                limiter=self._host_limiter,
+                max_workers=self.config.download_workers,
+                full_resync=full_resync,
+                scheduler=self._schedulers[source.channel],
+                priority=self.config.priority,
+                wait_for_reset=self.config.wait_for_quota_reset,
+                transcode_executor=self._transcode_executor,
+                cache=self._cache,
+                throttle=self._throttle,
+                templates=channel.compiled_templates,
+                cancel_uploads=self._cancel_uploads,
+                on_queue_depth=on_queue_depth,
+            )
+            status.last_success = time.time()
+            status.last_error = None
+        except Exception as e:
+            logging.exception("Sync for @%s failed: %s", source.tiktok_username, e)
+            status.last_error = str(e)
+        finally:
+            self._running_stop_events.discard(stop_uploads)
+            status.syncing = False
+            status.queue_depth = 0
+            status.last_sync_finished = time.time()
+            status.next_sync = status.last_sync_finished + self._delay(status.poll_interval)
+            if _source_key(source) not in self._sources:
+                self.accounts.pop(_source_key(source), None)
+            metrics.write_metrics()
+
+    def _start_due_syncs(self) -> None:
+        if self._pending_limits is not None:
+            if self._tasks:
+                return
+            self._cache, self._throttle = self._pending_limits
+            self._pending_limits = None
+        now = time.time()
+        for key, status in self.accounts.items():
+            if key in self._tasks or key not in self._sources or status.next_sync > now:
+                continue
+            task = asyncio.create_task(self._sync(self._sources[key], status))
+            self._tasks[key] = task
+            task.add_done_callback(lambda _, key=key: self._tasks.pop(key, None))
+
+    def _seconds_until_next_sync(self) -> float:
+        idle = [s.next_sync for k, s in self.accounts.items() if k not in self._tasks and k in self._sources]
+        if not idle:
+            return CONFIG_CHECK_INTERVAL
+        return max(0.0, min(CONFIG_CHECK_INTERVAL, min(idle) - time.time()))
+
+    def request_stop(self) -> None:
+        """Stops starting new work; in-flight uploads stop after their current chunk."""
+        if self._stop is None or self._stop.is_set():
+            return
+        logging.info("Stopping: waiting for in-flight downloads and upload chunks to finish.")
+        self._stop.set()
+        self._cancel_uploads.set()
+        for event in self._running_stop_events:
+            event.set()
+
+    def request_reload(self) -> None:
+        self._reload_requested = True
+
+    async def run(self, install_signal_handlers: bool = True) -> None:
+        loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        handled = []
+        if install_signal_handlers:
+            for sig, handler in ((signal.SIGTERM, self.request_stop), (signal.SIGINT, self.request_stop),
+                                 (signal.SIGHUP, self.request_reload)):
+                loop.add_signal_handler(sig, handler)
+                handled.append(sig)
+
+        config = self.config
+        self._download_slots = FairLimiter(config.download_workers)
+        self._upload_slots = FairLimiter(config.upload_workers)
+        self._listing_semaphore = asyncio.Semaphore(config.listing_concurrency)
+        self._host_limiter = HostRateLimiter(DEFAULT_REQUESTS_PER_SECOND)
+        server = (
+            self._start_status_server(config.status_host, config.status_port)
+            if config.status_port is not None else None
+        )
+        transcode_executor = ProcessPoolExecutor(config.transcode_workers) if config.transcode else None
+        logging.info("Daemon started with %d sources.", len(self.accounts))
+        try:
+            with ProcessPoolExecutor(max_workers=config.download_workers) as executor, \
+                    (transcode_executor or contextlib.nullcontext()):
+                self._executor = executor
+                self._transcode_executor = transcode_executor
+                while not self._stop.is_set():
+                    self._check_config()
+                    self._start_due_syncs()
+                    with contextlib.suppress(asyncio.TimeoutError):
+                        await asyncio.wait_for(self._stop.wait(), self._seconds_until_next_sync())
+                if self._tasks:
+                    await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+        finally:
+            if server is not None:
+                server.shutdown()
+                server.server_close()
+            for sig in handled:
+                loop.remove_signal_handler(sig)
+        logging.info("Daemon stopped.")
+
+    # -- status endpoint ------------------------------------------------------
+
+    def status(self) -> Dict:
+        return {
+            "status": "stopping" if self._stop is not None and self._stop.is_set() else "running",
+            "started_at": self.started_at,
+            "config_loaded_at": self.config_loaded_at,
+            "accounts": [asdict(status) for status in list(self.accounts.values())],
+        }
+
+    def _start_status_server(self, host: str, port: int) -> ThreadingHTTPServer:
+        daemon = self
+
+        class StatusHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path not in ("/health", "/status"):
+                    self.send_error(404)
+                    return
+                status = daemon.status()
+                body = json.dumps(status).encode()
+                self.send_response(200 if status["status"] == "running" else 503)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), StatusHandler)
+        server.daemon_threads = True
+        self.status_address = server.server_address
+        threading.Thread(target=server.serve_forever, name="status-server", daemon=True).start()
+        logging.info("Status endpoint listening on %s:%d.", *self.status_address[:2])
+        return server
@@ -0,0 +1,232 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+from typing import Dict, List, Optional, Tuple
+
+import metrics
+from fingerprint import content_hash
+from state_store import StateStore
+from transcoder import PROCESSED_DIR_NAME
+
+
+# Size assumed for a download that hasn't finished yet, until real files
+# give an average to go by.
+DEFAULT_DOWNLOAD_ESTIMATE = 16 * 1024 * 1024
+DEFAULT_POLL_INTERVAL = 5.0
+# How long reserve() waits for something to become evictable before giving up.
+DEFAULT_MAX_WAIT = 10 * 60
+
+
+def _mp4_sizes(directory: str) -> Tuple[int, int]:
+    """Returns (count, total size) of the mp4 files directly in `directory`."""
+    count = total = 0
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.endswith(".mp4"):
+                    count += 1
+                    total += entry.stat().st_size
+    except FileNotFoundError:
+        pass
+    return count, total
+
+
+class DiskCache:
+    """
+    Keeps the videos in one or more download dirs under a byte budget.
+
+    Downloads reserve room before they start. When the budget is full, files
+    whose upload is confirmed (uploaded, or skipped as a duplicate) are
+    evicted, oldest upload first, together with their transcoded copies.
+    Videos still waiting for upload are never evicted; if nothing can be
+    evicted, `reserve()` waits for uploads to finish (`wait_for_uploads`, at
+    most `max_wait` seconds) or reports that there is no room.
+
+    Evicted videos are recorded in the state store, so the downloader knows
+    not to fetch them again. Victims are picked under a lock, so concurrent
+    downloads never pick the same one; hashing and deleting them is not.
+    """
+
+    def __init__(
+        self,
+        areas: List[Tuple[str, StateStore]],
+        budget_bytes: int,
+        wait_for_uploads: bool = True,
+        poll_interval: float = DEFAULT_POLL_INTERVAL,
+        max_wait: float = DEFAULT_MAX_WAIT,
+    ):
+        self.areas = list(areas)
+        self.budget_bytes = budget_bytes
+        self.wait_for_uploads = wait_for_uploads
+        self.poll_interval = poll_interval
+        self.max_wait = max_wait
+        self._reserved = 0
+        self._files = 0
+        self._used = 0
+        # Videos being evicted and their bytes, not yet deleted.
+        self._evicting = set()
+        self._freeing = 0
+        # Guards the counters above, which eviction threads and commit() both update.
+        self._lock = threading.Lock()
+        self.refresh()
+
+    @classmethod
+    def for_download_dir(cls, download_dir: str, store: StateStore, budget_bytes: int, **kwargs) -> "DiskCache":
+        return cls([(download_dir, store)], budget_bytes, **kwargs)
+
+    def refresh(self) -> int:
+        """Rescans the download dirs; returns the bytes in use."""
+        files = used = 0
+        for download_dir, _ in self.areas:
+            for directory in (download_dir, os.path.join(download_dir, PROCESSED_DIR_NAME)):
+                count, size = _mp4_sizes(directory)
+                files += count
+                used += size
+        with self._lock:
+            self._files, self._used = files, used
+        metrics.set_gauge("disk_cache_used_bytes", used)
+        return used
+
+    @property
+    def used(self) -> int:
+        return self._used
+
+    def _estimate(self) -> int:
+        if self._files:
+            return max(1, self._used // self._files)
+        return DEFAULT_DOWNLOAD_ESTIMATE
+
+    def _fits(self, size: int) -> bool:
+        # Bytes of victims being deleted right now already count as free.
+        return self._used - self._freeing + self._reserved + size <= self.budget_bytes
+
+    def evict(self, needed: int) -> int:
+        """Evicts confirmed uploads, oldest first, until `needed` more bytes fit. Returns bytes freed."""
+        with self._lock:
+            victims = self._pick_victims(needed)
+        return self._evict_all(victims)
+
+    def _pick_victims(self, needed: int) -> List[Tuple[Dict, str, StateStore, List[str], int]]:
+        """
+        Chooses the videos to evict so `needed` more bytes fit and books their
+        bytes as being freed. Runs under the lock; the slow part, hashing and
+        deleting, happens in _evict_all() outside it.
+        """
+        candidates = []
+        for download_dir, store in self.areas:
+            candidates += [
+                (row, download_dir, store) for row in store.eviction_candidates()
+                if row["video_id"] not in self._evicting
+            ]
+        candidates.sort(key=lambda item: item[0]["uploaded_at"] or 0)
+
+        victims = []
+        for row, download_dir, store in candidates:
+            if self._fits(needed):
+                break
+            paths = [os.path.join(download_dir, row["filename"])]
+            processed = store.transcode_output_for(row["video_id"])
+            if processed:
+                paths.append(os.path.join(download_dir, processed))
+            size = sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+            self._evicting.add(row["video_id"])
+            self._freeing += size
+            victims.append((row, download_dir, store, paths, size))
+        return victims
+
+    def _evict_all(self, victims) -> int:
+        freed = 0
+        for row, download_dir, store, paths, booked in victims:
+            removed, files = 0, 0
+            try:
+                removed, files = self._evict_video(row, store, paths)
+            finally:
+                with self._lock:
+                    self._evicting.discard(row["video_id"])
+                    self._freeing -= booked
+                    self._used = max(0, self._used - removed)
+                    self._files = max(0, self._files - files)
+            freed += removed
+        if freed:
+            metrics.inc("disk_cache_evicted_bytes_total", freed)
+            metrics.set_gauge("disk_cache_used_bytes", self._used)
+        return freed
+
+    def _claim(self, size: int) -> bool:
+        """
+        Picks victims and books `size` bytes in one locked step, so the room
+        freed for one download isn't counted again by another, then evicts
+        the victims. Returns whether the download fit.
+        """
+        with self._lock:
+            victims = [] if self._fits(size) else self._pick_victims(size)
+            fits = self._fits(size) or (self._used == 0 and self._reserved == 0)
+            if fits:
+                self._reserved += size
+        self._evict_all(victims)
+        return fits
+
+    def _evict_video(self, row, store: StateStore, paths: List[str]) -> Tuple[int, int]:
+        """Deletes a video's files; returns (bytes, files) removed."""
+        try:
+            # Keep the full hash so later copies of this video are still
+            # recognized as duplicates once the file is gone.
+            content_hash(store, row["video_id"], paths[0])
+        except FileNotFoundError:
+            # The file vanished (e.g. deleted by hand): it counts as evicted.
+            pass
+        freed = files = 0
+        for victim in paths:
+            try:
+                size = os.path.getsize(victim)
+                os.remove(victim)
+            except FileNotFoundError:
+                continue
+            freed += size
+            files += 1
+        store.mark_evicted(row["video_id"])
+        logging.info("Evicted uploaded video %s from the download cache (%d bytes).", row["video_id"], freed)
+        return freed, files
+
+    async def reserve(self, stop_event: Optional[asyncio.Event] = None) -> Optional[int]:
+        """
+        Reserves room for one download, evicting or waiting as needed.
+        Returns the reservation to pass to `commit`, or None if there is no
+        room (not waiting, `stop_event` was set, or nothing became evictable
+        within `max_wait` seconds, e.g. because every cached video's upload
+        keeps failing).
+        """
+        size = self._estimate()
+        waiting_since = None
+        while True:
+            if await asyncio.to_thread(self._claim, size):
+                return size
+            if not self.wait_for_uploads or (stop_event is not None and stop_event.is_set()):
+                return None
+            if waiting_since is None:
+                logging.info(
+                    "Download cache full (%d of %d bytes); waiting for uploads before downloading more.",
+                    self._used, self.budget_bytes,
+                )
+                metrics.inc("disk_cache_waits_total")
+                waiting_since = time.monotonic()
+            elif time.monotonic() - waiting_since >= self.max_wait:
+                logging.warning(
+                    "Download cache still full after %.0fs with nothing to evict; skipping downloads for now.",
+                    self.max_wait,
+                )
+                metrics.inc("disk_cache_wait_timeouts_total")
+                return None
+            await asyncio.sleep(self.poll_interval)
+
+    def commit(self, reservation: int, path: Optional[str]) -> None:
+        """Replaces a reservation with the size of the file it was for (None if the download failed)."""
+        size = os.path.getsize(path) if path is not None and os.path.exists(path) else None
+        with self._lock:
+            self._reserved -= reservation
+            if size is not None:
+                self._used += size
+                self._files += 1
+        metrics.set_gauge("disk_cache_used_bytes", self._used)
@@ -0,0 +1,96 @@
+import os
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from state_store import StateStore
+
+
+# The partial hash covers the file size plus this many bytes from each end of
+# the file. mp4 keeps its index (moov box) at one end or the other, so
+# re-encodes with equal size still differ here.
+PARTIAL_HASH_BYTES = 1024 * 1024
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def _hasher():
+    return hashlib.blake2b(digest_size=32)
+
+
+def partial_hash(path: str) -> Tuple[int, str]:
+    """Returns (size, hash of the size and the first and last PARTIAL_HASH_BYTES)."""
+    digest = _hasher()
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        digest.update(str(size).encode())
+        digest.update(f.read(PARTIAL_HASH_BYTES))
+        if size > PARTIAL_HASH_BYTES:
+            f.seek(max(PARTIAL_HASH_BYTES, size - PARTIAL_HASH_BYTES))
+            digest.update(f.read(PARTIAL_HASH_BYTES))
+    return size, digest.hexdigest()
+
+
+def full_hash(path: str) -> str:
+    """Streams the whole file through the hash, HASH_CHUNK_SIZE bytes at a time."""
+    digest = _hasher()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def fingerprint_video(store: StateStore, video_id: str, video_path: str) -> Dict:
+    """
+    Records the partial fingerprint of a downloaded video, reusing the stored
+    one while the file's size and mtime are unchanged.
+    """
+    stat = os.stat(video_path)
+    known = store.get_fingerprint(video_id)
+    if known and known["file_size"] == stat.st_size and known["file_mtime"] == stat.st_mtime:
+        return known
+    size, partial = partial_hash(video_path)
+    store.save_fingerprint(video_id, size, stat.st_mtime, partial)
+    return store.get_fingerprint(video_id)
+
+
+def _ensure_full_hash(store: StateStore, row: Dict, video_path: str) -> Optional[str]:
+    if row["full_hash"]:
+        return row["full_hash"]
+    if not video_path or not os.path.exists(video_path):
+        return None
+    digest = full_hash(video_path)
+    store.set_full_hash(row["video_id"], digest)
+    return digest
+
+
+def content_hash(store: StateStore, video_id: str, video_path: str) -> str:
+    """Full content hash of a downloaded video, computed once and kept in the store."""
+    return _ensure_full_hash(store, fingerprint_video(store, video_id, video_path), video_path)
+
+
+def find_uploaded_duplicate(store: StateStore, download_dir: str, video_id: str, video_path: str) -> Optional[Dict]:
+    """
+    Looks for an already uploaded video with the same content as video_path.
+
+    Only candidates whose size and partial hash match are compared by full
+    hash, which is computed once per file and stored. A candidate whose file
+    is gone and was never fully hashed cannot be confirmed and is ignored.
+    Returns the matching video's state store row, or None.
+    """
+    fingerprint = fingerprint_video(store, video_id, video_path)
+    candidates = store.uploaded_with_fingerprint(
+        fingerprint["file_size"], fingerprint["partial_hash"], exclude_video_id=video_id
+    )
+    if not candidates:
+        return None
+
+    own_hash = _ensure_full_hash(store, fingerprint, video_path)
+    for candidate in candidates:
+        candidate_path = os.path.join(download_dir, candidate["filename"]) if candidate["filename"] else None
+        if _ensure_full_hash(store, candidate, candidate_path) == own_hash:
+            logging.info(
+                "TikTok %s has the same content as %s, already on YouTube as %s.",
+                video_id, candidate["video_id"], candidate["youtube_id"],
+            )
+            return candidate
+    return None
@@ -1,12 +1,155 @@
+import sys
+import copy
+import json
+import queue
+import atexit
 import logging
+import contextvars
+from contextlib import contextmanager
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler, TimedRotatingFileHandler
+from typing import Optional
 
-def setup_logger():
-    """Configure logging settings."""
-    logging.basicConfig(
-        level=logging.INFO,
-        format="%(asctime)s - %(levelname)s - %(message)s",
-        handlers=[
-            logging.FileHandler("tiktok_to_youtube.log"),
-            logging.StreamHandler()
-        ]
-    )
+LOG_FILE = "tiktok_to_youtube.log"
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+LOG_MAX_BYTES = 10 * 1024 * 1024
+LOG_BACKUP_COUNT = 5
+
+# Per-task/thread fields (e.g. video_id, account) attached to every record.
+_log_context = contextvars.ContextVar("log_context", default={})
+
+_installed_handlers = []
+_listener: Optional[QueueListener] = None
+
+
+@contextmanager
+def log_context(**fields):
+    """Adds fields such as video_id or account to records logged inside the block."""
+    token = _log_context.set({**_log_context.get(), **fields})
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """
+    Copies the current log_context onto each record. It runs where the record
+    is created, so in queued mode it still sees the caller's context.
+    """
+
+    def filter(self, record):
+        context = _log_context.get()
+        record.context = context
+        for key, value in context.items():
+            if not hasattr(record, key):
+                setattr(record, key, value)
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line, including any log_context fields."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        entry.update(getattr(record, "context", None) or {})
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class _QueueHandler(QueueHandler):
+    """
+    QueueHandler that keeps the traceback apart from the message.
+
+    The stock prepare() folds the traceback into `message` and drops
+    exc_info/exc_text, so JsonFormatter on the listener side could never
+    fill in its "exception" field. Here the traceback travels as exc_text
+    (exc_info can't be pickled), which every formatter picks up.
+    """
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+        record.message = record.msg = record.getMessage()
+        record.args = None
+        record.exc_info = None
+        return record
+
+
+def _file_handler(log_file, max_bytes, backup_count, rotate_when):
+    if rotate_when:
+        return TimedRotatingFileHandler(log_file, when=rotate_when, backupCount=backup_count, encoding="utf-8")
+    return RotatingFileHandler(log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8")
+
+
+def setup_logger(
+    log_file: str = LOG_FILE,
+    level: int = logging.INFO,
+    json_lines: bool = False,
+    queued: bool = False,
+    max_bytes: int = LOG_MAX_BYTES,
+    backup_count: int = LOG_BACKUP_COUNT,
+    rotate_when: Optional[str] = None,
+) -> Optional[QueueListener]:
+    """
+    Configure logging settings.
+
+    Logs go to stdout and to `log_file`, which rotates at `max_bytes` or, with
+    `rotate_when` (e.g. "midnight"), on a schedule, keeping `backup_count` old
+    files. `json_lines` writes the file as JSON lines carrying log_context
+    fields. With `queued`, callers only put records on an in-memory queue and
+    a background QueueListener does the formatting and I/O; the listener is
+    returned and is stopped (flushing the queue) at exit or by
+    shutdown_logger(). Calling it again replaces the previous configuration.
+    """
+    global _listener
+    shutdown_logger()
+    root = logging.getLogger()
+    for handler in _installed_handlers:
+        root.removeHandler(handler)
+        handler.close()
+    _installed_handlers.clear()
+
+    file_handler = _file_handler(log_file, max_bytes, backup_count, rotate_when)
+    file_handler.setFormatter(JsonFormatter() if json_lines else logging.Formatter(LOG_FORMAT))
+    stream_handler = logging.StreamHandler(sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    handlers = [file_handler, stream_handler]
+
+    context_filter = ContextFilter()
+    if queued:
+        queue_handler = _QueueHandler(queue.SimpleQueue())
+        queue_handler.addFilter(context_filter)
+        _listener = QueueListener(queue_handler.queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        handlers = [queue_handler]
+    else:
+        for handler in handlers:
+            handler.addFilter(context_filter)
+
+    for handler in handlers:
+        root.addHandler(handler)
+        _installed_handlers.append(handler)
+    root.setLevel(level)
+    return _listener
+
+
+def shutdown_logger() -> None:
+    """Stops the queue listener, if any, after it has written every queued record."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        for handler in _listener.handlers:
+            handler.close()
+        _listener = None
+
+
+atexit.register(shutdown_logger)
@@ -1,14 +1,312 @@
-from tiktok_downloader import download_tiktok_clips
-from youtube_uploader import process_and_upload_clips
+import os
+import sys
+import json
+import asyncio
+import logging
+import argparse
+import contextlib
+from datetime import datetime
+
+# Only light modules are imported here. Each command imports the stages it
+# runs (pyktok, the Google API client, ...) itself, so e.g. `status` never
+# loads a network client.
 from logger import setup_logger
+import metrics
 
-if __name__ == "__main__":
-    setup_logger()
+TIKTOK_USERNAME = "your_tiktok_username"  # Replace with your TikTok username
+DOWNLOAD_DIR = "./tiktok_downloads"
+PIPELINED = True  # Upload while downloading; set to False to run the stages one after another
+UPLOAD_WORKERS = 2  # Uploads running at once
+UPLOAD_BANDWIDTH_BYTES = None  # e.g. 5 * 1024**2 to cap uploads at 5 MiB/s in total
+UPLOAD_BANDWIDTH_HOURS = None  # e.g. (9, 18) to only apply the cap during business hours
+UPLOAD_ORDER = "shortest_first"  # Backlog order of the `upload` command: priority, shortest_first or interleaved
+METADATA_TEMPLATES = {}  # e.g. {"title": "{caption}", "tags": ["Shorts", "{hashtags}"]}, see metadata_templates.py
+CONFIG_FILE = "config.json"  # Multi-account config; when present it replaces the settings above
+TRANSCODE = False  # Remux/transcode videos with ffmpeg where needed to meet YouTube Shorts limits
+CACHE_BUDGET_BYTES = None  # e.g. 20 * 1024**3 to keep DOWNLOAD_DIR under 20 GiB by evicting uploaded videos
+LOG_JSON = False  # Write tiktok_to_youtube.log as JSON lines with video_id/account fields
+METRICS_ENABLED = False  # Write Prometheus metrics to METRICS_FILE and JSON trace spans to TRACE_FILE
+METRICS_FILE = metrics.DEFAULT_METRICS_FILE
+TRACE_FILE = metrics.DEFAULT_TRACE_FILE
+
+DEFAULT_COMMAND = "sync"
+# The project modules each command imports; `python benchmark.py --startup`
+# times loading them in a fresh interpreter.
+COMMAND_MODULES = {
+    "sync": ("orchestrator", "pipeline", "daemon"),
+    "download": ("orchestrator", "tiktok_downloader"),
+    "upload": ("orchestrator", "upload_executor"),
+    "status": ("orchestrator", "quota", "tiktok_throttle"),
+    "reconcile": ("orchestrator", "auth", "youtube_metadata"),
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Mirror TikTok videos to YouTube Shorts.")
+    commands = parser.add_subparsers(dest="command", metavar="command")
+
+    sync = commands.add_parser("sync", help="Download new videos and upload them (the default).")
+    download = commands.add_parser("download", help="Only download new videos.")
+    for command in (sync, download):
+        command.add_argument(
+            "--full-resync",
+            action="store_true",
+            help="List every account's whole feed instead of only videos newer than the last sync.",
+        )
+    sync.add_argument(
+        "--daemon",
+        action="store_true",
+        help=f"Stay running and sync every source in {CONFIG_FILE} on its poll interval.",
+    )
+    commands.add_parser("upload", help="Only upload videos that are already downloaded.")
+    status = commands.add_parser("status", help="Show what the local state stores know; no network access.")
+    status.add_argument("--json", action="store_true", help="Print the status as JSON.")
+    reconcile = commands.add_parser("reconcile", help="Check that recorded uploads still exist on YouTube.")
+    reconcile.add_argument(
+        "--requeue-missing",
+        action="store_true",
+        help="Queue videos YouTube no longer has for upload again instead of only marking them missing.",
+    )
+    reconcile.add_argument(
+        "--update-metadata",
+        action="store_true",
+        help="Re-render every upload's title, description and tags and update the ones that changed.",
+    )
+
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # `main.py [--full-resync]` keeps working as `main.py sync [--full-resync]`.
+    if not argv or (argv[0] not in COMMAND_MODULES and argv[0] not in ("-h", "--help")):
+        argv = [DEFAULT_COMMAND] + argv
+    return parser.parse_args(argv)
+
+
+def _load_config():
+    if not os.path.exists(CONFIG_FILE):
+        return None
+    from orchestrator import load_config
+    return load_config(CONFIG_FILE)
+
+
+def _store(download_dir):
+    from state_store import StateStore
+    os.makedirs(download_dir, exist_ok=True)
+    return StateStore.for_download_dir(download_dir)
+
+
+def _transcode_executor(enabled, workers=None):
+    if not enabled:
+        return contextlib.nullcontext()
+    from concurrent.futures import ProcessPoolExecutor
+    from transcoder import DEFAULT_TRANSCODE_WORKERS
+    return ProcessPoolExecutor(max_workers=workers or DEFAULT_TRANSCODE_WORKERS)
+
+
+def _throttle():
+    if UPLOAD_BANDWIDTH_BYTES is None:
+        return None
+    from bandwidth import BandwidthLimiter
+    return BandwidthLimiter(UPLOAD_BANDWIDTH_BYTES, hours=UPLOAD_BANDWIDTH_HOURS)
+
+
+def _templates():
+    from metadata_templates import MetadataTemplates
+    return MetadataTemplates.from_config(METADATA_TEMPLATES)
+
+
+def _disk_cache(store, wait_for_uploads: bool):
+    if CACHE_BUDGET_BYTES is None:
+        return None
+    from disk_cache import DiskCache
+    return DiskCache.for_download_dir(DOWNLOAD_DIR, store, CACHE_BUDGET_BYTES, wait_for_uploads=wait_for_uploads)
+
+
+async def sync(args):
+    config = _load_config()
+    if args.daemon:
+        if config is None:
+            logging.error("Daemon mode needs a multi-account config in %s.", CONFIG_FILE)
+            return
+        from daemon import SyncDaemon
+        await SyncDaemon(CONFIG_FILE, full_resync=args.full_resync).run()
+    elif config is not None:
+        from orchestrator import run_orchestrator
+        await run_orchestrator(config, full_resync=args.full_resync)
+    elif PIPELINED:
+        from pipeline import run_pipeline
+        store = _store(DOWNLOAD_DIR)
+        with _transcode_executor(TRANSCODE) as transcode_executor:
+            await run_pipeline(
+                TIKTOK_USERNAME, DOWNLOAD_DIR, upload_workers=UPLOAD_WORKERS, store=store,
+                full_resync=args.full_resync, transcode_executor=transcode_executor,
+                cache=_disk_cache(store, wait_for_uploads=True), throttle=_throttle(), templates=_templates(),
+            )
+    else:
+        await download(args)
+        await upload(args)
+
+
+async def download(args):
+    from tiktok_downloader import download_tiktok_clips
+
+    config = _load_config()
+    if config is None:
+        # Nothing uploads while this stage runs, so a full cache ends it
+        # early; the rest is downloaded on a later run.
+        store = _store(DOWNLOAD_DIR)
+        await download_tiktok_clips(
+            TIKTOK_USERNAME, DOWNLOAD_DIR, store=store, full_resync=args.full_resync,
+            cache=_disk_cache(store, wait_for_uploads=False),
+        )
+        return
+
+    from orchestrator import build_disk_cache
+    stores = {name: _store(channel.download_dir) for name, channel in config.channels.items()}
+    cache = build_disk_cache(config, stores, wait_for_uploads=False)
+    for source in config.sources:
+        await download_tiktok_clips(
+            source.tiktok_username, config.channels[source.channel].download_dir,
+            max_workers=config.download_workers, store=stores[source.channel],
+            full_resync=args.full_resync, cache=cache,
+        )
+
+
+async def upload(args):
+    config = _load_config()
+    if config is None:
+        from youtube_uploader import process_and_upload_clips
+        with _transcode_executor(TRANSCODE) as transcode_executor:
+            await asyncio.to_thread(
+                process_and_upload_clips, DOWNLOAD_DIR, transcode_executor=transcode_executor,
+                workers=UPLOAD_WORKERS, throttle=_throttle(), order=UPLOAD_ORDER, templates=_templates(),
+            )
+        return
+
+    # One executor for every channel, so the workers are shared between them.
+    from orchestrator import build_bandwidth_limiter, channel_schedulers, channel_service_factory
+    from upload_executor import UploadExecutor, channel_jobs
+    schedulers = channel_schedulers(config, _store(config.download_dir))
+    jobs = []
+    for name, channel in config.channels.items():
+        store = _store(channel.download_dir)
+        store.import_csv_history(channel.download_dir)
+        jobs += channel_jobs(
+            name, channel.download_dir, store, schedulers[name], channel_service_factory(channel), config.priority,
+            channel.compiled_templates,
+        )
+    with _transcode_executor(config.transcode, config.transcode_workers) as transcode_executor:
+        executor = UploadExecutor(
+            config.upload_workers,
+            throttle=build_bandwidth_limiter(config),
+            order=config.upload_order,
+            wait_for_reset=config.wait_for_quota_reset,
+            transcode_executor=transcode_executor,
+        )
+        await asyncio.to_thread(executor.run, jobs)
+
+
+def collect_status():
+    """Summaries of every local state store and today's quota use, read without any network client."""
+    from quota import DEFAULT_DAILY_BUDGET, QuotaScheduler
+    from state_store import STATE_DB_FILE
+    from tiktok_throttle import saved_states
+
+    config = _load_config()
+    if config is None:
+        dirs = {"default": DOWNLOAD_DIR}
+        quota_dir, budgets = DOWNLOAD_DIR, {"default": DEFAULT_DAILY_BUDGET}
+    else:
+        dirs = {name: channel.download_dir for name, channel in config.channels.items()}
+        quota_dir = config.download_dir
+        budgets = {channel.project: channel.daily_quota for channel in config.channels.values()}
+
+    report = {"channels": {}, "quota": {}}
+    for name, download_dir in dirs.items():
+        # Reading must not create anything, so dirs without a store are skipped.
+        if os.path.exists(os.path.join(download_dir, STATE_DB_FILE)):
+            store = _store(download_dir)
+            report["channels"][name] = dict(store.summary(), download_dir=download_dir, tiktok=saved_states(store))
+    if os.path.exists(os.path.join(quota_dir, STATE_DB_FILE)):
+        quota_store = _store(quota_dir)
+        for project, budget in budgets.items():
+            report["quota"][project] = {"used": QuotaScheduler(quota_store, project, budget).used(), "budget": budget}
+    return report
+
+
+def _when(timestamp):
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M") if timestamp else "never"
+
+
+def format_status(report) -> str:
+    lines = []
+    if not report["channels"]:
+        lines.append("No state stores found; nothing has been synced yet.")
+    for name, channel in report["channels"].items():
+        lines.append(
+            f"{name} ({channel['download_dir']}): {channel['videos']} videos, "
+            f"{channel['pending_uploads']} waiting for upload, last upload {_when(channel['last_upload_at'])}"
+        )
+        for label, counts in (("downloads", channel["download_status"]), ("uploads", channel["upload_status"])):
+            lines.append(f"  {label}: " + (", ".join(f"{key} {n}" for key, n in sorted(counts.items())) or "none"))
+        for account, mark in channel["sync_marks"].items():
+            lines.append(f"  @{account} synced up to {mark['newest_video_id']} ({_when(mark['updated_at'])})")
+        for account, throttle in channel["tiktok"].items():
+            if throttle["state"] != "closed":
+                lines.append(f"  @{account} TikTok requests paused until {_when(throttle['open_until'])}")
+    for project, usage in report["quota"].items():
+        lines.append(f"Quota {project}: {usage['used']} of {usage['budget']} units used today")
+    return "\n".join(lines)
+
+
+async def status(args):
+    report = collect_status()
+    print(json.dumps(report, indent=2) if args.json else format_status(report))
+
+
+async def reconcile(args):
+    from auth import get_authenticated_service
+    from quota import QuotaScheduler
+    from youtube_metadata import reconcile_uploads
+
+    config = _load_config()
+    if config is None:
+        store = _store(DOWNLOAD_DIR)
+        youtube = await asyncio.to_thread(get_authenticated_service)
+        await asyncio.to_thread(
+            reconcile_uploads, youtube, store, QuotaScheduler(store), requeue_missing=args.requeue_missing,
+            templates=_templates() if args.update_metadata else None,
+        )
+        return
+
+    from orchestrator import channel_schedulers, channel_service_factory
+    schedulers = channel_schedulers(config, _store(config.download_dir))
+    for name, channel in config.channels.items():
+        youtube = await asyncio.to_thread(channel_service_factory(channel))
+        await asyncio.to_thread(
+            reconcile_uploads, youtube, _store(channel.download_dir), schedulers[name],
+            requeue_missing=args.requeue_missing,
+            templates=channel.compiled_templates if args.update_metadata else None,
+        )
+
+
+COMMANDS = {"sync": sync, "download": download, "upload": upload, "status": status, "reconcile": reconcile}
+
+
+async def main(args):
     try:
-        TIKTOK_USERNAME = "your_tiktok_username"  # Replace with your TikTok username
-        DOWNLOAD_DIR = "./tiktok_downloads"
-        download_tiktok_clips(TIKTOK_USERNAME, DOWNLOAD_DIR)
-        process_and_upload_clips(DOWNLOAD_DIR)
+        await COMMANDS[args.command](args)
     except Exception as e:
-        import logging
         logging.error(f"An unexpected error occurred in the process: {e}")
+    finally:
+        metrics.write_metrics()
+
+
+def cli(argv=None):
+    args = parse_args(argv)
+    # Queued: workers only enqueue log records; a background thread writes them.
+    setup_logger(json_lines=LOG_JSON, queued=True)
+    metrics.configure(METRICS_ENABLED, METRICS_FILE, TRACE_FILE)
+    asyncio.run(main(args))
+
+
+if __name__ == "__main__":
+    cli()
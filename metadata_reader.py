@@ -0,0 +1,139 @@
+import io
+import csv
+import logging
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+
+METADATA_FILE = "metadata.csv"
+
+# The metadata.csv columns the pipeline uses, each with the names pyktok
+# versions have given it. The first name is the one the state store expects.
+COLUMN_ALIASES = {
+    "video_id": ("video_id", "id"),
+    "author_username": ("author_username", "author_unique_id", "author_uniqueid"),
+    "video_description": ("video_description", "video_desc", "desc"),
+    "video_timestamp": ("video_timestamp", "video_create_time", "create_time"),
+    "video_playcount": ("video_playcount", "video_play_count", "play_count"),
+}
+
+_CANONICAL = {alias: column for column, aliases in COLUMN_ALIASES.items() for alias in aliases}
+
+
+def _canonical(name: str) -> str:
+    name = name.strip().lower()
+    return _CANONICAL.get(name, name)
+
+
+def column_indexes(header: Sequence[str]) -> Dict[str, int]:
+    """Positions of the COLUMN_ALIASES columns in `header`, whatever they are called there."""
+    indexes = {}
+    for i, name in enumerate(header):
+        column = _canonical(name)
+        if column in COLUMN_ALIASES and column not in indexes:
+            indexes[column] = i
+    return indexes
+
+
+def project(indexes: Dict[str, int], row: Sequence[str]) -> Dict[str, str]:
+    """Only the used columns of a csv row, keyed by their canonical names."""
+    return {column: row[i] for column, i in indexes.items() if i < len(row)}
+
+
+def remap_row(target_header: Sequence[str], source_header: Sequence[str], row: Sequence[str]) -> List[str]:
+    """
+    Reorders a row written under `source_header` to fit `target_header`,
+    matching columns by name or alias. Columns the target lacks are dropped
+    and ones the source lacks are left empty.
+    """
+    by_column = {_canonical(name): i for i, name in enumerate(source_header)}
+    out = []
+    for name in target_header:
+        i = by_column.get(_canonical(name))
+        out.append(row[i] if i is not None and i < len(row) else "")
+    return out
+
+
+def _complete_lines(f, consumed: List[int]) -> Iterator[str]:
+    # A trailing line without a newline may still be being written; it is
+    # left for the next read.
+    for raw in f:
+        if not raw.endswith(b"\n"):
+            return
+        consumed[0] += len(raw)
+        yield raw.decode("utf-8")
+
+
+def _line_number(f, position: int) -> int:
+    """1-based number of the line starting at byte `position` of `f`."""
+    f.seek(0)
+    count, remaining = 1, position
+    while remaining > 0:
+        chunk = f.read(min(remaining, 1 << 20))
+        if not chunk:
+            break
+        count += chunk.count(b"\n")
+        remaining -= len(chunk)
+    return count
+
+
+def read_header(path: str) -> Optional[List[str]]:
+    with open(path, "rb") as f:
+        line = f.readline()
+    if not line.endswith(b"\n"):
+        return None
+    return next(csv.reader(io.StringIO(line.decode("utf-8"))), None)
+
+
+def read_new_rows(
+    path: str, offset: int = 0, header: Optional[Sequence[str]] = None
+) -> Tuple[List[Dict[str, str]], int, Optional[List[str]]]:
+    """
+    Reads the rows appended to a metadata csv since byte `offset`, projected
+    onto COLUMN_ALIASES. `header` is the header seen when `offset` was
+    recorded; if the file was truncated or replaced (different header, or
+    smaller than `offset`) it is read from the start.
+
+    Returns (rows, offset, header) to pass back in on the next call. Only
+    complete rows are consumed. A malformed row is logged and skipped (its
+    first line), so the rows after it are still read.
+    """
+    current = read_header(path)
+    if current is None:
+        return [], 0, None
+    with open(path, "rb") as f:
+        size = f.seek(0, io.SEEK_END)
+        if offset <= 0 or header is None or list(header) != current or size < offset:
+            if offset > 0:
+                logging.info("%s was replaced or truncated; reading it from the start.", path)
+            offset = 0
+        rows = []
+        indexes = column_indexes(current)
+        position = offset
+        while True:
+            f.seek(position)
+            consumed = [position]
+            lines = _complete_lines(f, consumed)
+            # strict: a quoted field cut off at the end raises instead of coming
+            # back as a truncated row.
+            reader = csv.reader(lines, strict=True)
+            try:
+                for row in reader:
+                    if position == 0:
+                        position = consumed[0]
+                        continue
+                    position = consumed[0]
+                    if row:
+                        rows.append(project(indexes, row))
+                break
+            except csv.Error as e:
+                if next(lines, None) is None:
+                    # A quoted field still being written at the end of the file.
+                    break
+                line_number = _line_number(f, position)
+                f.seek(position)
+                skipped = f.readline()
+                logging.warning(
+                    "Skipping malformed row at byte %d (line %d) of %s: %s", position, line_number, path, e
+                )
+                position += len(skipped)
+    return rows, position, current
@@ -0,0 +1,232 @@
+import re
+import string
+import unicodedata
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+
+# YouTube's limits: titles count characters, descriptions bytes, and tags
+# count their characters plus 2 quotes for each tag containing a space.
+YOUTUBE_TITLE_MAX = 100
+YOUTUBE_DESCRIPTION_MAX_BYTES = 5000
+YOUTUBE_TAGS_MAX = 500
+
+DEFAULT_TITLE = "{description}"
+DEFAULT_TITLE_FALLBACK = "TikTok by @{username} ({video_id})"
+DEFAULT_DESCRIPTION = "Credit to @{username} on TikTok."
+DEFAULT_TAGS = ("TikTok", "Shorts", "Reels")
+
+_HASHTAG = re.compile(r"#(\w+)")
+# YouTube rejects titles and descriptions containing angle brackets.
+_FORBIDDEN = str.maketrans("", "", "<>")
+_ZWJ = "\u200d"
+
+
+def _description(fields) -> str:
+    return " ".join((fields.row.get("video_description") or "").split())
+
+
+# Values the templates can use, computed from a state store row on first use.
+FIELDS: Dict[str, Callable] = {
+    "video_id": lambda fields: str(fields.row["video_id"]),
+    "username": lambda fields: (fields.row.get("author_username") or "").strip(),
+    # The TikTok caption with its whitespace collapsed...
+    "description": _description,
+    # ...and without its hashtags, which are in `hashtags` ("#a #b").
+    "caption": lambda fields: " ".join(_HASHTAG.sub("", fields["description"]).split()),
+    "hashtags": lambda fields: " ".join("#" + tag for tag in fields.hashtags()),
+    "url": lambda fields: f"https://www.tiktok.com/@{fields['username']}/video/{fields['video_id']}",
+    "timestamp": lambda fields: str(fields.row.get("video_timestamp") or ""),
+    "play_count": lambda fields: fields.row.get("play_count") or 0,
+}
+
+
+class _RowFields(dict):
+    """The FIELDS of one row, each computed the first time a template asks for it."""
+
+    def __init__(self, row: Dict):
+        super().__init__()
+        self.row = row
+        self._hashtags = None
+
+    def __missing__(self, name):
+        value = self[name] = FIELDS[name](self)
+        return value
+
+    def hashtags(self) -> List[str]:
+        if self._hashtags is None:
+            self._hashtags = _HASHTAG.findall(self["description"])
+        return self._hashtags
+
+
+class CompiledTemplate:
+    """
+    A str.format-style template ("{caption} #shorts") parsed once into
+    literal and field parts, so rendering a row is a single join.
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.parts = []
+        for literal, name, spec, conversion in string.Formatter().parse(source):
+            if literal:
+                self.parts.append((literal, None, None))
+            if name is None:
+                continue
+            if name not in FIELDS:
+                raise ValueError(f"Unknown field {{{name}}} in template {source!r}; use one of {', '.join(FIELDS)}")
+            if conversion:
+                raise ValueError(f"Conversions like !{conversion} are not supported in template {source!r}")
+            self.parts.append((None, name, spec or None))
+
+    def render(self, fields: _RowFields) -> str:
+        return "".join([
+            literal if name is None else (format(fields[name], spec) if spec else str(fields[name]))
+            for literal, name, spec in self.parts
+        ])
+
+
+def _extends(ch: str) -> bool:
+    """Whether `ch` belongs to the grapheme before it (marks, variation selectors, skin tones, tags)."""
+    return (
+        ch == _ZWJ
+        or "\ufe00" <= ch <= "\ufe0f"
+        or "\U0001f3fb" <= ch <= "\U0001f3ff"
+        or "\U000e0020" <= ch <= "\U000e007f"
+        or unicodedata.category(ch) in ("Mn", "Me", "Mc")
+    )
+
+
+def _is_regional(ch: str) -> bool:
+    return "\U0001f1e6" <= ch <= "\U0001f1ff"
+
+
+def graphemes(text: str) -> Iterator[str]:
+    """
+    Splits `text` into user-perceived characters: a base character with its
+    combining marks, an emoji with its modifiers and ZWJ-joined parts, or a
+    flag's regional indicator pair.
+    """
+    start, n = 0, len(text)
+    while start < n:
+        end = start + 1
+        if text[start] == "\r" and end < n and text[end] == "\n":
+            end += 1
+        elif _is_regional(text[start]) and end < n and _is_regional(text[end]):
+            end += 1
+        while end < n and (_extends(text[end]) or text[end - 1] == _ZWJ):
+            end += 1
+        yield text[start:end]
+        start = end
+
+
+def _utf8_size(text: str) -> int:
+    return len(text.encode("utf-8"))
+
+
+def truncate(text: str, limit: int, size: Callable[[str], int] = len) -> str:
+    """
+    Cuts `text` to at most `limit` by `size` (characters by default) without
+    splitting a grapheme, so emoji, flags and accented letters stay whole.
+    """
+    if size(text) <= limit:
+        return text
+    kept, used = [], 0
+    for grapheme in graphemes(text):
+        used += size(grapheme)
+        if used > limit:
+            break
+        kept.append(grapheme)
+    return "".join(kept).rstrip()
+
+
+def _clean_tag(tag: str) -> str:
+    return " ".join(tag.lstrip("#").replace(",", " ").translate(_FORBIDDEN).split())
+
+
+class MetadataTemplates:
+    """
+    One channel's title, description and tags templates, compiled once and
+    rendered per state store row (see FIELDS for the values they can use).
+
+    `title` falls back to `title_fallback` when it renders empty, e.g. for a
+    video without a caption. `links` is a list of {"label", "url"} templates
+    added to the end of the description as "label: url" lines; links whose
+    url renders empty are left out, and the description body is cut to make
+    room for them. A `tags` entry that is exactly "{hashtags}" expands to the
+    caption's hashtags, one tag each. Everything is cut to YouTube's limits
+    on grapheme boundaries, and duplicate tags are dropped.
+    """
+
+    def __init__(
+        self,
+        title: str = DEFAULT_TITLE,
+        title_fallback: str = DEFAULT_TITLE_FALLBACK,
+        description: str = DEFAULT_DESCRIPTION,
+        links: Optional[Sequence[Dict[str, str]]] = None,
+        tags: Sequence[str] = DEFAULT_TAGS,
+    ):
+        self.title = CompiledTemplate(title)
+        self.title_fallback = CompiledTemplate(title_fallback)
+        self.description = CompiledTemplate(description)
+        self.links = [
+            (CompiledTemplate(link.get("label", "")), CompiledTemplate(link["url"])) for link in links or ()
+        ]
+        # None marks where the hashtags go.
+        self.tags = [None if tag == "{hashtags}" else CompiledTemplate(tag) for tag in tags]
+
+    @classmethod
+    def from_config(cls, raw: Optional[Dict]) -> "MetadataTemplates":
+        """Templates from a channel's "templates" config object; missing keys keep the defaults."""
+        return cls(**raw) if raw else DEFAULT_TEMPLATES
+
+    def _render_title(self, fields: _RowFields) -> str:
+        title = " ".join(self.title.render(fields).translate(_FORBIDDEN).split())
+        if not title:
+            title = " ".join(self.title_fallback.render(fields).translate(_FORBIDDEN).split())
+        return truncate(title, YOUTUBE_TITLE_MAX)
+
+    def _render_description(self, fields: _RowFields) -> str:
+        body = self.description.render(fields).translate(_FORBIDDEN).strip()
+        lines = []
+        for label, url in self.links:
+            target = url.render(fields).translate(_FORBIDDEN).strip()
+            if target:
+                text = label.render(fields).translate(_FORBIDDEN).strip()
+                lines.append(f"{text}: {target}" if text else target)
+        if not lines:
+            return truncate(body, YOUTUBE_DESCRIPTION_MAX_BYTES, _utf8_size)
+        block = "\n".join(lines)
+        if not body:
+            return truncate(block, YOUTUBE_DESCRIPTION_MAX_BYTES, _utf8_size)
+        room = YOUTUBE_DESCRIPTION_MAX_BYTES - _utf8_size(block) - 2
+        body = truncate(body, max(0, room), _utf8_size)
+        return f"{body}\n\n{block}" if body else block
+
+    def _render_tags(self, fields: _RowFields) -> List[str]:
+        tags, seen, used = [], set(), 0
+        for template in self.tags:
+            values = fields.hashtags() if template is None else [template.render(fields)]
+            for value in values:
+                tag = _clean_tag(value)
+                key = tag.lower()
+                if not tag or key in seen:
+                    continue
+                cost = len(tag) + (2 if " " in tag else 0) + (1 if tags else 0)
+                if used + cost > YOUTUBE_TAGS_MAX:
+                    return tags
+                seen.add(key)
+                tags.append(tag)
+                used += cost
+        return tags
+
+    def render(self, row: Dict) -> Dict:
+        """The YouTube snippet fields (title, description, tags) for a state store row."""
+        fields = _RowFields(row)
+        return {
+            "title": self._render_title(fields),
+            "description": self._render_description(fields),
+            "tags": self._render_tags(fields),
+        }
+
+
+DEFAULT_TEMPLATES = MetadataTemplates()
@@ -0,0 +1,224 @@
+"""
+Counters, gauges, timers and per-item trace spans for the pipeline.
+
+Everything is off until `configure(enabled=True, ...)` is called; while off,
+every call returns after a single flag check. When on, metrics accumulate in
+memory and `write_metrics()` renders them in the Prometheus text format
+(suitable for node_exporter's textfile collector), while each finished span
+is appended to the trace file as one JSON line.
+"""
+import os
+import json
+import time
+import uuid
+import logging
+import tempfile
+import threading
+import contextvars
+from typing import Dict, Optional, Tuple
+
+
+DEFAULT_METRICS_FILE = "metrics.prom"
+DEFAULT_TRACE_FILE = "traces.jsonl"
+
+_enabled = False
+_metrics_file = DEFAULT_METRICS_FILE
+_trace_file = None
+_trace_handle = None
+
+_lock = threading.Lock()
+_counters: Dict[Tuple, float] = {}
+_gauges: Dict[Tuple, float] = {}
+# (count, sum) per timer; rendered as a Prometheus summary without quantiles.
+_timers: Dict[Tuple, Tuple[int, float]] = {}
+
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+def configure(enabled: bool = True, metrics_file: str = DEFAULT_METRICS_FILE,
+              trace_file: Optional[str] = DEFAULT_TRACE_FILE) -> None:
+    """Turns instrumentation on or off; `trace_file=None` keeps metrics but drops spans."""
+    global _enabled, _metrics_file, _trace_file, _trace_handle
+    with _lock:
+        if _trace_handle is not None:
+            _trace_handle.close()
+            _trace_handle = None
+        _enabled = enabled
+        _metrics_file = metrics_file
+        _trace_file = trace_file if enabled else None
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def reset() -> None:
+    """Drops every recorded value."""
+    with _lock:
+        _counters.clear()
+        _gauges.clear()
+        _timers.clear()
+
+
+def _key(name: str, labels: Dict) -> Tuple:
+    return (name, tuple(sorted((k, str(v)) for k, v in labels.items())))
+
+
+def inc(name: str, value: float = 1, **labels) -> None:
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name: str, value: float, **labels) -> None:
+    if not _enabled:
+        return
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name: str, seconds: float, **labels) -> None:
+    if not _enabled:
+        return
+    key = _key(name, labels)
+    with _lock:
+        count, total = _timers.get(key, (0, 0.0))
+        _timers[key] = (count + 1, total + seconds)
+
+
+class Span:
+    """
+    Times a block. On exit the duration goes into the `<name>_seconds` timer
+    (labelled with the outcome) and, with tracing on, the span and its
+    attributes are written to the trace file.
+    """
+
+    __slots__ = ("name", "attrs", "span_id", "parent_id", "_start", "_wall_start", "_token")
+
+    def __init__(self, name: str, attrs: Dict):
+        self.name = name
+        self.attrs = attrs
+
+    def set(self, **attrs) -> None:
+        """Adds attributes to the trace record, e.g. bytes transferred."""
+        self.attrs.update(attrs)
+
+    def __enter__(self) -> "Span":
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = _current_span.get()
+        self._token = _current_span.set(self.span_id)
+        self._wall_start = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        duration = time.perf_counter() - self._start
+        _current_span.reset(self._token)
+        status = "ok" if exc_type is None else "error"
+        observe(f"{self.name}_seconds", duration, status=status)
+        if _trace_file is not None:
+            record = {
+                "name": self.name,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "start": round(self._wall_start, 6),
+                "duration": round(duration, 6),
+                "status": status,
+            }
+            if exc is not None:
+                record["error"] = str(exc)
+            record.update(self.attrs)
+            _write_trace(record)
+        return False
+
+
+class _NoopSpan:
+    __slots__ = ()
+
+    def set(self, **attrs) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP_SPAN = _NoopSpan()
+
+
+def span(name: str, **attrs):
+    """Context manager timing one unit of work, e.g. span("youtube_upload", video_id=...)."""
+    if not _enabled:
+        return _NOOP_SPAN
+    return Span(name, attrs)
+
+
+def _write_trace(record: Dict) -> None:
+    global _trace_handle
+    line = json.dumps(record, default=str) + "\n"
+    with _lock:
+        if _trace_file is None:
+            return
+        if _trace_handle is None:
+            _trace_handle = open(_trace_file, "a", encoding="utf-8", buffering=1)
+        _trace_handle.write(line)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _series(name: str, labels: Tuple, suffix: str = "") -> str:
+    if not labels:
+        return name + suffix
+    rendered = ",".join(f'{k}="{_escape(v)}"' for k, v in labels)
+    return f"{name}{suffix}{{{rendered}}}"
+
+
+def render() -> str:
+    """Renders every metric in the Prometheus text exposition format."""
+    with _lock:
+        counters = sorted(_counters.items())
+        gauges = sorted(_gauges.items())
+        timers = sorted(_timers.items())
+
+    lines = []
+    typed = set()
+
+    def declare(name, kind):
+        if name not in typed:
+            typed.add(name)
+            lines.append(f"# TYPE {name} {kind}")
+
+    for (name, labels), value in counters:
+        declare(name, "counter")
+        lines.append(f"{_series(name, labels)} {value:g}")
+    for (name, labels), value in gauges:
+        declare(name, "gauge")
+        lines.append(f"{_series(name, labels)} {value:g}")
+    for (name, labels), (count, total) in timers:
+        declare(name, "summary")
+        lines.append(f"{_series(name, labels, '_count')} {count}")
+        lines.append(f"{_series(name, labels, '_sum')} {total:.6f}")
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def write_metrics(path: Optional[str] = None) -> None:
+    """Atomically rewrites the metrics file so scrapers never see half of it."""
+    if not _enabled:
+        return
+    path = path or _metrics_file
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=".metrics-", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(render())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    logging.debug("Wrote metrics to %s", path)
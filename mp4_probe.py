@@ -0,0 +1,155 @@
+import os
+import mmap
+import struct
+import logging
+from typing import Dict, Iterator, Tuple
+
+import metrics
+from state_store import StateStore
+
+
+QUARANTINE_DIR_NAME = ".quarantine"
+# A video quarantined this many times is left alone instead of downloaded again.
+MAX_REDOWNLOADS = 3
+
+
+def _boxes(buf, start: int, end: int) -> Iterator[Tuple[bytes, int, int]]:
+    """
+    Yields (type, payload start, box end) for each box between `start` and
+    `end`. Raises ValueError when a box runs past `end`, i.e. the file is cut off.
+    """
+    offset = start
+    while offset < end:
+        if offset + 8 > end:
+            raise ValueError(f"partial box header at byte {offset}")
+        size, box_type = struct.unpack_from(">I4s", buf, offset)
+        header = 8
+        if size == 1:
+            if offset + 16 > end:
+                raise ValueError(f"partial box header at byte {offset}")
+            size = struct.unpack_from(">Q", buf, offset + 8)[0]
+            header = 16
+        elif size == 0:
+            size = end - offset
+        name = box_type.decode("latin-1")
+        if size < header:
+            raise ValueError(f"{name} box at byte {offset} has invalid size {size}")
+        if offset + size > end:
+            raise ValueError(f"{name} box at byte {offset} runs past the end ({offset + size} > {end} bytes)")
+        yield box_type, offset + header, offset + size
+        offset += size
+
+
+def _read_moov(buf, start: int, end: int, info: Dict) -> None:
+    for box_type, payload, box_end in _boxes(buf, start, end):
+        if box_type == b"mvhd":
+            # Version 1 widens the times and duration to 64 bits.
+            if buf[payload] == 1:
+                timescale, duration = struct.unpack_from(">IQ", buf, payload + 20)
+            else:
+                timescale, duration = struct.unpack_from(">II", buf, payload + 12)
+            if timescale:
+                info["duration"] = duration / timescale
+        elif box_type == b"trak":
+            for child, child_payload, _ in _boxes(buf, payload, box_end):
+                if child != b"tkhd":
+                    continue
+                # Width and height are 16.16 fixed point after the matrix.
+                offset = child_payload + (88 if buf[child_payload] == 1 else 76)
+                width, height = struct.unpack_from(">II", buf, offset)
+                if width and height and not info["width"]:
+                    info["width"], info["height"] = width >> 16, height >> 16
+
+
+def probe_boxes(path: str) -> Dict:
+    """
+    Reads the mp4 box structure of `path` through mmap, without decoding:
+    duration, dimensions, the mdat size and whether moov comes before mdat
+    ("faststart", None if neither box is there). `valid` is False, with the
+    reason in `error`, for empty, cut-off or non-mp4 files and ones without
+    video.
+    """
+    info = {"valid": False, "error": None, "duration": 0.0, "width": 0, "height": 0, "mdat_size": 0,
+            "faststart": None}
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            info["error"] = "empty file"
+            return info
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+            seen = set()
+            try:
+                for box_type, payload, box_end in _boxes(buf, 0, size):
+                    if box_type in (b"moov", b"mdat") and info["faststart"] is None:
+                        info["faststart"] = box_type == b"moov"
+                    seen.add(box_type)
+                    if box_type == b"moov":
+                        _read_moov(buf, payload, box_end, info)
+                    elif box_type == b"mdat":
+                        info["mdat_size"] += box_end - payload
+            except (ValueError, struct.error, IndexError) as e:
+                info["error"] = f"truncated or corrupt: {e}"
+                return info
+
+    if b"ftyp" not in seen:
+        info["error"] = "no ftyp box, not an mp4 file"
+    elif b"moov" not in seen:
+        info["error"] = "no moov box"
+    elif not info["mdat_size"]:
+        info["error"] = "no media data"
+    elif not info["width"]:
+        info["error"] = "no video track"
+    elif info["duration"] <= 0 and b"moof" not in seen:
+        # Fragmented files carry their duration in the fragments.
+        info["error"] = "zero duration"
+    else:
+        info["valid"] = True
+    return info
+
+
+def validate_video(store: StateStore, video_id: str, path: str) -> Dict:
+    """
+    probe_boxes() for a downloaded video, cached in the state store by file
+    size and mtime so an unchanged file is only ever probed once.
+    """
+    stat = os.stat(path)
+    cached = store.get_probe(video_id)
+    if cached is not None and cached["file_size"] == stat.st_size and cached["file_mtime"] == stat.st_mtime:
+        metrics.inc("mp4_probe_cache_hits_total")
+        return {
+            "valid": bool(cached["valid"]), "error": cached["error"], "duration": cached["duration"],
+            "width": cached["width"], "height": cached["height"],
+        }
+    with metrics.span("mp4_probe", video_id=video_id, bytes=stat.st_size):
+        info = probe_boxes(path)
+    store.save_probe(video_id, stat.st_size, stat.st_mtime, info)
+    return info
+
+
+def check_download(store: StateStore, download_dir: str, video_id: str, path: str) -> bool:
+    """
+    Whether a downloaded video is a usable mp4 (see validate_video); a broken
+    one is quarantined. Run it before anything else reads the whole file.
+    """
+    probe = validate_video(store, video_id, path)
+    if not probe["valid"]:
+        quarantine(store, download_dir, video_id, path, probe["error"])
+    return probe["valid"]
+
+
+def quarantine(store: StateStore, download_dir: str, video_id: str, path: str, reason: str) -> str:
+    """
+    Moves a broken download into the download dir's .quarantine folder and
+    queues the video to be downloaded again. Returns the new path.
+    """
+    target_dir = os.path.join(download_dir, QUARANTINE_DIR_NAME)
+    os.makedirs(target_dir, exist_ok=True)
+    target = os.path.join(target_dir, os.path.basename(path))
+    os.replace(path, target)
+    attempts = store.mark_quarantined(video_id, reason)
+    metrics.inc("mp4_quarantined_total")
+    if attempts > MAX_REDOWNLOADS:
+        logging.error("Quarantined %s again (%s); giving up after %d downloads.", path, reason, attempts)
+    else:
+        logging.warning("Quarantined %s (%s); it will be downloaded again.", path, reason)
+    return target
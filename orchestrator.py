@@ -0,0 +1,261 @@
+import os
+import json
+import asyncio
+import contextlib
+import functools
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from bandwidth import BandwidthLimiter
+from disk_cache import DiskCache
+from metadata_templates import DEFAULT_TEMPLATES, MetadataTemplates
+from scheduling import DEFAULT_REQUESTS_PER_SECOND, FairLimiter, HostRateLimiter
+from quota import DEFAULT_DAILY_BUDGET, DEFAULT_PRIORITY, QuotaScheduler
+from state_store import StateStore
+from transcoder import DEFAULT_TRANSCODE_WORKERS
+
+
+# Daemon mode: how often each source is synced, and the +/- fraction of
+# random jitter so sources with the same interval don't poll in lockstep.
+DEFAULT_POLL_INTERVAL = 15 * 60
+DEFAULT_POLL_JITTER = 0.1
+
+
+@dataclass
+class ChannelConfig:
+    """A YouTube channel and the OAuth files used to upload to it."""
+
+    name: str
+    # Empty means auth.CREDENTIALS_FILE (auth is only imported once it's needed).
+    credentials_file: str = ""
+    token_file: str = ""
+    download_dir: str = ""
+    # Channels uploading through the same Google Cloud project share its quota.
+    project: str = ""
+    daily_quota: int = DEFAULT_DAILY_BUDGET
+    # Title/description/tags templates, see metadata_templates.MetadataTemplates;
+    # load_config compiles them into compiled_templates.
+    templates: Dict = field(default_factory=dict)
+    compiled_templates: MetadataTemplates = field(default=DEFAULT_TEMPLATES, init=False, repr=False, compare=False)
+
+
+@dataclass
+class SourceConfig:
+    """A TikTok account mirrored into one YouTube channel."""
+
+    tiktok_username: str
+    channel: str
+    # Daemon mode only; falls back to OrchestratorConfig.poll_interval.
+    poll_interval: Optional[float] = None
+
+
+@dataclass
+class OrchestratorConfig:
+    download_dir: str = "./tiktok_downloads"
+    download_workers: int = 4
+    upload_workers: int = 2
+    listing_concurrency: int = 4
+    queue_size: int = 8
+    priority: List[str] = field(default_factory=lambda: list(DEFAULT_PRIORITY))
+    wait_for_quota_reset: bool = False
+    # Normalize videos for Shorts with ffmpeg before uploading them.
+    transcode: bool = False
+    transcode_workers: int = DEFAULT_TRANSCODE_WORKERS
+    # Byte budget for the videos kept in all channels' download dirs; None is unlimited.
+    cache_budget_bytes: Optional[int] = None
+    # Combined upload rate of all uploads in bytes/s, None is unlimited; with
+    # upload_bandwidth_hours = [start, end] it only applies between those
+    # local-time hours.
+    upload_bandwidth_bytes: Optional[float] = None
+    upload_bandwidth_hours: Optional[List[int]] = None
+    # Order of the `upload` command's backlog, see upload_executor.UPLOAD_ORDERS.
+    upload_order: str = "shortest_first"
+    poll_interval: float = DEFAULT_POLL_INTERVAL
+    poll_jitter: float = DEFAULT_POLL_JITTER
+    # Daemon mode: port of the HTTP health/status endpoint; None disables it.
+    status_port: Optional[int] = None
+    # Address the status endpoint binds to; "0.0.0.0" exposes it on every interface.
+    status_host: str = "127.0.0.1"
+    channels: Dict[str, ChannelConfig] = field(default_factory=dict)
+    sources: List[SourceConfig] = field(default_factory=list)
+
+
+def load_config(path: str) -> OrchestratorConfig:
+    """
+    Loads the multi-account JSON config. See
+    resources/examples/config_example.json for the format.
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+
+    config = OrchestratorConfig(
+        **{k: raw[k] for k in (
+            "download_dir", "download_workers", "upload_workers", "listing_concurrency", "queue_size",
+            "priority", "wait_for_quota_reset", "transcode", "transcode_workers", "cache_budget_bytes",
+            "upload_bandwidth_bytes", "upload_bandwidth_hours", "upload_order", "poll_interval", "poll_jitter", "status_port",
+            "status_host",
+        ) if k in raw}
+    )
+    for name, channel in (raw.get("channels") or {}).items():
+        channel = ChannelConfig(name=name, **channel)
+        if not channel.token_file:
+            channel.token_file = os.path.join("tokens", f"{name}.pickle")
+        if not channel.download_dir:
+            channel.download_dir = os.path.join(config.download_dir, name)
+        if not channel.project:
+            channel.project = name
+        channel.compiled_templates = MetadataTemplates.from_config(channel.templates)
+        config.channels[name] = channel
+
+    for source in raw.get("sources") or []:
+        source = SourceConfig(**source)
+        if source.channel not in config.channels:
+            raise ValueError(
+                f"Source @{source.tiktok_username} maps to unknown channel '{source.channel}'"
+            )
+        config.sources.append(source)
+
+    if not config.sources:
+        raise ValueError(f"No sources configured in {path}")
+    return config
+
+
+def channel_service_factory(channel: ChannelConfig):
+    from auth import CREDENTIALS_FILE, get_authenticated_service
+
+    # Pipelines uploading to the same channel share its token file; the auth
+    # module keeps one credential manager per token file and refreshes it
+    # single-flight, so the factory needs no locking of its own.
+    return functools.partial(
+        get_authenticated_service, channel.credentials_file or CREDENTIALS_FILE, channel.token_file
+    )
+
+
+def channel_schedulers(config: OrchestratorConfig, quota_store: StateStore) -> Dict[str, QuotaScheduler]:
+    """One QuotaScheduler per Google project, keyed by every channel that uploads through it."""
+    projects = {}
+    schedulers = {}
+    for name, channel in config.channels.items():
+        if channel.project not in projects:
+            projects[channel.project] = QuotaScheduler(quota_store, channel.project, channel.daily_quota)
+        schedulers[name] = projects[channel.project]
+    return schedulers
+
+
+def build_disk_cache(
+    config: OrchestratorConfig, stores: Dict[str, StateStore], wait_for_uploads: bool = True
+) -> Optional[DiskCache]:
+    """A DiskCache spanning every channel's download dir, if a budget is configured."""
+    if config.cache_budget_bytes is None:
+        return None
+    return DiskCache(
+        [(config.channels[name].download_dir, store) for name, store in stores.items()],
+        config.cache_budget_bytes,
+        wait_for_uploads=wait_for_uploads,
+    )
+
+
+def build_bandwidth_limiter(config: OrchestratorConfig) -> Optional[BandwidthLimiter]:
+    """The BandwidthLimiter shared by every upload, if a rate is configured."""
+    if config.upload_bandwidth_bytes is None:
+        return None
+    return BandwidthLimiter(config.upload_bandwidth_bytes, hours=config.upload_bandwidth_hours)
+
+
+async def run_orchestrator(config: OrchestratorConfig, full_resync: bool = False) -> Dict[str, int]:
+    """
+    Mirrors every configured TikTok source into its YouTube channel.
+
+    All sources run at once and share one pool of download workers and one
+    pool of `upload_workers` upload slots; both hand out work round-robin per
+    source, so a single large account cannot starve the rest, and a single
+    source can use every slot. Requests to each host are rate-limited
+    across all sources together. Account listings run
+    concurrently, up to `listing_concurrency` at a time. Each channel keeps its
+    own download dir and state store. Quota is budgeted per Google project,
+    and exhausting it only stops (or, with wait_for_quota_reset, pauses) the
+    sources that upload through that project. `full_resync` lists every source's
+    whole feed instead of only what is newer than its high-water mark. With
+    `transcode`, videos are normalized for Shorts in a pool of
+    `transcode_workers` processes shared by all sources. With
+    `cache_budget_bytes`, one DiskCache spans every channel's download dir and
+    evicts the oldest uploaded videos first, whichever channel they belong to.
+    With `upload_bandwidth_bytes`, all uploads share one bandwidth limit.
+    Each channel's uploads get their metadata from its own templates.
+
+    Returns the number of uploads per TikTok source.
+    """
+    from pipeline import run_pipeline
+
+    download_slots = FairLimiter(config.download_workers)
+    upload_slots = FairLimiter(config.upload_workers)
+    listing_semaphore = asyncio.Semaphore(config.listing_concurrency)
+    # One per run, so TikTok's hosts see the rate limit across all sources.
+    host_limiter = HostRateLimiter(DEFAULT_REQUESTS_PER_SECOND)
+
+    # Quota usage is tracked per Google project, which may span channels with
+    # separate download dirs, so it lives in a store at the top-level dir.
+    os.makedirs(config.download_dir, exist_ok=True)
+    quota_store = StateStore.for_download_dir(config.download_dir)
+
+    stores = {}
+    factories = {}
+    for name, channel in config.channels.items():
+        os.makedirs(channel.download_dir, exist_ok=True)
+        stores[name] = StateStore.for_download_dir(channel.download_dir)
+        factories[name] = channel_service_factory(channel)
+    schedulers = channel_schedulers(config, quota_store)
+    # Exhausting a project's quota stops every source uploading through it.
+    project_stop_events = {channel.project: asyncio.Event() for channel in config.channels.values()}
+    stop_events = {name: project_stop_events[channel.project] for name, channel in config.channels.items()}
+    cache = build_disk_cache(config, stores)
+    throttle = build_bandwidth_limiter(config)
+
+    logging.info(
+        "Syncing %d TikTok sources into %d YouTube channels.",
+        len(config.sources), len(config.channels),
+    )
+
+    transcode_executor = ProcessPoolExecutor(config.transcode_workers) if config.transcode else None
+    with ProcessPoolExecutor(max_workers=config.download_workers) as executor, \
+            (transcode_executor or contextlib.nullcontext()):
+        results = await asyncio.gather(
+            *(
+                run_pipeline(
+                    source.tiktok_username,
+                    config.channels[source.channel].download_dir,
+                    upload_workers=config.upload_workers,
+                    queue_size=config.queue_size,
+                    store=stores[source.channel],
+                    upload_slots=upload_slots,
+                    service_factory=factories[source.channel],
+                    stop_uploads=stop_events[source.channel],
+                    backlog_author=source.tiktok_username,
+                    executor=executor,
+                    slots=download_slots,
+                    listing_semaphore=listing_semaphore,
+                    limiter=host_limiter,
+                    max_workers=config.download_workers,
+                    full_resync=full_resync,
+                    scheduler=schedulers[source.channel],
+                    priority=config.priority,
+                    wait_for_reset=config.wait_for_quota_reset,
+                    transcode_executor=transcode_executor,
+                    cache=cache,
+                    throttle=throttle,
+                    templates=config.channels[source.channel].compiled_templates,
+                )
+                for source in config.sources
+            ),
+            return_exceptions=True,
+        )
+
+    summary = {}
+    for source, result in zip(config.sources, results):
+        if isinstance(result, BaseException):
+            logging.error("Sync for @%s failed: %s", source.tiktok_username, result)
+            result = 0
+        summary[source.tiktok_username] = summary.get(source.tiktok_username, 0) + result
+    return summary
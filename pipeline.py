@@ -0,0 +1,209 @@
+import os
+import asyncio
+import logging
+import threading
+from concurrent.futures import Executor
+from typing import Callable, Optional, Sequence, Union
+
+from auth import get_authenticated_service
+import metrics
+from state_store import StateStore
+from scheduling import FairLimiter
+from quota import DEFAULT_PRIORITY, QuotaScheduler
+from tiktok_downloader import download_tiktok_clips
+from transcoder import prepare_for_upload
+from youtube_uploader import QuotaExceededError, UploadInterrupted, downloaded_path, upload_video_record
+from upload_executor import DEFAULT_UPLOAD_WORKERS
+from bandwidth import BandwidthLimiter
+from mp4_probe import check_download
+from metadata_templates import DEFAULT_TEMPLATES, MetadataTemplates
+
+
+DEFAULT_QUEUE_SIZE = 8
+
+_DONE = object()
+
+
+def _upload_in_worker_thread(
+    service_factory, download_dir, row, store, scheduler, upload_path, cancel, throttle, templates
+):
+    # The service comes from the thread that uses it: the factory caches one
+    # per thread, and httplib2 transports must not be shared across threads.
+    return upload_video_record(
+        service_factory(), download_dir, row, store, scheduler, upload_path, cancel, throttle, templates
+    )
+
+
+def _prepare_row(store, download_dir, row, transcode_executor):
+    """Returns (upload it?, path to upload instead of the download or None)."""
+    video_path = downloaded_path(download_dir, row)
+    if transcode_executor is None or not os.path.exists(video_path):
+        return True, None
+    # A broken download is quarantined before it is hashed or sent to ffmpeg.
+    if not check_download(store, download_dir, row["video_id"], video_path):
+        return False, None
+    return True, prepare_for_upload(store, download_dir, row["video_id"], video_path, transcode_executor)
+
+
+async def run_pipeline(
+    username: str,
+    download_dir: str,
+    upload_workers: int = DEFAULT_UPLOAD_WORKERS,
+    queue_size: int = DEFAULT_QUEUE_SIZE,
+    store: StateStore = None,
+    upload_slots: FairLimiter = None,
+    service_factory=None,
+    stop_uploads: asyncio.Event = None,
+    backlog_author: Optional[str] = None,
+    scheduler: Optional[QuotaScheduler] = None,
+    priority: Union[str, Sequence[str]] = DEFAULT_PRIORITY,
+    wait_for_reset: bool = False,
+    transcode_executor: Optional[Executor] = None,
+    cancel_uploads: Optional[threading.Event] = None,
+    on_queue_depth: Optional[Callable[[int], None]] = None,
+    throttle: Optional[BandwidthLimiter] = None,
+    templates: MetadataTemplates = DEFAULT_TEMPLATES,
+    **download_kwargs,
+) -> int:
+    """
+    Downloads and uploads at the same time.
+
+    Each video goes onto a bounded queue as soon as it is on disk, and
+    `upload_workers` uploaders pick it up from there. Downloads hold their slot
+    until the queue has room, so at most `queue_size` finished videos wait on
+    disk for an uploader. Videos already downloaded by earlier runs but not yet
+    uploaded are queued too.
+
+    On QuotaExceededError no new downloads or uploads start; in-flight
+    downloads finish and queued videos stay pending in the state store for the
+    next run. Returns the number of videos uploaded.
+
+    The orchestrator runs one pipeline per TikTok source and shares
+    `upload_slots` (a FairLimiter across sources), the channel's
+    `service_factory` and `stop_uploads` event between the pipelines that
+    upload to the same channel. `backlog_author` limits the backlog to one
+    TikTok author when several sources share a state store.
+
+    Each upload books its quota cost against `scheduler` first (a default one
+    for the store if not given), and the backlog is queued in `priority`
+    order. With `wait_for_reset`, a spent budget pauses the uploaders until
+    the Pacific-time quota reset instead of stopping the pipeline.
+
+    With a `transcode_executor` each video is normalized for Shorts (see
+    transcoder.prepare_for_upload) before its uploader takes an upload slot.
+
+    A DiskCache passed as `cache` (one of the download options) keeps the
+    download dir under its byte budget: uploaded files are evicted to make
+    room, and downloads wait for uploads while only queued videos are left.
+
+    Setting `cancel_uploads` (a threading.Event, as uploads run in threads)
+    stops in-flight uploads after their current chunk; they stay pending and
+    resume from that byte next time. Set `stop_uploads` as well so nothing new
+    starts. `on_queue_depth` is called with the queue length as it changes.
+    A `throttle` shared by every pipeline caps their combined upload rate.
+    `templates` renders each upload's title, description and tags.
+    """
+    os.makedirs(download_dir, exist_ok=True)
+    if store is None:
+        store = StateStore.for_download_dir(download_dir)
+    store.import_csv_history(download_dir)
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    if stop_uploads is None:
+        stop_uploads = asyncio.Event()
+    if upload_slots is None:
+        upload_slots = FairLimiter(upload_workers)
+    if service_factory is None:
+        service_factory = get_authenticated_service
+    if scheduler is None:
+        scheduler = QuotaScheduler(store)
+    auth_lock = asyncio.Lock()
+    uploaded = []
+
+    def report_queue_depth():
+        metrics.set_gauge("pipeline_queue_depth", queue.qsize(), username=username)
+        if on_queue_depth is not None:
+            on_queue_depth(queue.qsize())
+
+    async def enqueue(video_id):
+        if not stop_uploads.is_set():
+            await queue.put(video_id)
+            report_queue_depth()
+
+    async def enqueue_backlog():
+        for row in scheduler.plan(store.pending_uploads(backlog_author), priority):
+            await enqueue(row["video_id"])
+
+    async def consumer(worker_id):
+        authenticated = False
+        while True:
+            video_id = await queue.get()
+            report_queue_depth()
+            try:
+                if video_id is _DONE:
+                    return
+                if stop_uploads.is_set():
+                    # Drain so blocked producers can finish; the video stays pending.
+                    continue
+                if not authenticated:
+                    async with auth_lock:
+                        await asyncio.to_thread(service_factory)
+                    authenticated = True
+                row = store.get_video(video_id)
+                usable, upload_path = await asyncio.to_thread(
+                    _prepare_row, store, download_dir, row, transcode_executor
+                )
+                if not usable:
+                    continue
+                while True:
+                    try:
+                        async with upload_slots.slot(username):
+                            if stop_uploads.is_set():
+                                break
+                            youtube_id = await asyncio.to_thread(
+                                _upload_in_worker_thread, service_factory, download_dir, row, store, scheduler,
+                                upload_path, cancel_uploads, throttle, templates,
+                            )
+                    except QuotaExceededError:
+                        if not wait_for_reset:
+                            raise
+                        await scheduler.async_sleep_until_reset()
+                        continue
+                    if youtube_id:
+                        uploaded.append(youtube_id)
+                    break
+            except QuotaExceededError:
+                logging.error("Halting uploads due to quota limits. Last attempted TikTok: %s", video_id)
+                stop_uploads.set()
+            except UploadInterrupted as e:
+                logging.info("%s; it resumes on the next run.", e)
+            except Exception as e:
+                logging.exception("Upload worker %d failed on TikTok %s: %s", worker_id, video_id, e)
+                if not authenticated:
+                    # Without an authenticated client no worker can make progress.
+                    stop_uploads.set()
+            finally:
+                queue.task_done()
+
+    consumers = [asyncio.create_task(consumer(n)) for n in range(upload_workers)]
+    try:
+        await asyncio.gather(
+            enqueue_backlog(),
+            download_tiktok_clips(
+                username,
+                download_dir,
+                store=store,
+                on_downloaded=enqueue,
+                stop_event=stop_uploads,
+                **download_kwargs,
+            ),
+        )
+        for _ in consumers:
+            await queue.put(_DONE)
+        await asyncio.gather(*consumers)
+    finally:
+        for task in consumers:
+            task.cancel()
+
+    logging.info("Pipeline finished: uploaded %d videos for %s.", len(uploaded), username)
+    return len(uploaded)
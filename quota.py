@@ -0,0 +1,141 @@
+import time
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from datetime import time as dt_time
+from typing import Callable, Dict, List, Optional, Sequence, Union
+from zoneinfo import ZoneInfo
+
+import metrics
+from state_store import StateStore
+
+
+# YouTube Data API v3 cost of each call, in quota units.
+QUOTA_COSTS = {
+    "videos.insert": 1600,
+    "videos.update": 50,
+    "videos.list": 1,
+    "playlistItems.insert": 50,
+    "playlistItems.list": 1,
+    "channels.list": 1,
+}
+
+DEFAULT_DAILY_BUDGET = 10000
+
+# Daily quotas reset at midnight Pacific time.
+QUOTA_TIMEZONE = ZoneInfo("America/Los_Angeles")
+
+
+def _video_id_key(row: Dict) -> int:
+    try:
+        return int(row.get("video_id") or 0)
+    except ValueError:
+        return 0
+
+
+# Sort keys for upload priority. TikTok video ids embed their creation time,
+# so they order videos by age even when the metadata timestamp is missing.
+PRIORITY_RULES = {
+    "newest": _video_id_key,
+    "oldest": _video_id_key,
+    "most_played": lambda row: row.get("play_count") or 0,
+}
+_DESCENDING_RULES = {"newest", "most_played"}
+
+DEFAULT_PRIORITY = ("newest",)
+
+
+def order_by_priority(rows: List[Dict], priority: Union[str, Sequence[str]] = DEFAULT_PRIORITY) -> List[Dict]:
+    """
+    Orders rows by a priority rule, or several rules where later ones break
+    ties in earlier ones, e.g. ("most_played", "newest").
+    """
+    rules = [priority] if isinstance(priority, str) else list(priority)
+    unknown = [rule for rule in rules if rule not in PRIORITY_RULES]
+    if unknown:
+        raise ValueError(f"Unknown upload priority rule(s): {', '.join(unknown)}")
+
+    ordered = list(rows)
+    # Stable sorts applied from the least to the most significant rule.
+    for rule in reversed(rules):
+        ordered.sort(key=PRIORITY_RULES[rule], reverse=rule in _DESCENDING_RULES)
+    return ordered
+
+
+class QuotaScheduler:
+    """
+    Tracks YouTube API quota units spent per Google project and day.
+
+    Usage is stored in the state store, so it survives restarts and is shared
+    by every uploader of the same project. Calls reserve their cost *before*
+    they are made, so the budget is never discovered by a failed request.
+    """
+
+    def __init__(
+        self,
+        store: StateStore,
+        project: str = "default",
+        daily_budget: int = DEFAULT_DAILY_BUDGET,
+        costs: Optional[Dict[str, int]] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        self.store = store
+        self.project = project
+        self.daily_budget = daily_budget
+        self.costs = dict(QUOTA_COSTS, **(costs or {}))
+        self.clock = clock
+
+    def quota_day(self) -> str:
+        return datetime.fromtimestamp(self.clock(), QUOTA_TIMEZONE).date().isoformat()
+
+    def seconds_until_reset(self) -> float:
+        now = datetime.fromtimestamp(self.clock(), QUOTA_TIMEZONE)
+        tomorrow = now.date() + timedelta(days=1)
+        reset = datetime.combine(tomorrow, dt_time(0), tzinfo=QUOTA_TIMEZONE)
+        return max(0.0, reset.timestamp() - now.timestamp())
+
+    def used(self) -> int:
+        return self.store.get_quota_usage(self.project, self.quota_day())
+
+    def remaining(self) -> int:
+        return max(0, self.daily_budget - self.used())
+
+    def cost(self, method: str, count: int = 1) -> int:
+        return self.costs[method] * count
+
+    def try_reserve(self, method: str, count: int = 1) -> bool:
+        """Books the cost of `count` calls to `method` if today's budget allows it."""
+        units = self.cost(method, count)
+        reserved = self.store.reserve_quota(self.project, self.quota_day(), units, self.daily_budget)
+        if reserved:
+            metrics.inc("youtube_quota_units_total", units, project=self.project, method=method)
+        else:
+            metrics.inc("youtube_quota_rejections_total", project=self.project, method=method)
+        return reserved
+
+    def mark_exhausted(self) -> None:
+        """Records that YouTube reported the quota as spent, e.g. by another client."""
+        self.store.raise_quota_usage(self.project, self.quota_day(), self.daily_budget)
+
+    def plan(self, rows: List[Dict], priority: Union[str, Sequence[str]] = DEFAULT_PRIORITY) -> List[Dict]:
+        """
+        Orders pending uploads by priority and logs how many fit in what is
+        left of today's budget.
+        """
+        ordered = order_by_priority(rows, priority)
+        fits = self.remaining() // self.cost("videos.insert")
+        logging.info(
+            "Quota plan for %s: %d of %d pending uploads fit in today's remaining %d units.",
+            self.project, min(fits, len(ordered)), len(ordered), self.remaining(),
+        )
+        return ordered
+
+    def sleep_until_reset(self) -> None:
+        delay = self.seconds_until_reset()
+        logging.info("Quota budget for %s spent; sleeping %.0f s until the Pacific-time reset.", self.project, delay)
+        time.sleep(delay)
+
+    async def async_sleep_until_reset(self) -> None:
+        delay = self.seconds_until_reset()
+        logging.info("Quota budget for %s spent; sleeping %.0f s until the Pacific-time reset.", self.project, delay)
+        await asyncio.sleep(delay)
@@ -0,0 +1,111 @@
+import asyncio
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlparse
+
+
+# Request starts per second against any one host.
+DEFAULT_REQUESTS_PER_SECOND = 2.0
+
+
+class FairLimiter:
+    """
+    Concurrency limit shared by several keys (e.g. TikTok accounts).
+
+    Works like an asyncio.Semaphore, except that when slots free up they are
+    handed to waiting keys round-robin instead of first-come-first-served, so
+    one key with hundreds of queued jobs cannot starve the others.
+    """
+
+    def __init__(self, limit: int):
+        if limit < 1:
+            raise ValueError("FairLimiter limit must be at least 1")
+        self.limit = limit
+        self._active = 0
+        self._waiters = OrderedDict()
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(q) for q in self._waiters.values())
+
+    @asynccontextmanager
+    async def slot(self, key):
+        await self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def acquire(self, key) -> None:
+        if self._active < self.limit and not self._waiters:
+            self._active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # The slot was granted just before the cancellation landed.
+                self.release()
+            else:
+                self._discard(key, future)
+            raise
+
+    def release(self) -> None:
+        self._active -= 1
+        self._wake()
+
+    def _discard(self, key, future) -> None:
+        waiters = self._waiters.get(key)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._waiters[key]
+
+    def _wake(self) -> None:
+        while self._active < self.limit and self._waiters:
+            key, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            if waiters:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if future.done():
+                continue
+            self._active += 1
+            future.set_result(None)
+
+
+class HostRateLimiter:
+    """
+    Spaces out request starts per host so that concurrent workers don't
+    burst more than `rate` requests per second at any single host.
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate and rate > 0 else 0.0
+        self._next_slot = {}
+        self._locks = {}
+
+    async def wait(self, url: str) -> None:
+        if not self.interval:
+            return
+        host = urlparse(url).netloc
+        lock = self._locks.setdefault(host, asyncio.Lock())
+        async with lock:
+            loop = asyncio.get_running_loop()
+            now = loop.time()
+            slot = max(now, self._next_slot.get(host, now))
+            self._next_slot[host] = slot + self.interval
+            if slot > now:
+                await asyncio.sleep(slot - now)
@@ -0,0 +1,720 @@
+import os
+import csv
+import json
+import time
+import sqlite3
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+from metadata_reader import METADATA_FILE, read_header, read_new_rows
+
+
+STATE_DB_FILE = "state.db"
+
+DOWNLOAD_PENDING = "pending"
+DOWNLOAD_DONE = "downloaded"
+DOWNLOAD_FAILED = "failed"
+# Downloaded and uploaded, then deleted locally to stay under the disk budget.
+DOWNLOAD_EVICTED = "evicted"
+# Failed the pre-upload mp4 check; moved aside and waiting to be downloaded again.
+DOWNLOAD_QUARANTINED = "quarantined"
+
+UPLOAD_PENDING = "pending"
+UPLOAD_DONE = "uploaded"
+UPLOAD_FAILED = "failed"
+# Same content as a video that is already on YouTube; never uploaded itself.
+UPLOAD_DUPLICATE = "duplicate"
+# Was uploaded, but YouTube no longer has it (deleted or removed).
+UPLOAD_MISSING = "missing"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS videos (
+    video_id          TEXT PRIMARY KEY,
+    author_username   TEXT,
+    video_description TEXT,
+    video_timestamp   TEXT,
+    play_count        INTEGER,
+    filename          TEXT,
+    download_status   TEXT NOT NULL DEFAULT 'pending',
+    downloaded_at     REAL,
+    download_error    TEXT,
+    upload_status     TEXT NOT NULL DEFAULT 'pending',
+    youtube_id        TEXT,
+    title             TEXT,
+    uploaded_at       REAL,
+    upload_error      TEXT,
+    updated_at        REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_videos_status ON videos (upload_status, download_status);
+CREATE INDEX IF NOT EXISTS idx_videos_author ON videos (author_username);
+CREATE INDEX IF NOT EXISTS idx_videos_youtube_id ON videos (youtube_id);
+
+CREATE TABLE IF NOT EXISTS upload_sessions (
+    video_id    TEXT PRIMARY KEY,
+    video_path  TEXT NOT NULL,
+    file_size   INTEGER NOT NULL,
+    file_mtime  REAL NOT NULL,
+    session_uri TEXT NOT NULL,
+    bytes_sent  INTEGER NOT NULL DEFAULT 0,
+    updated_at  REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS sync_marks (
+    account         TEXT PRIMARY KEY,
+    newest_video_id INTEGER NOT NULL,
+    updated_at      REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS quota_usage (
+    project    TEXT NOT NULL,
+    day        TEXT NOT NULL,
+    units      INTEGER NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (project, day)
+);
+
+CREATE TABLE IF NOT EXISTS fingerprints (
+    video_id     TEXT PRIMARY KEY,
+    file_size    INTEGER NOT NULL,
+    file_mtime   REAL NOT NULL,
+    partial_hash TEXT NOT NULL,
+    full_hash    TEXT,
+    duplicate_of TEXT,
+    updated_at   REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_fingerprints_partial ON fingerprints (file_size, partial_hash);
+
+CREATE TABLE IF NOT EXISTS transcodes (
+    source_hash TEXT PRIMARY KEY,
+    action      TEXT NOT NULL,
+    output_file TEXT,
+    reasons     TEXT,
+    updated_at  REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS probes (
+    video_id   TEXT PRIMARY KEY,
+    file_size  INTEGER NOT NULL,
+    file_mtime REAL NOT NULL,
+    valid      INTEGER NOT NULL,
+    error      TEXT,
+    duration   REAL,
+    width      INTEGER,
+    height     INTEGER,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS quarantine (
+    video_id   TEXT PRIMARY KEY,
+    attempts   INTEGER NOT NULL,
+    reason     TEXT,
+    updated_at REAL NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+
+def _to_int(value) -> Optional[int]:
+    try:
+        return int(float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class StateStore:
+    """
+    Transactional local state for the pipeline, keyed by TikTok video_id.
+
+    Backed by SQLite in WAL mode so readers never block the writer. Each thread
+    gets its own connection; writes go through `transaction()`, which takes the
+    write lock up front (BEGIN IMMEDIATE) so concurrent stages serialize
+    cleanly instead of failing on lock upgrades.
+    """
+
+    def __init__(self, path: str, timeout: float = 30.0):
+        self.path = path
+        self.timeout = timeout
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.connection().executescript(_SCHEMA)
+
+    @classmethod
+    def for_download_dir(cls, download_dir: str) -> "StateStore":
+        return cls(os.path.join(download_dir, STATE_DB_FILE))
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None)
+            conn.row_factory = sqlite3.Row
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def close(self) -> None:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+
+    # -- meta -----------------------------------------------------------------
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.connection().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return row["value"] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def meta_items(self, prefix: str) -> Dict[str, str]:
+        """Every meta key starting with `prefix`, with its value."""
+        rows = self.connection().execute(
+            "SELECT key, value FROM meta WHERE substr(key, 1, ?) = ? ORDER BY key", (len(prefix), prefix)
+        ).fetchall()
+        return {row["key"]: row["value"] for row in rows}
+
+    # -- videos ---------------------------------------------------------------
+
+    def record_metadata(self, rows: Iterable[Dict[str, str]]) -> int:
+        """Upserts pyktok metadata rows. Returns how many rows carried a video_id."""
+        with self.transaction() as conn:
+            return self._upsert_metadata(conn, rows)
+
+    @staticmethod
+    def _upsert_metadata(conn: sqlite3.Connection, rows: Iterable[Dict[str, str]]) -> int:
+        count = 0
+        now = time.time()
+        for row in rows:
+            video_id = (row.get("video_id") or "").strip()
+            if not video_id:
+                continue
+            conn.execute(
+                """
+                INSERT INTO videos (video_id, author_username, video_description,
+                                    video_timestamp, play_count, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    author_username   = excluded.author_username,
+                    video_description = excluded.video_description,
+                    video_timestamp   = excluded.video_timestamp,
+                    play_count        = COALESCE(excluded.play_count, videos.play_count),
+                    updated_at        = excluded.updated_at
+                """,
+                (
+                    video_id,
+                    (row.get("author_username") or "").strip(),
+                    row.get("video_description"),
+                    row.get("video_timestamp"),
+                    _to_int(row.get("video_playcount")),
+                    now,
+                ),
+            )
+            count += 1
+        return count
+
+    def _set_status(self, video_id: str, assignments: str, params: tuple) -> None:
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT INTO videos (video_id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT(video_id) DO NOTHING",
+                (video_id, now),
+            )
+            conn.execute(
+                f"UPDATE videos SET {assignments}, updated_at = ? WHERE video_id = ?",
+                params + (now, video_id),
+            )
+
+    def mark_downloaded(self, video_id: str, filename: str) -> None:
+        self._set_status(
+            video_id,
+            "download_status = ?, filename = ?, downloaded_at = ?, download_error = NULL",
+            (DOWNLOAD_DONE, filename, time.time()),
+        )
+
+    def mark_download_failed(self, video_id: str, error: str) -> None:
+        self._set_status(
+            video_id, "download_status = ?, download_error = ?", (DOWNLOAD_FAILED, error)
+        )
+
+    def mark_uploaded(self, video_id: str, youtube_id: str, title: str) -> None:
+        self._set_status(
+            video_id,
+            "upload_status = ?, youtube_id = ?, title = ?, uploaded_at = ?, upload_error = NULL",
+            (UPLOAD_DONE, youtube_id, title, time.time()),
+        )
+
+    def mark_upload_failed(self, video_id: str, error: str) -> None:
+        self._set_status(video_id, "upload_status = ?, upload_error = ?", (UPLOAD_FAILED, error))
+
+    def get_video(self, video_id: str) -> Optional[Dict]:
+        row = self.connection().execute(
+            "SELECT * FROM videos WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def is_uploaded(self, video_id: str) -> bool:
+        row = self.connection().execute(
+            "SELECT 1 FROM videos WHERE video_id = ? AND upload_status = ?",
+            (video_id, UPLOAD_DONE),
+        ).fetchone()
+        return row is not None
+
+    def pending_uploads(self, author_username: Optional[str] = None) -> List[Dict]:
+        """
+        Downloaded videos that have not been uploaded yet, oldest record first,
+        optionally limited to one TikTok author.
+        """
+        # Listing the statuses (rather than NOT IN) lets idx_videos_status be used.
+        query = "SELECT * FROM videos WHERE upload_status IN (?, ?) AND download_status = ?"
+        params = [UPLOAD_PENDING, UPLOAD_FAILED, DOWNLOAD_DONE]
+        if author_username is not None:
+            query += " AND author_username = ?"
+            params.append(author_username)
+        rows = self.connection().execute(query + " ORDER BY rowid", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def uploaded_videos(self, author_username: Optional[str] = None) -> List[Dict]:
+        """Videos recorded as uploaded, with their YouTube id, oldest upload first."""
+        query = "SELECT * FROM videos WHERE upload_status = ? AND youtube_id IS NOT NULL"
+        params = [UPLOAD_DONE]
+        if author_username is not None:
+            query += " AND author_username = ?"
+            params.append(author_username)
+        rows = self.connection().execute(query + " ORDER BY uploaded_at", params).fetchall()
+        return [dict(row) for row in rows]
+
+    def summary(self) -> Dict:
+        """Video counts by status, upload backlog, last upload and sync marks, for status reports."""
+        conn = self.connection()
+        downloads = {
+            row[0]: row[1]
+            for row in conn.execute("SELECT download_status, COUNT(*) FROM videos GROUP BY download_status")
+        }
+        uploads = {
+            row[0]: row[1]
+            for row in conn.execute("SELECT upload_status, COUNT(*) FROM videos GROUP BY upload_status")
+        }
+        pending = conn.execute(
+            "SELECT COUNT(*) FROM videos WHERE upload_status IN (?, ?) AND download_status = ?",
+            (UPLOAD_PENDING, UPLOAD_FAILED, DOWNLOAD_DONE),
+        ).fetchone()[0]
+        last_upload = conn.execute("SELECT MAX(uploaded_at) FROM videos").fetchone()[0]
+        marks = {
+            row["account"]: {"newest_video_id": row["newest_video_id"], "updated_at": row["updated_at"]}
+            for row in conn.execute("SELECT * FROM sync_marks ORDER BY account")
+        }
+        return {
+            "videos": sum(downloads.values()),
+            "download_status": downloads,
+            "upload_status": uploads,
+            "pending_uploads": pending,
+            "last_upload_at": last_upload,
+            "sync_marks": marks,
+        }
+
+    def mark_upload_missing(self, video_ids: List[str], requeue: bool = False) -> None:
+        """Flags uploads YouTube no longer has; `requeue` makes them pending uploads again."""
+        now = time.time()
+        with self.transaction() as conn:
+            if requeue:
+                # An evicted file has to be downloaded again before it can be re-uploaded.
+                conn.executemany(
+                    "UPDATE videos SET upload_status = ?, youtube_id = NULL, upload_error = ?, updated_at = ?, "
+                    "download_status = CASE WHEN download_status = ? THEN ? ELSE download_status END "
+                    "WHERE video_id = ?",
+                    [
+                        (UPLOAD_PENDING, "missing on YouTube", now, DOWNLOAD_EVICTED, DOWNLOAD_PENDING, video_id)
+                        for video_id in video_ids
+                    ],
+                )
+            else:
+                conn.executemany(
+                    "UPDATE videos SET upload_status = ?, updated_at = ? WHERE video_id = ?",
+                    [(UPLOAD_MISSING, now, video_id) for video_id in video_ids],
+                )
+
+    def eviction_candidates(self) -> List[Dict]:
+        """
+        Downloaded videos whose upload is settled (uploaded or a duplicate),
+        so their file may be deleted; oldest upload first.
+        """
+        rows = self.connection().execute(
+            "SELECT * FROM videos WHERE upload_status IN (?, ?) AND download_status = ? AND filename IS NOT NULL "
+            "ORDER BY COALESCE(uploaded_at, updated_at)",
+            (UPLOAD_DONE, UPLOAD_DUPLICATE, DOWNLOAD_DONE),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    def mark_evicted(self, video_id: str) -> None:
+        self._set_status(video_id, "download_status = ?", (DOWNLOAD_EVICTED,))
+
+    def set_title(self, video_id: str, title: str) -> None:
+        self._set_status(video_id, "title = ?", (title,))
+
+    def mark_duplicate(self, video_id: str, original: Dict) -> None:
+        """Marks a video as a copy of `original`, an uploaded video's row."""
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE videos SET upload_status = ?, youtube_id = ?, upload_error = NULL, updated_at = ? "
+                "WHERE video_id = ?",
+                (UPLOAD_DUPLICATE, original["youtube_id"], time.time(), video_id),
+            )
+            conn.execute(
+                "UPDATE fingerprints SET duplicate_of = ? WHERE video_id = ?",
+                (original["video_id"], video_id),
+            )
+
+    # -- content fingerprints -------------------------------------------------
+
+    def get_fingerprint(self, video_id: str) -> Optional[Dict]:
+        row = self.connection().execute(
+            "SELECT * FROM fingerprints WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_fingerprint(self, video_id: str, file_size: int, file_mtime: float, partial_hash: str) -> None:
+        """Stores a partial fingerprint; a changed file also drops its full hash."""
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO fingerprints (video_id, file_size, file_mtime, partial_hash, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    file_size    = excluded.file_size,
+                    file_mtime   = excluded.file_mtime,
+                    partial_hash = excluded.partial_hash,
+                    full_hash    = NULL,
+                    updated_at   = excluded.updated_at
+                """,
+                (video_id, file_size, file_mtime, partial_hash, time.time()),
+            )
+
+    def set_full_hash(self, video_id: str, full_hash: str) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE fingerprints SET full_hash = ?, updated_at = ? WHERE video_id = ?",
+                (full_hash, time.time(), video_id),
+            )
+
+    def uploaded_with_fingerprint(
+        self, file_size: int, partial_hash: str, exclude_video_id: Optional[str] = None
+    ) -> List[Dict]:
+        """Uploaded videos whose size and partial hash match, with their fingerprint."""
+        rows = self.connection().execute(
+            """
+            SELECT f.*, v.filename, v.youtube_id
+            FROM fingerprints f JOIN videos v ON v.video_id = f.video_id
+            WHERE f.file_size = ? AND f.partial_hash = ? AND v.upload_status = ? AND f.video_id != ?
+            ORDER BY v.uploaded_at
+            """,
+            (file_size, partial_hash, UPLOAD_DONE, exclude_video_id or ""),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    # -- transcode cache ------------------------------------------------------
+
+    def transcode_output_for(self, video_id: str) -> Optional[str]:
+        """The processed copy made from a video's content, relative to its download dir, if any."""
+        row = self.connection().execute(
+            "SELECT t.output_file FROM fingerprints f JOIN transcodes t ON t.source_hash = f.full_hash "
+            "WHERE f.video_id = ?",
+            (video_id,),
+        ).fetchone()
+        return row["output_file"] if row else None
+
+    def get_transcode(self, source_hash: str) -> Optional[Dict]:
+        row = self.connection().execute(
+            "SELECT * FROM transcodes WHERE source_hash = ?", (source_hash,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_transcode(self, source_hash: str, action: str, output_file: Optional[str], reasons: List[str]) -> None:
+        """Records how content with this hash was normalized; output_file is relative to the download dir."""
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO transcodes (source_hash, action, output_file, reasons, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(source_hash) DO UPDATE SET
+                    action      = excluded.action,
+                    output_file = excluded.output_file,
+                    reasons     = excluded.reasons,
+                    updated_at  = excluded.updated_at
+                """,
+                (source_hash, action, output_file, "; ".join(reasons), time.time()),
+            )
+
+    # -- mp4 probes and quarantine -------------------------------------------
+
+    def get_probe(self, video_id: str) -> Optional[Dict]:
+        row = self.connection().execute(
+            "SELECT * FROM probes WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_probe(self, video_id: str, file_size: int, file_mtime: float, info: Dict) -> None:
+        """Stores a probe of the file with this size and mtime (see mp4_probe.probe_boxes)."""
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO probes (video_id, file_size, file_mtime, valid, error, duration, width, height, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    file_size  = excluded.file_size,
+                    file_mtime = excluded.file_mtime,
+                    valid      = excluded.valid,
+                    error      = excluded.error,
+                    duration   = excluded.duration,
+                    width      = excluded.width,
+                    height     = excluded.height,
+                    updated_at = excluded.updated_at
+                """,
+                (
+                    video_id, file_size, file_mtime, int(info["valid"]), info["error"],
+                    info["duration"], info["width"], info["height"], time.time(),
+                ),
+            )
+
+    def mark_quarantined(self, video_id: str, reason: str) -> int:
+        """Queues a broken download to be fetched again; returns how often it has been quarantined."""
+        now = time.time()
+        with self.transaction() as conn:
+            conn.execute(
+                "UPDATE videos SET download_status = ?, download_error = ?, updated_at = ? WHERE video_id = ?",
+                (DOWNLOAD_QUARANTINED, reason, now, video_id),
+            )
+            conn.execute(
+                """
+                INSERT INTO quarantine (video_id, attempts, reason, updated_at) VALUES (?, 1, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    attempts   = quarantine.attempts + 1,
+                    reason     = excluded.reason,
+                    updated_at = excluded.updated_at
+                """,
+                (video_id, reason, now),
+            )
+            return conn.execute(
+                "SELECT attempts FROM quarantine WHERE video_id = ?", (video_id,)
+            ).fetchone()["attempts"]
+
+    def redownload_candidates(self, author_username: str, max_attempts: int) -> List[Dict]:
+        """Quarantined videos of an author quarantined at most `max_attempts` times."""
+        rows = self.connection().execute(
+            "SELECT v.* FROM videos v JOIN quarantine q ON q.video_id = v.video_id "
+            "WHERE v.download_status = ? AND v.author_username = ? AND q.attempts <= ? ORDER BY v.rowid",
+            (DOWNLOAD_QUARANTINED, author_username, max_attempts),
+        ).fetchall()
+        return [dict(row) for row in rows]
+
+    # -- resumable upload sessions -------------------------------------------
+
+    def get_upload_session(self, video_id: str) -> Optional[Dict]:
+        row = self.connection().execute(
+            "SELECT * FROM upload_sessions WHERE video_id = ?", (video_id,)
+        ).fetchone()
+        return dict(row) if row else None
+
+    def save_upload_session(
+        self, video_id: str, video_path: str, file_size: int, file_mtime: float,
+        session_uri: str, bytes_sent: int,
+    ) -> None:
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO upload_sessions (video_id, video_path, file_size, file_mtime,
+                                             session_uri, bytes_sent, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(video_id) DO UPDATE SET
+                    video_path  = excluded.video_path,
+                    file_size   = excluded.file_size,
+                    file_mtime  = excluded.file_mtime,
+                    session_uri = excluded.session_uri,
+                    bytes_sent  = excluded.bytes_sent,
+                    updated_at  = excluded.updated_at
+                """,
+                (video_id, video_path, file_size, file_mtime, session_uri, bytes_sent, time.time()),
+            )
+
+    def clear_upload_session(self, video_id: str) -> None:
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM upload_sessions WHERE video_id = ?", (video_id,))
+
+    # -- incremental sync ----------------------------------------------------
+
+    def get_sync_mark(self, account: str) -> Optional[int]:
+        """Newest TikTok video_id known to be fully synced for an account."""
+        row = self.connection().execute(
+            "SELECT newest_video_id FROM sync_marks WHERE account = ?", (account,)
+        ).fetchone()
+        return row["newest_video_id"] if row else None
+
+    def set_sync_mark(self, account: str, video_id: int) -> None:
+        """Records a high-water mark; the stored mark only ever moves forward."""
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO sync_marks (account, newest_video_id, updated_at) VALUES (?, ?, ?)
+                ON CONFLICT(account) DO UPDATE SET
+                    newest_video_id = MAX(sync_marks.newest_video_id, excluded.newest_video_id),
+                    updated_at      = excluded.updated_at
+                """,
+                (account, int(video_id), time.time()),
+            )
+
+    # -- quota accounting ----------------------------------------------------
+
+    def get_quota_usage(self, project: str, day: str) -> int:
+        row = self.connection().execute(
+            "SELECT units FROM quota_usage WHERE project = ? AND day = ?", (project, day)
+        ).fetchone()
+        return row["units"] if row else 0
+
+    def reserve_quota(self, project: str, day: str, units: int, budget: int) -> bool:
+        """Atomically adds `units` to the day's usage unless that would exceed `budget`."""
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT units FROM quota_usage WHERE project = ? AND day = ?", (project, day)
+            ).fetchone()
+            used = row["units"] if row else 0
+            if used + units > budget:
+                return False
+            conn.execute(
+                """
+                INSERT INTO quota_usage (project, day, units, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(project, day) DO UPDATE SET
+                    units = quota_usage.units + excluded.units,
+                    updated_at = excluded.updated_at
+                """,
+                (project, day, units, time.time()),
+            )
+            return True
+
+    def raise_quota_usage(self, project: str, day: str, units: int) -> None:
+        """Raises the day's recorded usage to at least `units`."""
+        with self.transaction() as conn:
+            conn.execute(
+                """
+                INSERT INTO quota_usage (project, day, units, updated_at) VALUES (?, ?, ?, ?)
+                ON CONFLICT(project, day) DO UPDATE SET
+                    units = MAX(quota_usage.units, excluded.units),
+                    updated_at = excluded.updated_at
+                """,
+                (project, day, units, time.time()),
+            )
+
+    # -- legacy CSV import ----------------------------------------------------
+
+    def import_csv_history(self, download_dir: str) -> None:
+        """
+        Imports metadata.csv and youtube_uploads.csv from download_dir.
+
+        metadata.csv is read incrementally: the byte offset reached and the
+        header seen are kept in the store, so each call only parses rows
+        appended since the last one. youtube_uploads.csv, which nothing
+        writes any more, is imported once. Each import is a single
+        transaction.
+        """
+        self.ingest_metadata(os.path.join(download_dir, METADATA_FILE), download_dir)
+
+        upload_log_path = os.path.join(download_dir, "youtube_uploads.csv")
+        meta_key = f"csv_import:{os.path.abspath(upload_log_path)}"
+        if os.path.exists(upload_log_path) and self.get_meta(meta_key) is None:
+            now = time.time()
+            uploads = []
+            with open(upload_log_path, "r", newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    tiktok_id = (row.get("tiktok_video_id") or "").strip()
+                    youtube_id = (row.get("youtube_video_id") or "").strip()
+                    if tiktok_id and youtube_id:
+                        uploads.append((tiktok_id, UPLOAD_DONE, youtube_id, row.get("title") or "", now, now))
+            with self.transaction() as conn:
+                conn.executemany(
+                    """
+                    INSERT INTO videos (video_id, upload_status, youtube_id, title, uploaded_at, updated_at)
+                    VALUES (?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(video_id) DO UPDATE SET
+                        upload_status = excluded.upload_status,
+                        youtube_id    = excluded.youtube_id,
+                        title         = excluded.title,
+                        uploaded_at   = excluded.uploaded_at,
+                        updated_at    = excluded.updated_at
+                    """,
+                    uploads,
+                )
+                conn.execute("INSERT INTO meta (key, value) VALUES (?, ?)", (meta_key, str(now)))
+            logging.info("Imported %d uploads from %s into the state store", len(uploads), upload_log_path)
+
+    def ingest_metadata(self, metadata_path: str, download_dir: str) -> int:
+        """
+        Records the rows appended to a pyktok metadata csv since the last call
+        and marks those whose video file is in download_dir as downloaded.
+        Returns the number of rows read.
+        """
+        if not os.path.exists(metadata_path):
+            return 0
+        path = os.path.abspath(metadata_path)
+        offset_key = f"csv_offset:{path}"
+        saved = self.get_meta(offset_key)
+        if saved is not None:
+            position = json.loads(saved)
+            offset, header = position["offset"], position["header"]
+        elif self.get_meta(f"csv_import:{path}") is not None:
+            # Imported in full by an older version; rows appended since then
+            # were recorded by the downloader, so only newer rows are needed.
+            offset, header = os.path.getsize(metadata_path), read_header(metadata_path)
+        else:
+            offset, header = 0, None
+
+        rows, new_offset, new_header = read_new_rows(metadata_path, offset, header)
+        if new_offset == offset and new_header == header:
+            return 0
+
+        now = time.time()
+        downloaded = []
+        for row in rows:
+            video_id = (row.get("video_id") or "").strip()
+            username = (row.get("author_username") or "").strip()
+            filename = f"@{username}_video_{video_id}.mp4"
+            if video_id and username and os.path.exists(os.path.join(download_dir, filename)):
+                downloaded.append((DOWNLOAD_DONE, filename, now, now, video_id, DOWNLOAD_DONE))
+        with self.transaction() as conn:
+            self._upsert_metadata(conn, rows)
+            conn.executemany(
+                "UPDATE videos SET download_status = ?, filename = ?, downloaded_at = ?, "
+                "updated_at = ? WHERE video_id = ? AND download_status != ?",
+                downloaded,
+            )
+            conn.execute(
+                "INSERT INTO meta (key, value) VALUES (?, ?) "
+                "ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (offset_key, json.dumps({"offset": new_offset, "header": new_header})),
+            )
+        if rows:
+            logging.info("Imported %d new rows from %s into the state store", len(rows), metadata_path)
+        return len(rows)
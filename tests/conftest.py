@@ -0,0 +1,29 @@
+import struct
+import pytest
+
+from state_store import StateStore
+
+
+def _box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+@pytest.fixture
+def mp4_bytes():
+    """Builds the smallest mp4 the pre-upload probe accepts: ftyp, moov with one video track, mdat."""
+    def build(payload=b"frames", width=1080, height=1920, duration=1.0):
+        ticks = int(duration * 1000)
+        mvhd = _box(b"mvhd", struct.pack(">B3xIIII", 0, 0, 0, 1000, ticks) + b"\0" * 80)
+        tkhd = _box(b"tkhd", struct.pack(">B3xIIIII", 0, 0, 0, 1, 0, ticks) + b"\0" * 52
+                    + struct.pack(">II", width << 16, height << 16))
+        return (_box(b"ftyp", b"isom\0\0\2\0isommp41") + _box(b"moov", mvhd + _box(b"trak", tkhd))
+                + _box(b"mdat", payload))
+    return build
+
+
+@pytest.fixture
+def store(tmp_path):
+    """Create a state store in the temporary download directory."""
+    store = StateStore.for_download_dir(str(tmp_path))
+    yield store
+    store.close()
@@ -1,4 +1,9 @@
+import os
+import time
 import pytest
+import threading
+from datetime import datetime, timedelta, timezone
+import auth
 from auth import get_authenticated_service
 from unittest.mock import MagicMock, patch
 import pickle
@@ -64,3 +69,72 @@ def test_invalid_credentials_file(mocker, tmp_path):
 
     with pytest.raises(Exception, match="Invalid credentials file"):
         get_authenticated_service()
+
+
+class FakeCredentials:
+    """Picklable stand-in for google.oauth2 credentials."""
+
+    def __init__(self, valid=True, expiry=None):
+        self.valid = valid
+        self.expiry = expiry
+        self.refresh_token = "mock_refresh"
+        self.refreshes = 0
+
+    def refresh(self, request):
+        time.sleep(0.05)
+        self.refreshes += 1
+        self.valid = True
+        self.expiry = None
+
+    def before_request(self, request, method, url, headers):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def clear_auth_cache():
+    auth.clear_service_cache()
+    yield
+    auth.clear_service_cache()
+
+
+def test_service_cached_per_thread(tmp_path):
+    """Each thread builds its own service once; credentials are loaded once."""
+    token_file = tmp_path / "token.pickle"
+    token_file.write_bytes(pickle.dumps(FakeCredentials()))
+
+    first = get_authenticated_service("client_secrets.json", str(token_file))
+    assert get_authenticated_service("client_secrets.json", str(token_file)) is first
+
+    other = []
+    thread = threading.Thread(
+        target=lambda: other.append(get_authenticated_service("client_secrets.json", str(token_file)))
+    )
+    thread.start()
+    thread.join()
+
+    assert other[0] is not first
+    assert other[0]._http is not first._http
+    assert other[0]._http.credentials is first._http.credentials
+    assert hasattr(first, "videos")
+
+
+def test_concurrent_refresh_is_single_flight(tmp_path, mocker):
+    """Threads that see an expiring token at once trigger one refresh and one write."""
+    token_file = tmp_path / "tokens" / "channel.pickle"
+    token_file.parent.mkdir()
+    soon = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(seconds=30)
+    token_file.write_bytes(pickle.dumps(FakeCredentials(expiry=soon)))
+    mocker.patch("auth.Request")
+    manager = auth.CredentialManager("client_secrets.json", str(token_file))
+    save = mocker.spy(manager, "_save")
+
+    threads = [threading.Thread(target=manager.ensure_fresh) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert manager.credentials.refreshes == 1
+    assert save.call_count == 1
+    assert pickle.loads(token_file.read_bytes()).refreshes == 1
+    assert sorted(os.listdir(token_file.parent)) == ["channel.pickle"]
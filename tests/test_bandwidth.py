@@ -0,0 +1,52 @@
+import threading
+from datetime import datetime
+from bandwidth import BandwidthLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_chunks_beyond_the_burst_wait_for_the_rate(mocker):
+    """Bytes beyond the bucket are paid for at `rate_bytes` per second, in order."""
+    sleep = mocker.patch("bandwidth.time.sleep")
+    clock = FakeClock()
+    limiter = BandwidthLimiter(1000, burst_bytes=500, clock=clock)
+
+    assert limiter.consume(500) == 0.0
+    assert limiter.consume(1000) == 1.0
+    # The next caller queues behind the bytes already booked.
+    assert limiter.consume(500) == 1.5
+    clock.now = 10.0
+    assert limiter.consume(500) == 0.0
+    assert [call.args[0] for call in sleep.call_args_list] == [1.0, 1.5]
+
+
+def test_cap_only_applies_within_its_hours(mocker):
+    """Outside the configured hours uploads are not throttled; the window may wrap midnight."""
+    sleep = mocker.patch("bandwidth.time.sleep")
+    hour = {"now": 20}
+    now = lambda: datetime(2024, 1, 1, hour["now"])
+
+    business = BandwidthLimiter(100, burst_bytes=0, hours=(9, 18), clock=FakeClock(), now=now)
+    night = BandwidthLimiter(100, burst_bytes=0, hours=(22, 6), clock=FakeClock(), now=now)
+
+    assert business.consume(1000) == 0.0
+    assert not night.active()
+    hour["now"] = 10
+    assert business.consume(100) == 1.0
+    hour["now"] = 2
+    assert night.active() and not business.active()
+    sleep.assert_called_once_with(1.0)
+
+
+def test_cancel_interrupts_the_wait():
+    """A set cancel event ends the wait right away."""
+    cancel = threading.Event()
+    cancel.set()
+    limiter = BandwidthLimiter(1, burst_bytes=0)
+    assert limiter.consume(3600, cancel) == 3600.0
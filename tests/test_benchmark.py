@@ -0,0 +1,46 @@
+from benchmark import FakeServerConfig, run_benchmark
+
+
+def test_benchmark_runs_end_to_end(tmp_path):
+    """Every synthetic video is downloaded and uploaded despite injected errors."""
+    results = run_benchmark(
+        10,
+        video_size=4096,
+        work_dir=str(tmp_path),
+        download_workers=2,
+        tiktok=FakeServerConfig(error_rate=0.05),
+    )
+
+    download, upload = results["download"], results["upload"]
+    assert download.completed == 10 and upload.completed == 10
+    assert download.bytes == upload.bytes == 10 * 4096
+    summary = upload.summary()
+    assert summary["videos_per_second"] > 0
+    assert 0 < summary["p50_latency"] <= summary["p99_latency"]
+    assert summary["peak_rss_mb"] > 0
+    # Scratch download dirs are removed afterwards.
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_benchmark_quota_injection_stops_uploads(tmp_path):
+    """The fake YouTube endpoint reports quotaExceeded after the configured uploads."""
+    results = run_benchmark(
+        6,
+        video_size=1024,
+        work_dir=str(tmp_path),
+        download_workers=2,
+        youtube=FakeServerConfig(quota_after=4),
+    )
+
+    assert results["download"].completed == 6
+    assert results["upload"].completed == 4
+
+
+def test_startup_benchmark_times_each_command():
+    """Startup timings come from fresh interpreters, one entry per command."""
+    from benchmark import startup_benchmark
+
+    results = startup_benchmark(["status"], repeat=1)
+
+    assert set(results) == {"main", "status", "status (whole process)"}
+    assert all(timing["median_ms"] > 0 for timing in results.values())
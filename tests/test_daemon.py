@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import asyncio
+import urllib.request
+import pytest
+import daemon
+from daemon import SyncDaemon
+
+
+def _write_config(path, sources, **settings):
+    config = {
+        "download_dir": str(path.parent / "downloads"),
+        "poll_interval": 0.05,
+        "poll_jitter": 0,
+        "channels": {"main": {}},
+        "sources": [{"tiktok_username": name, "channel": "main"} for name in sources],
+    }
+    config.update(settings)
+    path.write_text(json.dumps(config))
+    # Make sure the reload check sees a new mtime even on coarse clocks.
+    stamp = time.time() + len(sources)
+    os.utime(path, (stamp, stamp))
+
+
+@pytest.fixture
+def config_file(tmp_path, mocker):
+    mocker.patch.object(daemon, "CONFIG_CHECK_INTERVAL", 0.01)
+    path = tmp_path / "config.json"
+    _write_config(path, ["one"])
+    return path
+
+
+def test_polls_sources_and_reloads_config(config_file, mocker):
+    """Sources sync on their interval, and sources added to the config start syncing."""
+    synced = []
+
+    async def fake_pipeline(username, download_dir, **kwargs):
+        synced.append(username)
+        return 0
+
+    mocker.patch("daemon.run_pipeline", side_effect=fake_pipeline)
+    sync_daemon = SyncDaemon(str(config_file))
+
+    async def scenario():
+        task = asyncio.create_task(sync_daemon.run(install_signal_handlers=False))
+        await asyncio.sleep(0.2)
+        _write_config(config_file, ["one", "two"])
+        await asyncio.sleep(0.2)
+        sync_daemon.request_stop()
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(scenario())
+
+    assert synced.count("one") >= 3
+    assert "two" in synced
+    assert {status.tiktok_username for status in sync_daemon.accounts.values()} == {"one", "two"}
+
+
+def test_stop_lets_running_syncs_finish(config_file, mocker):
+    """On stop, running pipelines are told to stop and cancel uploads, and are awaited."""
+    seen = {}
+
+    async def fake_pipeline(username, download_dir, stop_uploads, cancel_uploads, on_queue_depth, **kwargs):
+        on_queue_depth(3)
+        await stop_uploads.wait()
+        seen["cancelled"] = cancel_uploads.is_set()
+        return 2
+
+    mocker.patch("daemon.run_pipeline", side_effect=fake_pipeline)
+    sync_daemon = SyncDaemon(str(config_file))
+
+    async def scenario():
+        task = asyncio.create_task(sync_daemon.run(install_signal_handlers=False))
+        await asyncio.sleep(0.05)
+        status = next(iter(sync_daemon.accounts.values()))
+        assert status.syncing and status.queue_depth == 3
+        sync_daemon.request_stop()
+        await asyncio.wait_for(task, 5)
+        return status
+
+    status = asyncio.run(scenario())
+
+    assert seen == {"cancelled": True}
+    assert status.last_uploaded == 2
+    assert not status.syncing
+
+
+def test_status_endpoint(config_file, mocker):
+    """GET /health reports each source's state as JSON."""
+    _write_config(config_file, ["one"], status_port=0, poll_interval=60)
+
+    async def fake_pipeline(username, download_dir, **kwargs):
+        return 1
+
+    mocker.patch("daemon.run_pipeline", side_effect=fake_pipeline)
+    sync_daemon = SyncDaemon(str(config_file))
+
+    async def scenario():
+        task = asyncio.create_task(sync_daemon.run(install_signal_handlers=False))
+        await asyncio.sleep(0.1)
+        url = f"http://127.0.0.1:{sync_daemon.status_address[1]}/health"
+        body = await asyncio.to_thread(lambda: json.load(urllib.request.urlopen(url)))
+        sync_daemon.request_stop()
+        await asyncio.wait_for(task, 5)
+        return body
+
+    body = asyncio.run(scenario())
+
+    assert sync_daemon.status_address[0] == "127.0.0.1"
+    assert body["status"] == "running"
+    [account] = body["accounts"]
+    assert account["tiktok_username"] == "one"
+    assert account["last_uploaded"] == 1
+    assert account["next_sync"] > account["last_sync_finished"]
+
+
+def test_reload_keeps_the_cache_of_running_syncs(config_file, mocker):
+    """A reloaded cache budget takes over only after the running sync has finished."""
+    _write_config(config_file, ["one"], cache_budget_bytes=1000)
+    caches = []
+    release = asyncio.Event()
+
+    async def fake_pipeline(username, download_dir, cache, **kwargs):
+        caches.append(cache.budget_bytes)
+        if len(caches) == 1:
+            await release.wait()
+        return 0
+
+    mocker.patch("daemon.run_pipeline", side_effect=fake_pipeline)
+    sync_daemon = SyncDaemon(str(config_file))
+
+    async def scenario():
+        task = asyncio.create_task(sync_daemon.run(install_signal_handlers=False))
+        await asyncio.sleep(0.05)
+        _write_config(config_file, ["one", "two"], cache_budget_bytes=2000)
+        await asyncio.sleep(0.1)
+        assert caches == [1000]
+        assert sync_daemon._cache.budget_bytes == 1000
+        release.set()
+        await asyncio.sleep(0.1)
+        sync_daemon.request_stop()
+        await asyncio.wait_for(task, 5)
+
+    asyncio.run(scenario())
+
+    assert caches[0] == 1000
+    assert set(caches[1:]) == {2000}
@@ -0,0 +1,118 @@
+import asyncio
+from disk_cache import DiskCache
+from fingerprint import find_uploaded_duplicate
+from state_store import DOWNLOAD_DONE, DOWNLOAD_EVICTED
+
+
+def _downloaded(store, tmp_path, video_id, size=100, uploaded_at=None):
+    filename = f"@user_video_{video_id}.mp4"
+    (tmp_path / filename).write_bytes(video_id.encode().ljust(size, b"x"))
+    store.record_metadata([{"video_id": video_id, "author_username": "user"}])
+    store.mark_downloaded(video_id, filename)
+    if uploaded_at is not None:
+        store.mark_uploaded(video_id, f"yt{video_id}", "title")
+        store.connection().execute("UPDATE videos SET uploaded_at = ? WHERE video_id = ?", (uploaded_at, video_id))
+    return tmp_path / filename
+
+
+def test_evicts_oldest_uploads_and_never_pending(store, tmp_path):
+    """Uploaded files go oldest first, only as far as needed; pending ones stay."""
+    newer = _downloaded(store, tmp_path, "1", uploaded_at=200)
+    older = _downloaded(store, tmp_path, "2", uploaded_at=100)
+    pending = _downloaded(store, tmp_path, "3")
+    cache = DiskCache.for_download_dir(str(tmp_path), store, budget_bytes=350, wait_for_uploads=False)
+    assert cache.used == 300
+
+    assert asyncio.run(cache.reserve()) == 100
+    assert not older.exists()
+    assert newer.exists() and pending.exists()
+    assert store.get_video("2")["download_status"] == DOWNLOAD_EVICTED
+    assert store.get_video("1")["download_status"] == DOWNLOAD_DONE
+
+    assert asyncio.run(cache.reserve()) == 100
+    assert not newer.exists()
+    # Only the pending video's file could make room now.
+    assert asyncio.run(cache.reserve()) is None
+    assert pending.exists()
+
+
+def test_reserve_waits_for_uploads(store, tmp_path):
+    """A full cache pauses downloads until an upload makes a file evictable."""
+    _downloaded(store, tmp_path, "1")
+    cache = DiskCache.for_download_dir(str(tmp_path), store, budget_bytes=150, poll_interval=0.01)
+
+    async def scenario():
+        waiting = asyncio.create_task(cache.reserve())
+        await asyncio.sleep(0.05)
+        assert not waiting.done()
+        store.mark_uploaded("1", "yt1", "title")
+        return await asyncio.wait_for(waiting, 1)
+
+    assert asyncio.run(scenario()) == 100
+    assert cache.used == 0
+
+
+def test_evicted_video_still_detected_as_duplicate(store, tmp_path):
+    """The full hash is kept before eviction, so reposts are still recognized."""
+    _downloaded(store, tmp_path, "1", uploaded_at=100)
+    cache = DiskCache.for_download_dir(str(tmp_path), store, budget_bytes=100)
+    cache.evict(100)
+
+    repost = tmp_path / "repost.mp4"
+    repost.write_bytes(b"1".ljust(100, b"x"))
+    assert find_uploaded_duplicate(store, str(tmp_path), "2", str(repost))["youtube_id"] == "yt1"
+
+
+def test_concurrent_reserves_evict_each_video_once(store, tmp_path, mocker):
+    """Downloads reserving at once don't race for the same victim or lose track of the bytes in use."""
+    import disk_cache
+    import time
+
+    for n in range(6):
+        _downloaded(store, tmp_path, str(n), uploaded_at=n)
+    cache = DiskCache.for_download_dir(str(tmp_path), store, budget_bytes=600, wait_for_uploads=False)
+    real_hash = disk_cache.content_hash
+
+    def slow_hash(*args):
+        # Widens the window in which two evictions could pick the same file.
+        time.sleep(0.02)
+        return real_hash(*args)
+
+    mocker.patch("disk_cache.content_hash", side_effect=slow_hash)
+
+    async def scenario():
+        return await asyncio.gather(*(cache.reserve() for _ in range(4)))
+
+    assert asyncio.run(scenario()) == [100] * 4
+    evicted = [n for n in range(6) if store.get_video(str(n))["download_status"] == DOWNLOAD_EVICTED]
+    assert evicted == [0, 1, 2, 3]
+    assert cache.used == 200 == cache.refresh()
+
+
+def test_reserve_gives_up_when_nothing_can_become_evictable(store, tmp_path):
+    """A cache full of failed uploads doesn't stall a one-shot sync forever."""
+    _downloaded(store, tmp_path, "1", size=200)
+    store.mark_upload_failed("1", "rejected")
+    cache = DiskCache.for_download_dir(str(tmp_path), store, budget_bytes=100, poll_interval=0.01, max_wait=0.05)
+
+    assert asyncio.run(asyncio.wait_for(cache.reserve(), 1)) is None
+    assert (tmp_path / "@user_video_1.mp4").exists()
+
+
+def test_files_are_hashed_outside_the_lock(store, tmp_path, mocker):
+    """Full hashes of evicted files are computed without blocking other reservations."""
+    import disk_cache
+
+    _downloaded(store, tmp_path, "1", uploaded_at=100)
+    cache = DiskCache.for_download_dir(str(tmp_path), store, budget_bytes=150, wait_for_uploads=False)
+    real_hash = disk_cache.content_hash
+    held = []
+
+    def hash_and_check(*args):
+        held.append(cache._lock.locked())
+        return real_hash(*args)
+
+    mocker.patch("disk_cache.content_hash", side_effect=hash_and_check)
+
+    assert asyncio.run(cache.reserve()) == 100
+    assert held == [False]
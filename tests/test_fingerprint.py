@@ -0,0 +1,51 @@
+import fingerprint
+from fingerprint import find_uploaded_duplicate, fingerprint_video, partial_hash
+
+
+def _uploaded_video(store, tmp_path, video_id, content):
+    filename = f"@user_video_{video_id}.mp4"
+    (tmp_path / filename).write_bytes(content)
+    store.record_metadata([{"video_id": video_id, "author_username": "user"}])
+    store.mark_downloaded(video_id, filename)
+    fingerprint_video(store, video_id, str(tmp_path / filename))
+    store.mark_uploaded(video_id, f"yt{video_id}", "title")
+    return str(tmp_path / filename)
+
+
+def test_partial_hash_reads_only_the_ends(tmp_path, mocker):
+    """Files that differ only in the middle share a partial hash but not a full hash."""
+    mocker.patch.object(fingerprint, "PARTIAL_HASH_BYTES", 4)
+    a = tmp_path / "a.mp4"
+    b = tmp_path / "b.mp4"
+    a.write_bytes(b"headXXXXXXtail")
+    b.write_bytes(b"headYYYYYYtail")
+
+    assert partial_hash(str(a)) == partial_hash(str(b))
+    assert fingerprint.full_hash(str(a)) != fingerprint.full_hash(str(b))
+
+
+def test_duplicate_confirmed_by_full_hash(store, tmp_path, mocker):
+    """A matching partial hash is only a duplicate once the full hashes agree."""
+    mocker.patch.object(fingerprint, "PARTIAL_HASH_BYTES", 4)
+    _uploaded_video(store, tmp_path, "1", b"headXXXXXXtail")
+    full_hash = mocker.spy(fingerprint, "full_hash")
+
+    (tmp_path / "repost.mp4").write_bytes(b"headXXXXXXtail")
+    (tmp_path / "other.mp4").write_bytes(b"headYYYYYYtail")
+    (tmp_path / "unrelated.mp4").write_bytes(b"something else entirely")
+
+    assert find_uploaded_duplicate(store, str(tmp_path), "2", str(tmp_path / "repost.mp4"))["youtube_id"] == "yt1"
+    assert find_uploaded_duplicate(store, str(tmp_path), "3", str(tmp_path / "other.mp4")) is None
+    assert find_uploaded_duplicate(store, str(tmp_path), "4", str(tmp_path / "unrelated.mp4")) is None
+    # The uploaded file's full hash is computed once and then reused.
+    assert full_hash.call_count == 3
+    assert store.get_fingerprint("1")["full_hash"]
+
+
+def test_unverifiable_candidate_is_not_a_duplicate(store, tmp_path):
+    """Without the original file or its full hash the match cannot be confirmed."""
+    original = _uploaded_video(store, tmp_path, "1", b"same content")
+    (tmp_path / "copy.mp4").write_bytes(b"same content")
+    (tmp_path / original).unlink()
+
+    assert find_uploaded_duplicate(store, str(tmp_path), "2", str(tmp_path / "copy.mp4")) is None
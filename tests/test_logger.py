@@ -1,3 +1,5 @@
+import os
+import json
 import logging
 import pytest
 from logger import setup_logger
@@ -44,3 +46,59 @@ def test_log_file_creation(tmp_path, mocker):
     with open(log_file, "r") as file:
         log_contents = file.read()
     assert "Logging to file test" in log_contents
+
+
+@pytest.fixture
+def restore_logging():
+    yield
+    from logger import shutdown_logger
+    shutdown_logger()
+    setup_logger(log_file=os.devnull)
+
+
+def test_queued_json_logging_carries_context(tmp_path, restore_logging):
+    """Queued mode hands records to a listener thread; JSON lines keep the log context."""
+    from logger import log_context, shutdown_logger
+
+    log_file = tmp_path / "pipeline.log"
+    listener = setup_logger(log_file=str(log_file), json_lines=True, queued=True)
+    assert listener is not None
+
+    with log_context(account="user", video_id="42"):
+        logging.getLogger().info("Uploading %s", "clip")
+    logging.getLogger().warning("No context here")
+    shutdown_logger()
+
+    first, second = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert first["message"] == "Uploading clip"
+    assert first["video_id"] == "42" and first["account"] == "user"
+    assert second["level"] == "WARNING" and "video_id" not in second
+
+
+def test_queued_json_logging_keeps_the_exception(tmp_path, restore_logging):
+    """Tracebacks reach the JSON formatter as their own field, not folded into the message."""
+    from logger import shutdown_logger
+
+    log_file = tmp_path / "pipeline.log"
+    setup_logger(log_file=str(log_file), json_lines=True, queued=True)
+    try:
+        1 / 0
+    except ZeroDivisionError:
+        logging.getLogger().exception("Upload of %s failed", "clip")
+    shutdown_logger()
+
+    (entry,) = [json.loads(line) for line in log_file.read_text().splitlines()]
+    assert entry["message"] == "Upload of clip failed"
+    assert "ZeroDivisionError" in entry["exception"]
+
+
+def test_log_file_rotates_by_size(tmp_path, restore_logging):
+    """The log file rolls over at max_bytes and keeps backup_count old files."""
+    log_file = tmp_path / "pipeline.log"
+    setup_logger(log_file=str(log_file), max_bytes=200, backup_count=2)
+
+    for n in range(20):
+        logging.getLogger().info("message number %d with some padding", n)
+
+    names = sorted(p.name for p in tmp_path.iterdir())
+    assert names == ["pipeline.log", "pipeline.log.1", "pipeline.log.2"]
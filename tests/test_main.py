@@ -0,0 +1,39 @@
+import os
+import sys
+import json
+import subprocess
+from main import parse_args
+from state_store import StateStore
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_sync_is_the_default_command():
+    """Running without a command keeps the old behaviour and flags."""
+    assert parse_args([]).command == "sync"
+    args = parse_args(["--full-resync"])
+    assert args.command == "sync" and args.full_resync
+    assert parse_args(["status", "--json"]).json
+
+
+def test_status_reads_local_state_without_network_clients(tmp_path):
+    """`status` reports from the state store and never imports pyktok or the Google client."""
+    store = StateStore.for_download_dir(str(tmp_path / "tiktok_downloads"))
+    store.record_metadata([{"video_id": "1", "author_username": "user"}])
+    store.mark_downloaded("1", "@user_video_1.mp4")
+    store.set_sync_mark("user", 1)
+    store.close()
+
+    code = (
+        f"import sys; sys.path.insert(0, {REPO_DIR!r}); import main; main.cli(['status', '--json']); "
+        "print([m for m in ('pyktok', 'googleapiclient', 'google_auth_oauthlib') if m in sys.modules])"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], cwd=tmp_path, check=True, capture_output=True, text=True
+    ).stdout.strip().splitlines()
+
+    assert output[-1] == "[]"
+    report = json.loads("\n".join(output[:-1]))
+    channel = report["channels"]["default"]
+    assert channel["pending_uploads"] == 1
+    assert channel["sync_marks"]["user"]["newest_video_id"] == 1
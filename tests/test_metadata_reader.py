@@ -0,0 +1,60 @@
+from metadata_reader import read_new_rows, remap_row
+
+
+def test_reads_only_complete_new_rows(tmp_path):
+    """Each call picks up where the last one stopped, leaving half-written rows."""
+    path = tmp_path / "metadata.csv"
+    path.write_text("video_id,author_username,video_description,video_duration\n1,user,one,10\n")
+
+    rows, offset, header = read_new_rows(str(path))
+    assert rows == [{"video_id": "1", "author_username": "user", "video_description": "one"}]
+
+    with open(path, "a") as f:
+        f.write('2,user,two,11\n3,user,"multi\nline')
+    rows, offset, header = read_new_rows(str(path), offset, header)
+    assert [row["video_id"] for row in rows] == ["2"]
+
+    with open(path, "a") as f:
+        f.write(' description",12\n')
+    rows, offset, header = read_new_rows(str(path), offset, header)
+    assert rows == [{"video_id": "3", "author_username": "user", "video_description": "multi\nline description"}]
+    assert read_new_rows(str(path), offset, header)[0] == []
+
+
+def test_header_drift_is_mapped_by_alias(tmp_path):
+    """Columns renamed or reordered by another pyktok version land in the same fields."""
+    path = tmp_path / "metadata.csv"
+    path.write_text("author_unique_id,video_create_time,id,video_play_count\nuser,1700000000,9,42\n")
+
+    rows, _, _ = read_new_rows(str(path))
+
+    assert rows == [{
+        "author_username": "user", "video_timestamp": "1700000000", "video_id": "9", "video_playcount": "42",
+    }]
+    assert remap_row(["video_id", "author_username", "video_duration"], ["author_unique_id", "id"], ["user", "9"]) == [
+        "9", "user", "",
+    ]
+
+
+def test_replaced_file_is_read_from_the_start(tmp_path):
+    """A file that was truncated or swapped for one with another header is re-read."""
+    path = tmp_path / "metadata.csv"
+    path.write_text("video_id,author_username\n1,user\n2,user\n")
+    _, offset, header = read_new_rows(str(path))
+
+    path.write_text("video_id,author_username,video_description\n5,user,new\n")
+    rows, _, _ = read_new_rows(str(path), offset, header)
+
+    assert [row["video_id"] for row in rows] == ["5"]
+
+
+def test_malformed_row_is_skipped(tmp_path, caplog):
+    """A broken row is logged with its position and the rows after it are still read."""
+    path = tmp_path / "metadata.csv"
+    path.write_text('video_id,author_username\n1,user\n2,"us"er\n3,user\n')
+
+    rows, offset, header = read_new_rows(str(path))
+
+    assert [row["video_id"] for row in rows] == ["1", "3"]
+    assert offset == path.stat().st_size
+    assert "byte 32 (line 3)" in caplog.text
@@ -0,0 +1,71 @@
+import time
+import pytest
+
+from metadata_templates import (
+    DEFAULT_TEMPLATES, YOUTUBE_DESCRIPTION_MAX_BYTES, YOUTUBE_TITLE_MAX, MetadataTemplates, truncate,
+)
+
+
+def _row(description, video_id="7301", username="creator"):
+    return {"video_id": video_id, "author_username": username, "video_description": description}
+
+
+def test_default_templates_keep_the_original_metadata():
+    """Caption as title (or a fallback), the credit line as description and the fixed tags."""
+    assert DEFAULT_TEMPLATES.render(_row("  Morning   run\n#fyp ")) == {
+        "title": "Morning run #fyp",
+        "description": "Credit to @creator on TikTok.",
+        "tags": ["TikTok", "Shorts", "Reels"],
+    }
+    assert DEFAULT_TEMPLATES.render(_row(None))["title"] == "TikTok by @creator (7301)"
+    assert len(DEFAULT_TEMPLATES.render(_row("x" * 300))["title"]) == YOUTUBE_TITLE_MAX
+
+
+def test_hashtags_become_tags_and_links_survive_a_long_description():
+    """Hashtags are split out into deduplicated tags; the link block is never cut."""
+    templates = MetadataTemplates(
+        title="{caption} | @{username}",
+        description="{caption} <3",
+        links=[{"label": "Original", "url": "{url}"}, {"label": "Shop", "url": ""}],
+        tags=["Shorts", "{hashtags}", "shorts", "#Cats"],
+    )
+    snippet = templates.render(_row("So fluffy #cats #Shorts #fyp " + "meow " * 2000))
+
+    assert snippet["title"].endswith("meow") and "#" not in snippet["title"]
+    assert snippet["tags"] == ["Shorts", "cats", "fyp"]
+    link = "Original: https://www.tiktok.com/@creator/video/7301"
+    assert snippet["description"].startswith("So fluffy meow")
+    assert snippet["description"].endswith("\n\n" + link)
+    assert len(snippet["description"].encode("utf-8")) <= YOUTUBE_DESCRIPTION_MAX_BYTES
+    assert "<" not in templates.render(_row("short"))["description"]
+
+    with pytest.raises(ValueError, match="Unknown field"):
+        MetadataTemplates(title="{likes}")
+
+
+def test_truncation_never_splits_a_grapheme():
+    """Emoji with modifiers or ZWJ sequences, flags and combining accents stay whole."""
+    family = "\U0001f468\u200d\U0001f469\u200d\U0001f467"
+    thumbs, flag, accented = "\U0001f44d\U0001f3fd", "\U0001f1eb\U0001f1f7", "e\u0301"
+    assert truncate("ab" + family, 4) == "ab"
+    assert truncate("a" + thumbs + "b", 2) == "a"
+    assert truncate(flag * 3, 5) == flag * 2
+    assert truncate(accented * 3, 5) == accented * 2
+    assert truncate("hi " + thumbs, 2) == "hi"
+
+    title = DEFAULT_TEMPLATES.render(_row("x" * 99 + family))["title"]
+    assert title == "x" * 99
+
+
+def test_rendering_keeps_up_with_a_reconcile_pass():
+    """Tens of thousands of rows render in well under a second or two."""
+    templates = MetadataTemplates(
+        title="{caption}", description="{description}", links=[{"label": "Original", "url": "{url}"}],
+        tags=["Shorts", "{hashtags}"],
+    )
+    rows = [_row(f"Clip number {n} with a caption #fyp #clip{n % 50} 🎉", video_id=str(n)) for n in range(20000)]
+
+    started = time.perf_counter()
+    for row in rows:
+        templates.render(row)
+    assert time.perf_counter() - started < 5
@@ -0,0 +1,63 @@
+import json
+import pytest
+import metrics
+
+
+@pytest.fixture(autouse=True)
+def clean_metrics():
+    metrics.reset()
+    yield
+    metrics.configure(enabled=False)
+    metrics.reset()
+
+
+def test_disabled_metrics_record_nothing(tmp_path):
+    """While switched off, every call is a no-op and no files are written."""
+    metrics.configure(enabled=False)
+    metrics.inc("videos_total")
+    metrics.set_gauge("queue_depth", 3)
+    with metrics.span("work", video_id="1") as span:
+        span.set(bytes=10)
+
+    assert span is metrics._NOOP_SPAN
+    assert metrics.render() == ""
+    metrics.write_metrics(str(tmp_path / "metrics.prom"))
+    assert not (tmp_path / "metrics.prom").exists()
+
+
+def test_metrics_render_prometheus_text(tmp_path):
+    """Counters, gauges and span timers are written in the Prometheus text format."""
+    metrics.configure(enabled=True, metrics_file=str(tmp_path / "metrics.prom"), trace_file=None)
+    metrics.inc("youtube_upload_bytes_total", 100)
+    metrics.inc("youtube_upload_bytes_total", 50)
+    metrics.inc("youtube_quota_units_total", 1600, project="main", method="videos.insert")
+    metrics.set_gauge("pipeline_queue_depth", 2, username="user")
+    with metrics.span("youtube_upload"):
+        pass
+
+    metrics.write_metrics()
+    text = (tmp_path / "metrics.prom").read_text()
+    assert "# TYPE youtube_upload_bytes_total counter\nyoutube_upload_bytes_total 150\n" in text
+    assert 'youtube_quota_units_total{method="videos.insert",project="main"} 1600' in text
+    assert 'pipeline_queue_depth{username="user"} 2' in text
+    assert "# TYPE youtube_upload_seconds summary" in text
+    assert 'youtube_upload_seconds_count{status="ok"} 1' in text
+
+
+def test_spans_are_traced_as_json_lines(tmp_path):
+    """Each span becomes one JSON line with its attributes, parent and outcome."""
+    trace_file = tmp_path / "traces.jsonl"
+    metrics.configure(enabled=True, metrics_file=str(tmp_path / "metrics.prom"), trace_file=str(trace_file))
+
+    with metrics.span("upload", video_id="7") as outer:
+        outer.set(bytes=123)
+        with pytest.raises(ValueError):
+            with metrics.span("chunk"):
+                raise ValueError("boom")
+    metrics.configure(enabled=False)
+
+    chunk, upload = [json.loads(line) for line in trace_file.read_text().splitlines()]
+    assert upload["name"] == "upload" and upload["video_id"] == "7" and upload["bytes"] == 123
+    assert upload["status"] == "ok" and upload["parent_id"] is None
+    assert chunk["parent_id"] == upload["span_id"]
+    assert chunk["status"] == "error" and chunk["error"] == "boom"
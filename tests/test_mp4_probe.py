@@ -0,0 +1,59 @@
+import os
+from unittest.mock import MagicMock
+
+import mp4_probe
+from mp4_probe import QUARANTINE_DIR_NAME, probe_boxes, validate_video
+from state_store import DOWNLOAD_QUARANTINED
+
+
+def test_probe_reads_structure_and_rejects_broken_files(tmp_path, mp4_bytes):
+    """Duration and size come from the boxes; empty, cut-off and non-mp4 files are invalid."""
+    good = mp4_bytes(b"x" * 64, width=720, height=1280, duration=12.5)
+    cases = {"good": good, "empty": b"", "cut": good[:-10], "html": b"<html>rate limited</html>"}
+    for name, content in cases.items():
+        (tmp_path / f"{name}.mp4").write_bytes(content)
+
+    info = probe_boxes(str(tmp_path / "good.mp4"))
+    assert info["valid"] and info["error"] is None
+    assert (info["duration"], info["width"], info["height"], info["mdat_size"]) == (12.5, 720, 1280, 64)
+    assert info["faststart"] is True
+
+    assert probe_boxes(str(tmp_path / "empty.mp4"))["error"] == "empty file"
+    assert "runs past the end" in probe_boxes(str(tmp_path / "cut.mp4"))["error"]
+    assert not probe_boxes(str(tmp_path / "html.mp4"))["valid"]
+
+
+def test_probe_results_are_cached_by_size_and_mtime(store, tmp_path, mp4_bytes, mocker):
+    """An unchanged file is probed once; a rewritten one is probed again."""
+    path = tmp_path / "@user_video_1.mp4"
+    path.write_bytes(mp4_bytes())
+    probe = mocker.spy(mp4_probe, "probe_boxes")
+
+    assert validate_video(store, "1", str(path))["valid"]
+    assert validate_video(store, "1", str(path))["valid"]
+    assert probe.call_count == 1
+
+    path.write_bytes(mp4_bytes()[:-1])
+    assert not validate_video(store, "1", str(path))["valid"]
+    assert probe.call_count == 2
+
+
+def test_broken_download_is_quarantined_before_quota_is_booked(store, tmp_path, mp4_bytes, mocker):
+    """A truncated file is moved aside and queued for download instead of uploaded."""
+    from youtube_uploader import upload_video_record
+
+    store.record_metadata([{"video_id": "1", "author_username": "user"}])
+    (tmp_path / "@user_video_1.mp4").write_bytes(mp4_bytes(b"x" * 100)[:-50])
+    store.mark_downloaded("1", "@user_video_1.mp4")
+    scheduler = MagicMock()
+    upload = mocker.patch("youtube_uploader.upload_to_youtube")
+
+    assert upload_video_record(MagicMock(), str(tmp_path), store.get_video("1"), store, scheduler) is None
+
+    upload.assert_not_called()
+    scheduler.try_reserve.assert_not_called()
+    assert not (tmp_path / "@user_video_1.mp4").exists()
+    assert os.path.exists(tmp_path / QUARANTINE_DIR_NAME / "@user_video_1.mp4")
+    assert store.get_video("1")["download_status"] == DOWNLOAD_QUARANTINED
+    assert store.pending_uploads() == []
+    assert [row["video_id"] for row in store.redownload_candidates("user", 3)] == ["1"]
@@ -0,0 +1,119 @@
+import json
+import time
+import asyncio
+import threading
+import pytest
+from unittest.mock import MagicMock
+from orchestrator import load_config, run_orchestrator
+from state_store import StateStore
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    """Write a two-channel, three-source config."""
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({
+        "download_dir": str(tmp_path / "downloads"),
+        "download_workers": 2,
+        "channels": {
+            "main": {"token_file": str(tmp_path / "main.pickle"), "templates": {"title": "{caption} #shorts"}},
+            "clips": {},
+        },
+        "sources": [
+            {"tiktok_username": "one", "channel": "main"},
+            {"tiktok_username": "two", "channel": "main"},
+            {"tiktok_username": "three", "channel": "clips"},
+        ],
+    }))
+    return str(path)
+
+
+def test_load_config(config_file, tmp_path):
+    """Channels get per-channel download dirs and token files by default."""
+    config = load_config(config_file)
+
+    assert [s.tiktok_username for s in config.sources] == ["one", "two", "three"]
+    assert config.channels["main"].download_dir == str(tmp_path / "downloads" / "main")
+    assert config.channels["clips"].token_file.endswith("clips.pickle")
+    row = {"video_id": "1", "author_username": "one", "video_description": "Hi #fyp"}
+    assert config.channels["main"].compiled_templates.render(row)["title"] == "Hi #shorts"
+    assert config.channels["clips"].compiled_templates.render(row)["title"] == "Hi #fyp"
+
+
+def test_unknown_channel_is_rejected(tmp_path):
+    """A source that points at a missing channel is a config error."""
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({
+        "channels": {},
+        "sources": [{"tiktok_username": "one", "channel": "nope"}],
+    }))
+
+    with pytest.raises(ValueError, match="unknown channel"):
+        load_config(str(path))
+
+
+def test_sources_share_worker_pools(config_file, mocker):
+    """Every source pipeline gets the same download/upload pools; channels keep their own state."""
+    calls = []
+
+    async def fake_pipeline(username, download_dir, **kwargs):
+        calls.append((username, download_dir, kwargs))
+        return 1
+
+    mocker.patch("pipeline.run_pipeline", side_effect=fake_pipeline)
+
+    summary = asyncio.run(run_orchestrator(load_config(config_file)))
+
+    assert summary == {"one": 1, "two": 1, "three": 1}
+    kwargs = [c[2] for c in calls]
+    assert len({id(k["slots"]) for k in kwargs}) == 1
+    assert len({id(k["upload_slots"]) for k in kwargs}) == 1
+    assert len({id(k["executor"]) for k in kwargs}) == 1
+    assert len({id(k["limiter"]) for k in kwargs}) == 1
+    assert {k["max_workers"] for k in kwargs} == {2}
+    assert kwargs[0]["store"] is kwargs[1]["store"]
+    assert kwargs[0]["store"] is not kwargs[2]["store"]
+    assert kwargs[0]["stop_uploads"] is not kwargs[2]["stop_uploads"]
+    assert kwargs[0]["templates"] is not kwargs[2]["templates"]
+
+
+def test_single_source_uploads_on_every_worker(tmp_path, mocker, mp4_bytes):
+    """One source is not limited to one upload at a time; the shared slots cap the total."""
+    path = tmp_path / "config.json"
+    path.write_text(json.dumps({
+        "download_dir": str(tmp_path / "downloads"),
+        "upload_workers": 3,
+        "channels": {"main": {}},
+        "sources": [{"tiktok_username": "one", "channel": "main"}],
+    }))
+    config = load_config(str(path))
+    channel_dir = tmp_path / "downloads" / "main"
+    channel_dir.mkdir(parents=True)
+    store = StateStore.for_download_dir(str(channel_dir))
+    for n in range(6):
+        (channel_dir / f"@one_video_{n}.mp4").write_bytes(mp4_bytes(f"video {n}".encode()))
+        store.record_metadata([{"video_id": str(n), "author_username": "one"}])
+        store.mark_downloaded(str(n), f"@one_video_{n}.mp4")
+
+    async def no_new_videos(*args, **kwargs):
+        return []
+
+    mocker.patch("pipeline.download_tiktok_clips", side_effect=no_new_videos)
+    mocker.patch("auth.get_authenticated_service", return_value=MagicMock())
+    lock = threading.Lock()
+    active = []
+    peak = []
+
+    def upload(youtube, video_path, title, description, **kwargs):
+        with lock:
+            active.append(video_path)
+            peak.append(len(active))
+        time.sleep(0.05)
+        with lock:
+            active.remove(video_path)
+        return "yt-" + video_path[-5]
+
+    mocker.patch("youtube_uploader.upload_to_youtube", side_effect=upload)
+
+    assert asyncio.run(run_orchestrator(config)) == {"one": 6}
+    assert max(peak) == 3
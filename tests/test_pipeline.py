@@ -0,0 +1,102 @@
+import asyncio
+from unittest.mock import MagicMock
+
+from pipeline import run_pipeline
+from youtube_uploader import QuotaExceededError
+
+
+def _fake_downloader(video_ids, events, mp4_bytes):
+    """Builds a download_tiktok_clips stand-in that hands each video to on_downloaded."""
+    async def download(username, download_dir, store, on_downloaded, stop_event, **kwargs):
+        for vid in video_ids:
+            if stop_event.is_set():
+                break
+            filename = f"@user_video_{vid}.mp4"
+            with open(f"{download_dir}/{filename}", "wb") as f:
+                f.write(mp4_bytes(f"video {vid}".encode()))
+            store.record_metadata([{"video_id": vid, "author_username": "user"}])
+            store.mark_downloaded(vid, filename)
+            events.append(("downloaded", vid))
+            await on_downloaded(vid)
+            await asyncio.sleep(0.01)
+        events.append(("download_done", None))
+    return download
+
+
+def test_uploads_start_while_downloading(mocker, tmp_path, store, mp4_bytes):
+    """Uploads begin before the download stage has finished."""
+    events = []
+    mocker.patch("pipeline.download_tiktok_clips", _fake_downloader(["1", "2", "3"], events, mp4_bytes))
+    mocker.patch("pipeline.get_authenticated_service", return_value=MagicMock())
+
+    def upload(youtube, video_path, title, description, **kwargs):
+        events.append(("uploaded", video_path))
+        return "yt-" + video_path[-5]
+
+    mocker.patch("youtube_uploader.upload_to_youtube", side_effect=upload)
+
+    count = asyncio.run(run_pipeline("user", str(tmp_path), upload_workers=2, queue_size=1, store=store))
+
+    assert count == 3
+    kinds = [kind for kind, _ in events]
+    assert kinds.index("uploaded") < kinds.index("download_done")
+    assert store.pending_uploads() == []
+
+
+def test_backlog_from_previous_runs_is_uploaded(mocker, tmp_path, store, mp4_bytes):
+    """Videos downloaded earlier but never uploaded are queued as well."""
+    (tmp_path / "@user_video_9.mp4").write_bytes(mp4_bytes())
+    store.record_metadata([{"video_id": "9", "author_username": "user"}])
+    store.mark_downloaded("9", "@user_video_9.mp4")
+
+    mocker.patch("pipeline.download_tiktok_clips", _fake_downloader([], [], mp4_bytes))
+    mocker.patch("pipeline.get_authenticated_service", return_value=MagicMock())
+    mocker.patch("youtube_uploader.upload_to_youtube", return_value="yt9")
+
+    asyncio.run(run_pipeline("user", str(tmp_path), store=store))
+
+    assert store.is_uploaded("9")
+
+
+def test_quota_exceeded_drains_pipeline(mocker, tmp_path, store, mp4_bytes):
+    """Quota exhaustion stops new work without deadlocking the bounded queue."""
+    events = []
+    mocker.patch(
+        "pipeline.download_tiktok_clips",
+        _fake_downloader([str(i) for i in range(10)], events, mp4_bytes),
+    )
+    mocker.patch("pipeline.get_authenticated_service", return_value=MagicMock())
+    upload = mocker.patch(
+        "youtube_uploader.upload_to_youtube",
+        side_effect=["yt0", QuotaExceededError("quota")] + ["unexpected"] * 10,
+    )
+
+    count = asyncio.run(
+        asyncio.wait_for(
+            run_pipeline("user", str(tmp_path), upload_workers=1, queue_size=1, store=store),
+            timeout=5,
+        )
+    )
+
+    assert count == 1
+    assert upload.call_count == 2
+    assert len([kind for kind, _ in events if kind == "downloaded"]) < 10
+    assert len(store.pending_uploads()) >= 1
+
+
+def test_broken_download_is_quarantined_before_transcoding(mocker, tmp_path, store):
+    """The pipeline checks a download before hashing or transcoding it."""
+    def cut_off(*args):
+        return b"\0\0\0\x20ftypisom"
+
+    mocker.patch("pipeline.download_tiktok_clips", _fake_downloader(["1"], [], cut_off))
+    mocker.patch("pipeline.get_authenticated_service", return_value=MagicMock())
+    prepare = mocker.patch("pipeline.prepare_for_upload")
+    upload = mocker.patch("youtube_uploader.upload_to_youtube")
+
+    count = asyncio.run(run_pipeline("user", str(tmp_path), store=store, transcode_executor=MagicMock()))
+
+    assert count == 0
+    prepare.assert_not_called()
+    upload.assert_not_called()
+    assert (tmp_path / ".quarantine" / "@user_video_1.mp4").exists()
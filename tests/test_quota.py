@@ -0,0 +1,72 @@
+from datetime import datetime
+from unittest.mock import MagicMock
+
+import pytest
+
+from quota import QUOTA_TIMEZONE, QuotaScheduler, order_by_priority
+
+
+def _pacific(*args):
+    return datetime(*args, tzinfo=QUOTA_TIMEZONE).timestamp()
+
+
+def test_reserve_stays_within_budget(store):
+    """Uploads are booked until the next one would not fit."""
+    scheduler = QuotaScheduler(store, daily_budget=5000, clock=lambda: _pacific(2024, 5, 1, 12))
+
+    assert [scheduler.try_reserve("videos.insert") for _ in range(4)] == [True, True, True, False]
+    assert scheduler.used() == 4800
+    assert scheduler.try_reserve("videos.list")
+
+
+def test_budget_rolls_over_at_pacific_midnight(store):
+    """Usage is per Pacific-time day and persists in the store."""
+    now = {"t": _pacific(2024, 5, 1, 23, 59)}
+    scheduler = QuotaScheduler(store, daily_budget=1600, clock=lambda: now["t"])
+
+    assert scheduler.try_reserve("videos.insert")
+    assert not scheduler.try_reserve("videos.insert")
+    assert scheduler.seconds_until_reset() == pytest.approx(60)
+
+    now["t"] = _pacific(2024, 5, 2, 0, 1)
+    restarted = QuotaScheduler(store, daily_budget=1600, clock=lambda: now["t"])
+    assert restarted.try_reserve("videos.insert")
+
+
+def test_mark_exhausted_blocks_further_calls(store):
+    """A quotaExceeded from YouTube spends the rest of the day's budget."""
+    scheduler = QuotaScheduler(store, clock=lambda: _pacific(2024, 5, 1, 8))
+    scheduler.mark_exhausted()
+
+    assert scheduler.remaining() == 0
+    assert not scheduler.try_reserve("videos.list")
+
+
+def test_order_by_priority():
+    """Rules sort most-wanted first; later rules break ties."""
+    rows = [
+        {"video_id": "1", "play_count": 50},
+        {"video_id": "3", "play_count": 10},
+        {"video_id": "2", "play_count": 50},
+    ]
+
+    assert [r["video_id"] for r in order_by_priority(rows, "newest")] == ["3", "2", "1"]
+    assert [r["video_id"] for r in order_by_priority(rows, "oldest")] == ["1", "2", "3"]
+    assert [r["video_id"] for r in order_by_priority(rows, ["most_played", "newest"])] == ["2", "1", "3"]
+    with pytest.raises(ValueError):
+        order_by_priority(rows, "loudest")
+
+
+def test_spent_budget_skips_the_api_call(store, tmp_path, mocker, mp4_bytes):
+    """Once the budget is spent no insert is attempted."""
+    from youtube_uploader import QuotaExceededError, upload_video_record
+
+    (tmp_path / "@user_video_1.mp4").write_bytes(mp4_bytes())
+    store.record_metadata([{"video_id": "1", "author_username": "user"}])
+    store.mark_downloaded("1", "@user_video_1.mp4")
+    scheduler = QuotaScheduler(store, daily_budget=1000)
+    upload = mocker.patch("youtube_uploader.upload_to_youtube")
+
+    with pytest.raises(QuotaExceededError):
+        upload_video_record(MagicMock(), str(tmp_path), store.get_video("1"), store, scheduler)
+    upload.assert_not_called()
@@ -0,0 +1,65 @@
+import asyncio
+import pytest
+from scheduling import FairLimiter
+
+
+def test_slots_are_shared_round_robin():
+    """A key with many queued jobs cannot starve a key with few."""
+    order = []
+
+    async def job(limiter, key, n):
+        async with limiter.slot(key):
+            order.append((key, n))
+            await asyncio.sleep(0)
+
+    async def run():
+        limiter = FairLimiter(1)
+        await limiter.acquire("setup")
+        big = [asyncio.create_task(job(limiter, "big", n)) for n in range(6)]
+        await asyncio.sleep(0)
+        small = [asyncio.create_task(job(limiter, "small", n)) for n in range(2)]
+        await asyncio.sleep(0)
+        limiter.release()
+        await asyncio.gather(*big, *small)
+
+    asyncio.run(run())
+
+    keys = [key for key, _ in order]
+    assert keys[:5] == ["big", "small", "big", "small", "big"]
+
+
+def test_limit_is_respected():
+    """Never more than `limit` holders at once."""
+    state = {"active": 0, "peak": 0}
+
+    async def job(limiter, key):
+        async with limiter.slot(key):
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            await asyncio.sleep(0.001)
+            state["active"] -= 1
+
+    async def run():
+        limiter = FairLimiter(3)
+        await asyncio.gather(*(job(limiter, n % 4) for n in range(20)))
+        assert limiter.active == 0 and limiter.waiting == 0
+
+    asyncio.run(run())
+    assert state["peak"] == 3
+
+
+def test_cancelled_waiter_releases_its_place():
+    """Cancelling a waiter does not leak a slot."""
+    async def run():
+        limiter = FairLimiter(1)
+        await limiter.acquire("a")
+        waiter = asyncio.create_task(limiter.acquire("b"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        limiter.release()
+        await asyncio.wait_for(limiter.acquire("c"), timeout=1)
+        assert limiter.active == 1
+
+    asyncio.run(run())
@@ -0,0 +1,94 @@
+import threading
+from state_store import DOWNLOAD_DONE, UPLOAD_DONE
+
+
+def test_wal_mode_enabled(store):
+    """The store runs in WAL mode so readers don't block writers."""
+    mode = store.connection().execute("PRAGMA journal_mode").fetchone()[0]
+    assert mode == "wal"
+
+
+def test_metadata_is_deduplicated_by_video_id(store):
+    """Re-recording the same video updates the row instead of adding one."""
+    row = {"video_id": "1", "author_username": "user", "video_description": "first", "video_playcount": "10"}
+    store.record_metadata([row])
+    store.record_metadata([dict(row, video_description="second")])
+
+    count = store.connection().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+    assert count == 1
+    assert store.get_video("1")["video_description"] == "second"
+    assert store.get_video("1")["play_count"] == 10
+
+
+def test_pending_uploads_tracks_status(store):
+    """Only downloaded, not-yet-uploaded videos are pending."""
+    store.record_metadata([{"video_id": vid, "author_username": "user"} for vid in ("1", "2", "3")])
+    store.mark_downloaded("1", "@user_video_1.mp4")
+    store.mark_downloaded("2", "@user_video_2.mp4")
+    store.mark_uploaded("2", "yt2", "title")
+
+    pending = store.pending_uploads()
+    assert [row["video_id"] for row in pending] == ["1"]
+    assert store.is_uploaded("2")
+    assert not store.is_uploaded("1")
+
+
+def test_pending_uploads_use_the_status_index(store):
+    """The backlog queries look videos up through idx_videos_status instead of scanning the table."""
+    conn = store.connection()
+    statements = []
+    conn.set_trace_callback(statements.append)
+    store.pending_uploads()
+    store.summary()
+    conn.set_trace_callback(None)
+
+    backlog = [sql for sql in statements if "download_status = " in sql]
+    assert len(backlog) == 2
+    for sql in backlog:
+        plan = " ".join(row[-1] for row in conn.execute("EXPLAIN QUERY PLAN " + sql))
+        assert "idx_videos_status" in plan
+
+
+def test_import_csv_history_reads_only_new_rows(tmp_path, store, mocker):
+    """metadata.csv is followed from the last offset; the upload log is imported once."""
+    import state_store
+
+    (tmp_path / "metadata.csv").write_text(
+        "video_id,author_username,video_description\n1,user,hello\n2,user,world\n"
+    )
+    (tmp_path / "youtube_uploads.csv").write_text(
+        "tiktok_video_id,youtube_video_id,title\n2,yt2,world\n"
+    )
+    (tmp_path / "@user_video_1.mp4").write_bytes(b"video")
+
+    store.import_csv_history(str(tmp_path))
+    with open(tmp_path / "metadata.csv", "a") as f:
+        f.write("3,user,again\n")
+    (tmp_path / "youtube_uploads.csv").write_text(
+        "tiktok_video_id,youtube_video_id,title\n4,yt4,late\n"
+    )
+    upsert = mocker.spy(state_store.StateStore, "_upsert_metadata")
+    store.import_csv_history(str(tmp_path))
+
+    assert [row["video_id"] for row in upsert.call_args.args[1]] == ["3"]
+    assert store.get_video("1")["download_status"] == DOWNLOAD_DONE
+    assert store.get_video("2")["upload_status"] == UPLOAD_DONE
+    assert store.get_video("3")["video_description"] == "again"
+    assert store.get_video("4") is None
+
+
+def test_concurrent_writers(store):
+    """Threads updating state at the same time do not lose writes."""
+    def write(start):
+        for i in range(start, start + 25):
+            store.mark_downloaded(str(i), f"{i}.mp4")
+        store.close()
+
+    threads = [threading.Thread(target=write, args=(n * 25,)) for n in range(4)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    count = store.connection().execute("SELECT COUNT(*) FROM videos").fetchone()[0]
+    assert count == 100
@@ -42,3 +42,301 @@ def test_directory_permission_error(mocker):
     # Expect an exception due to directory permissions
     with pytest.raises(PermissionError):
         download_tiktok_clips("valid_user", restricted_dir)
+
+
+def _fake_listing(urls):
+    async def get_video_urls(*args, **kwargs):
+        return urls
+    return get_video_urls
+
+
+def _fake_save_tiktok(video_url, save_video=True, metadata_fn=""):
+    """Mimics pyktok: writes the mp4 into the cwd and a metadata row to metadata_fn."""
+    from tiktok_downloader import tiktok_url_to_filename
+    filename = tiktok_url_to_filename(video_url)
+    with open(filename, "wb") as f:
+        f.write(b"video")
+    video_id = video_url.rsplit("/", 1)[-1]
+    with open(metadata_fn, "w", encoding="utf-8") as f:
+        f.write(f"video_id,author_username\n{video_id},user\n")
+
+
+def _fake_staged_save(video_url, staging_dir):
+    """Stands in for the worker-process save, writing straight into staging_dir."""
+    from tiktok_downloader import tiktok_url_to_filename, STAGED_METADATA_FILE
+    filename = tiktok_url_to_filename(video_url)
+    with open(os.path.join(staging_dir, filename), "wb") as f:
+        f.write(b"video")
+    video_id = video_url.rsplit("/", 1)[-1]
+    with open(os.path.join(staging_dir, STAGED_METADATA_FILE), "w", encoding="utf-8") as f:
+        f.write(f"video_id,author_username\n{video_id},user\n")
+
+
+def test_concurrent_download_respects_worker_limit(mocker, tmp_path):
+    """Downloads run in parallel but never exceed max_workers at once."""
+    import threading
+    import time
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    download_dir = str(tmp_path / "downloads")
+    urls = [f"https://www.tiktok.com/@user/video/{i}" for i in range(8)]
+
+    lock = threading.Lock()
+    state = {"active": 0, "peak": 0}
+
+    def save(video_url, staging_dir):
+        with lock:
+            state["active"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+        time.sleep(0.02)
+        _fake_staged_save(video_url, staging_dir)
+        with lock:
+            state["active"] -= 1
+
+    mocker.patch("tiktok_downloader.pyk.get_video_urls", _fake_listing(urls))
+    mocker.patch("tiktok_downloader._staged_save_tiktok", side_effect=save)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        downloaded = asyncio.run(
+            download_tiktok_clips(
+                "user", download_dir, max_workers=3, requests_per_second=0, executor=executor
+            )
+        )
+
+    assert len(downloaded) == 8
+    assert 1 < state["peak"] <= 3
+    with open(os.path.join(download_dir, "metadata.csv"), encoding="utf-8") as f:
+        assert len(f.read().splitlines()) == 9
+    assert os.listdir(os.path.join(download_dir, ".staging")) == []
+
+
+def test_duplicate_urls_are_downloaded_once(mocker, tmp_path):
+    """The skip-if-exists claim stays race-free when a URL is listed twice."""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    url = "https://www.tiktok.com/@user/video/42"
+    mocker.patch("tiktok_downloader.pyk.get_video_urls", _fake_listing([url, url, url]))
+    save = mocker.patch("tiktok_downloader._staged_save_tiktok", side_effect=_fake_staged_save)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        asyncio.run(
+            download_tiktok_clips(
+                "user", str(tmp_path / "downloads"), requests_per_second=0, executor=executor
+            )
+        )
+
+    assert save.call_count == 1
+
+
+def test_download_retries_with_backoff(mocker, tmp_path):
+    """Transient failures are retried before the video is given up on."""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+
+    url = "https://www.tiktok.com/@user/video/7"
+    mocker.patch("tiktok_downloader.pyk.get_video_urls", _fake_listing([url]))
+    save = mocker.patch("tiktok_downloader._staged_save_tiktok")
+
+    def flaky(video_url, staging_dir):
+        if save.call_count == 1:
+            raise Exception("Network error")
+        _fake_staged_save(video_url, staging_dir)
+
+    save.side_effect = flaky
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        downloaded = asyncio.run(
+            download_tiktok_clips(
+                "user", str(tmp_path / "downloads"), requests_per_second=0,
+                backoff_base=0.01, executor=executor,
+            )
+        )
+
+    assert save.call_count == 2
+    assert len(downloaded) == 1
+
+
+def test_staged_save_writes_into_staging_dir(mocker, tmp_path):
+    """pyktok's cwd output lands in the staging dir and the cwd is restored."""
+    from tiktok_downloader import _staged_save_tiktok
+
+    staging_dir = tmp_path / "stage"
+    staging_dir.mkdir()
+    mocker.patch("tiktok_downloader.pyk.save_tiktok", side_effect=_fake_save_tiktok)
+    cwd = os.getcwd()
+
+    _staged_save_tiktok("https://www.tiktok.com/@user/video/9", str(staging_dir))
+
+    assert os.getcwd() == cwd
+    assert (staging_dir / "@user_video_9.mp4").exists()
+    assert (staging_dir / "metadata.csv").exists()
+
+
+def _fake_feed(ids, calls):
+    """A newest-first feed that honours video_ct like pyktok's listing."""
+    async def get_video_urls(username, ent_type="user", video_ct=30):
+        calls.append(video_ct)
+        return [f"https://www.tiktok.com/@{username}/video/{i}" for i in ids[:video_ct]]
+    return get_video_urls
+
+
+def _run_incremental(mocker, tmp_path, feed_ids, mark=None, full_resync=False, fail_ids=()):
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from state_store import StateStore
+
+    store = StateStore.for_download_dir(str(tmp_path / "downloads"))
+    if mark is not None:
+        store.set_sync_mark("user", mark)
+    calls = []
+    mocker.patch("tiktok_downloader.pyk.get_video_urls", _fake_feed(feed_ids, calls))
+
+    def save(video_url, staging_dir):
+        if int(video_url.rsplit("/", 1)[-1]) in fail_ids:
+            raise Exception("Network error")
+        _fake_staged_save(video_url, staging_dir)
+
+    save_mock = mocker.patch("tiktok_downloader._staged_save_tiktok", side_effect=save)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        downloaded = asyncio.run(
+            download_tiktok_clips(
+                "user", str(tmp_path / "downloads"), requests_per_second=0, max_retries=0,
+                executor=executor, store=store, full_resync=full_resync,
+            )
+        )
+    return store, calls, downloaded, save_mock
+
+
+def test_incremental_sync_unchanged_account_lists_one_page(mocker, tmp_path):
+    """An account with nothing newer than its mark costs a single listing page."""
+    store, calls, downloaded, save = _run_incremental(mocker, tmp_path, list(range(100, 0, -1)), mark=100)
+
+    assert calls == [30]
+    assert downloaded == []
+    assert save.call_count == 0
+
+
+def test_incremental_sync_pages_until_known_content(mocker, tmp_path):
+    """Listing grows until it reaches the mark, then only new videos are fetched."""
+    store, calls, downloaded, _ = _run_incremental(mocker, tmp_path, list(range(140, 0, -1)), mark=100)
+
+    assert calls == [30, 60]
+    assert len(downloaded) == 40
+    assert store.get_sync_mark("user") == 140
+
+
+def test_pinned_old_videos_do_not_end_the_listing(mocker, tmp_path):
+    """Old videos pinned at the top of the feed don't stop paging before the mark."""
+    feed = [5, 6] + list(range(161, 101, -1)) + list(range(100, 0, -1))
+    store, calls, _, save = _run_incremental(mocker, tmp_path, feed, mark=100)
+
+    saved = {int(call.args[0].rsplit("/", 1)[-1]) for call in save.call_args_list}
+    assert calls == [30, 60, 120]
+    assert saved == set(range(102, 162))
+    assert store.get_sync_mark("user") == 161
+
+
+def test_failed_download_holds_back_the_mark(mocker, tmp_path):
+    """A video that failed is listed again next time."""
+    store, _, _, _ = _run_incremental(
+        mocker, tmp_path, list(range(140, 0, -1)), mark=100, fail_ids={120}
+    )
+
+    assert store.get_sync_mark("user") == 119
+
+
+def test_full_resync_ignores_the_mark(mocker, tmp_path):
+    """--full-resync lists the whole feed."""
+    store, calls, downloaded, _ = _run_incremental(
+        mocker, tmp_path, list(range(50, 0, -1)), mark=50, full_resync=True
+    )
+
+    assert calls == [500]
+    assert len(downloaded) == 50
+
+
+def test_evicted_and_uploaded_videos_are_not_downloaded_again(mocker, tmp_path):
+    """The skip check trusts the state record, not the file on disk."""
+    from state_store import StateStore
+
+    store = StateStore.for_download_dir(str(tmp_path / "downloads"))
+    store.mark_downloaded("50", "@user_video_50.mp4")
+    store.mark_uploaded("50", "yt50", "title")
+    store.mark_evicted("50")
+    store.mark_uploaded("49", "yt49", "title")
+    # Recorded as downloaded, but the file is gone and it was never uploaded.
+    store.mark_downloaded("48", "@user_video_48.mp4")
+
+    store, _, downloaded, save = _run_incremental(mocker, tmp_path, list(range(50, 0, -1)), full_resync=True)
+
+    assert len(downloaded) == 48
+    fetched = {call.args[0] for call in save.call_args_list}
+    assert "https://www.tiktok.com/@user/video/48" in fetched
+    assert "https://www.tiktok.com/@user/video/50" not in fetched
+
+
+def test_merge_metadata_keeps_the_shared_header(tmp_path):
+    """Rows from a pyktok with a different column layout are written under the existing header."""
+    from tiktok_downloader import _merge_metadata
+
+    shared = tmp_path / "metadata.csv"
+    shared.write_text("video_id,author_username,video_description\n1,user,old\n")
+    part = tmp_path / "part.csv"
+    part.write_text("author_unique_id,id,video_desc,video_new_field\nuser,2,new,x\n")
+
+    rows = _merge_metadata(str(part), str(shared))
+
+    assert rows == [{"author_username": "user", "video_id": "2", "video_description": "new"}]
+    assert shared.read_text().splitlines()[-1] == "2,user,new"
+
+
+def test_quarantined_videos_are_downloaded_again(mocker, tmp_path):
+    """Quarantined videos are fetched again even when no longer listed, without holding back the mark."""
+    from mp4_probe import MAX_REDOWNLOADS
+    from state_store import StateStore
+
+    store = StateStore.for_download_dir(str(tmp_path / "downloads"))
+    store.record_metadata([{"video_id": "20", "author_username": "user"}, {"video_id": "30", "author_username": "user"}])
+    store.mark_quarantined("20", "truncated")
+    for _ in range(MAX_REDOWNLOADS + 1):
+        store.mark_quarantined("30", "truncated")
+
+    store, _, downloaded, save = _run_incremental(mocker, tmp_path, list(range(140, 0, -1)), mark=100)
+
+    fetched = {call.args[0] for call in save.call_args_list}
+    assert "https://www.tiktok.com/@user/video/20" in fetched
+    assert "https://www.tiktok.com/@user/video/30" not in fetched
+    assert len(downloaded) == 41
+    assert store.get_video("20")["download_status"] == "downloaded"
+    assert store.get_sync_mark("user") == 140
+
+
+def test_blocked_account_stops_and_stays_paused(mocker, tmp_path):
+    """A block opens the account's circuit: the run stops hammering and the next run skips it."""
+    import asyncio
+    from concurrent.futures import ThreadPoolExecutor
+    from state_store import StateStore
+
+    download_dir = str(tmp_path / "downloads")
+    store = StateStore.for_download_dir(download_dir)
+    calls = []
+    mocker.patch("tiktok_downloader.pyk.get_video_urls", _fake_feed(list(range(40, 0, -1)), calls))
+    save = mocker.patch("tiktok_downloader._staged_save_tiktok", side_effect=Exception("HTTP Error 403: Forbidden"))
+
+    def run():
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            return asyncio.run(download_tiktok_clips(
+                "user", download_dir, requests_per_second=0, max_retries=1, backoff_base=0.001,
+                executor=executor, store=store, full_resync=True,
+            ))
+
+    assert run() == []
+    assert save.call_count < 10
+    assert store.get_sync_mark("user") is None
+
+    attempts = save.call_count
+    assert run() == []
+    assert save.call_count == attempts
+    assert calls == [500]
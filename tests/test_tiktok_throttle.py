@@ -0,0 +1,80 @@
+import asyncio
+import urllib.error
+import pytest
+
+from tiktok_throttle import (
+    BLOCKED, CLOSED, HALF_OPEN, NOT_FOUND, OPEN, RATE_LIMITED, TRANSIENT,
+    AccountThrottle, CircuitOpenError, classify_failure, saved_states,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1_000_000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_failures_are_classified():
+    """Status codes win over message text; parse errors mean TikTok served something else."""
+    def http_error(code):
+        return urllib.error.HTTPError("https://www.tiktok.com/@user/video/4040", code, "error", {}, None)
+
+    assert classify_failure(http_error(429)) == RATE_LIMITED
+    assert classify_failure(http_error(403)) == BLOCKED
+    assert classify_failure(http_error(404)) == NOT_FOUND
+    assert classify_failure(http_error(503)) == TRANSIENT
+    assert classify_failure(Exception("Too Many Requests")) == RATE_LIMITED
+    assert classify_failure(Exception("Please verify you are human")) == BLOCKED
+    assert classify_failure(KeyError("__UNIVERSAL_DATA_FOR_REHYDRATION__")) == BLOCKED
+    assert classify_failure(ConnectionResetError("reset for video 74041")) == TRANSIENT
+
+
+def test_concurrency_is_halved_on_throttling_and_regrows(store):
+    """AIMD: one halving per backoff window, then +1/limit per success."""
+    clock = FakeClock()
+    throttle = AccountThrottle("user", 8, store, backoff_base=10, clock=clock)
+
+    throttle.record_failure(Exception("429"))
+    throttle.record_failure(Exception("429"))
+    assert throttle.limit == 4
+    clock.now += 3600
+    throttle.record_failure(Exception("captcha"))
+    assert throttle.limit == 2
+
+    for _ in range(4):
+        throttle.record_success()
+    assert 3 < throttle.limit < 4
+    assert throttle.consecutive_failures == 0
+
+
+def test_circuit_opens_persists_and_closes_after_a_probe(store):
+    """Consecutive failures open the circuit for the next run too; a successful probe closes it."""
+    clock = FakeClock()
+    throttle = AccountThrottle("user", 4, store, failure_threshold=3, open_seconds=60, clock=clock)
+    for _ in range(3):
+        throttle.record_failure(ConnectionResetError())
+    assert throttle.state == OPEN
+
+    # The next run starts paused, not at full speed.
+    later = AccountThrottle.load(store, "user", 4, clock=clock)
+    assert later.state == OPEN and saved_states(store)["user"]["state"] == OPEN
+
+    async def request(throttle):
+        async with throttle.slot():
+            await throttle.ready()
+
+    with pytest.raises(CircuitOpenError):
+        asyncio.run(request(later))
+
+    clock.now += 60 * 1.2
+
+    async def probe():
+        async with later.slot():
+            assert later.state == HALF_OPEN
+            later.record_success()
+
+    asyncio.run(probe())
+    assert later.state == CLOSED and later.limit == 1
+    assert AccountThrottle.load(store, "user", 4).state == CLOSED
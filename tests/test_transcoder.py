@@ -0,0 +1,76 @@
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import transcoder
+from transcoder import ShortsLimits, plan, prepare_for_upload
+from state_store import StateStore
+
+
+def _box(box_type, payload=b""):
+    return struct.pack(">I4s", 8 + len(payload), box_type) + payload
+
+
+def _info(**overrides):
+    info = {"duration": 30.0, "bit_rate": 2_000_000, "width": 1080, "height": 1920, "faststart": True}
+    info.update(overrides)
+    return info
+
+
+def test_moov_position_detected(tmp_path):
+    """Box order decides whether a file is faststart."""
+    faststart = tmp_path / "fast.mp4"
+    faststart.write_bytes(_box(b"ftyp", b"isom") + _box(b"moov") + _box(b"mdat", b"x" * 32))
+    slow = tmp_path / "slow.mp4"
+    slow.write_bytes(_box(b"ftyp", b"isom") + _box(b"mdat", b"x" * 32) + _box(b"moov"))
+
+    assert transcoder._moov_before_mdat(str(faststart)) is True
+    assert transcoder._moov_before_mdat(str(slow)) is False
+
+
+def test_plan_picks_cheapest_fix():
+    """Compliant videos are left alone, container issues remuxed, the rest transcoded."""
+    limits = ShortsLimits()
+    assert plan(_info(), limits)["action"] == "none"
+    assert plan(_info(faststart=False), limits)["action"] == "remux"
+    assert plan(_info(duration=200.0), limits)["action"] == "remux"
+    assert plan(_info(width=1920, height=1080), limits)["action"] == "transcode"
+    assert plan(_info(bit_rate=20_000_000, faststart=False), limits) == {
+        "action": "transcode", "reasons": ["bitrate above 10000000", "moov after mdat"],
+    }
+
+
+def test_prepare_for_upload_caches_by_content_hash(tmp_path, mocker):
+    """The same content is encoded once, even when it arrives under another video id."""
+    store = StateStore.for_download_dir(str(tmp_path))
+    for video_id in ("1", "2"):
+        (tmp_path / f"@user_video_{video_id}.mp4").write_bytes(b"same horizontal clip")
+    mocker.patch("transcoder.probe", return_value=_info(width=1920, height=1080))
+
+    def fake_ffmpeg(command, **kwargs):
+        with open(command[-1], "wb") as f:
+            f.write(b"vertical clip")
+
+    run = mocker.patch("transcoder.subprocess.run", side_effect=fake_ffmpeg)
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        first = prepare_for_upload(store, str(tmp_path), "1", str(tmp_path / "@user_video_1.mp4"), executor)
+        second = prepare_for_upload(store, str(tmp_path), "2", str(tmp_path / "@user_video_2.mp4"), executor)
+
+    assert first == second
+    assert first.startswith(str(tmp_path / ".processed"))
+    assert open(first, "rb").read() == b"vertical clip"
+    assert run.call_count == 1
+    assert "-vf" in run.call_args[0][0]
+
+
+def test_prepare_for_upload_falls_back_to_original(tmp_path, mocker):
+    """Without ffmpeg the original file is uploaded and nothing is cached."""
+    store = StateStore.for_download_dir(str(tmp_path))
+    video = tmp_path / "@user_video_1.mp4"
+    video.write_bytes(b"clip")
+    mocker.patch("transcoder.subprocess.run", side_effect=FileNotFoundError("ffprobe"))
+
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        assert prepare_for_upload(store, str(tmp_path), "1", str(video), executor) == str(video)
+
+    assert store.connection().execute("SELECT COUNT(*) FROM transcodes").fetchone()[0] == 0
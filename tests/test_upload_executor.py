@@ -0,0 +1,94 @@
+import threading
+from unittest.mock import MagicMock
+from quota import QuotaScheduler
+from state_store import StateStore
+from upload_executor import UploadExecutor, UploadJob, channel_jobs, order_uploads
+from youtube_uploader import QuotaExceededError
+
+
+def _job(channel, video_id, size, scheduler):
+    return UploadJob(channel, "unused", {"video_id": video_id}, MagicMock(), scheduler, MagicMock(), size)
+
+
+def _scheduler(project, uploads_left):
+    scheduler = MagicMock(project=project)
+    scheduler.remaining.return_value = uploads_left * 1600
+    scheduler.cost.return_value = 1600
+    return scheduler
+
+
+def test_size_aware_orders_keep_quota_priority():
+    """Smaller files go first among the uploads today's quota allows; the rest keep priority order."""
+    main, clips = _scheduler("main", 3), _scheduler("clips", 5)
+    jobs = [
+        _job("main", "m1", 900, main), _job("main", "m2", 100, main), _job("main", "m3", 500, main),
+        _job("main", "m4", 1, main),
+        _job("clips", "c1", 300, clips), _job("clips", "c2", 200, clips),
+    ]
+
+    def ids(ordered):
+        return [job.video_id for job in ordered]
+
+    assert ids(order_uploads(jobs, "priority")) == ["m1", "m2", "m3", "m4", "c1", "c2"]
+    assert ids(order_uploads(jobs, "shortest_first")) == ["m2", "c2", "c1", "m3", "m1", "m4"]
+    assert ids(order_uploads(jobs, "interleaved")) == ["m2", "c2", "m3", "c1", "m1", "m4"]
+
+
+def test_uploads_run_in_parallel_with_a_client_per_thread(mocker, tmp_path, mp4_bytes):
+    """Uploads overlap on separate threads, each with its own API client."""
+    store = StateStore.for_download_dir(str(tmp_path))
+    store.record_metadata([{"video_id": str(n), "author_username": "user"} for n in range(4)])
+    for n in range(4):
+        (tmp_path / f"@user_video_{n}.mp4").write_bytes(mp4_bytes(b"x" * (n + 1)))
+        store.mark_downloaded(str(n), f"@user_video_{n}.mp4")
+
+    barrier = threading.Barrier(2, timeout=5)
+    clients = {}
+
+    def factory():
+        return clients.setdefault(threading.get_ident(), MagicMock())
+
+    def upload(youtube, video_path, *args, **kwargs):
+        # Only returns once two uploads are in flight at the same time.
+        barrier.wait()
+        return "yt-" + video_path[-5]
+
+    mocker.patch("youtube_uploader.upload_to_youtube", side_effect=upload)
+    jobs = channel_jobs("main", str(tmp_path), store, QuotaScheduler(store), factory)
+
+    assert UploadExecutor(2).run(jobs) == 4
+    assert len(clients) == 2
+    assert store.pending_uploads() == []
+
+
+def test_quota_exhaustion_only_stops_its_project(mocker):
+    """A spent project stops its remaining uploads while other projects carry on."""
+    main, clips = _scheduler("main", 10), _scheduler("clips", 10)
+    jobs = [_job("main", "m1", 1, main), _job("main", "m2", 2, main), _job("clips", "c1", 3, clips),
+            _job("clips", "c2", 4, clips)]
+
+    def upload(youtube, download_dir, row, *args):
+        if row["video_id"] == "m1":
+            raise QuotaExceededError("spent")
+        return "yt-" + row["video_id"]
+
+    record = mocker.patch("upload_executor.upload_video_record", side_effect=upload)
+
+    assert UploadExecutor(1, order="priority").run(jobs) == 2
+    assert [call.args[2]["video_id"] for call in record.call_args_list] == ["m1", "c1", "c2"]
+
+
+def test_broken_download_is_quarantined_before_transcoding(mocker, tmp_path):
+    """A cut-off file never reaches the transcoder or the uploader."""
+    store = StateStore.for_download_dir(str(tmp_path))
+    store.record_metadata([{"video_id": "1", "author_username": "user"}])
+    (tmp_path / "@user_video_1.mp4").write_bytes(b"\0\0\0\x20ftypisom")
+    store.mark_downloaded("1", "@user_video_1.mp4")
+    prepare = mocker.patch("upload_executor.prepare_for_upload")
+    upload = mocker.patch("youtube_uploader.upload_to_youtube")
+    jobs = channel_jobs("main", str(tmp_path), store, QuotaScheduler(store), MagicMock)
+
+    assert UploadExecutor(1, transcode_executor=MagicMock()).run(jobs) == 0
+    prepare.assert_not_called()
+    upload.assert_not_called()
+    assert (tmp_path / ".quarantine" / "@user_video_1.mp4").exists()
@@ -0,0 +1,158 @@
+import httplib2
+import pytest
+from unittest.mock import MagicMock
+from googleapiclient.errors import HttpError
+
+from metadata_templates import MetadataTemplates
+from quota import QuotaScheduler
+from state_store import UPLOAD_MISSING
+from youtube_metadata import add_to_playlist, reconcile_uploads, update_snippets
+from youtube_uploader import QuotaExceededError
+
+
+class FakeBatch:
+    """Stands in for BatchHttpRequest, answering each request through `respond`."""
+
+    def __init__(self, callback, respond, log):
+        self.callback = callback
+        self.respond = respond
+        self.log = log
+        self.requests = []
+
+    def add(self, request, request_id=None):
+        self.requests.append((request_id, request))
+
+    def execute(self):
+        self.log.append(len(self.requests))
+        for request_id, request in self.requests:
+            try:
+                self.callback(request_id, self.respond(request), None)
+            except HttpError as e:
+                self.callback(request_id, None, e)
+
+
+def _fake_youtube(respond):
+    youtube = MagicMock()
+    youtube.batches = []
+    youtube.new_batch_http_request.side_effect = lambda callback: FakeBatch(callback, respond, youtube.batches)
+    youtube.videos.return_value.list.side_effect = lambda **kwargs: ("list", kwargs)
+    youtube.videos.return_value.update.side_effect = lambda **kwargs: ("update", kwargs)
+    youtube.playlistItems.return_value.insert.side_effect = lambda **kwargs: ("insert", kwargs)
+    return youtube
+
+
+def _http_error(status, reason=""):
+    content = f'{{"error": {{"errors": [{{"reason": "{reason}"}}]}}}}'.encode()
+    return HttpError(httplib2.Response({"status": status}), content)
+
+
+@pytest.fixture
+def store(store):
+    """The shared state store with 120 recorded uploads."""
+    for n in range(120):
+        store.mark_uploaded(str(n), f"yt{n}", f"title {n}")
+    return store
+
+
+def test_reconcile_uses_fifty_ids_per_call_in_one_batch(store):
+    """120 uploads take three videos.list calls sent as a single batch request."""
+    deleted = {"yt7", "yt99"}
+
+    def respond(request):
+        ids = request[1]["id"].split(",")
+        return {"items": [{"id": i, "status": {"uploadStatus": "processed"}} for i in ids if i not in deleted]}
+
+    youtube = _fake_youtube(respond)
+    scheduler = QuotaScheduler(store, daily_budget=100)
+
+    summary = reconcile_uploads(youtube, store, scheduler)
+
+    assert youtube.batches == [3]
+    assert scheduler.used() == 3
+    assert summary == {"checked": 120, "present": 118, "missing": 2, "rejected": 0}
+    assert store.get_video("7")["upload_status"] == UPLOAD_MISSING
+    assert store.pending_uploads() == []
+
+
+def test_reconcile_keeps_the_results_gathered_before_the_quota_ran_out(store):
+    """Chunks answered before a quotaExceeded are acted on; the rest stay unchecked."""
+    deleted = {"yt7", "yt110"}
+
+    def respond(request):
+        assert "maxResults" not in request[1]
+        ids = request[1]["id"].split(",")
+        if "yt100" in ids:
+            raise _http_error(403, "quotaExceeded")
+        return {"items": [{"id": i, "status": {"uploadStatus": "processed"}} for i in ids if i not in deleted]}
+
+    with pytest.raises(QuotaExceededError) as raised:
+        reconcile_uploads(_fake_youtube(respond), store)
+
+    assert set(raised.value.responses) == {"0", "1"}
+    assert store.get_video("7")["upload_status"] == UPLOAD_MISSING
+    assert store.get_video("110")["upload_status"] != UPLOAD_MISSING
+
+
+def test_batch_retries_server_errors_and_stops_on_quota(store):
+    """5xx entries are retried in a later batch; quotaExceeded raises."""
+    failures = {"yt1": [_http_error(503)], "yt3": [_http_error(403, "quotaExceeded")]}
+
+    def respond(request):
+        video_id = request[1]["body"]["snippet"]["resourceId"]["videoId"]
+        if failures.get(video_id):
+            raise failures[video_id].pop(0)
+        return {"id": f"item-{video_id}"}
+
+    youtube = _fake_youtube(respond)
+    assert add_to_playlist(youtube, "PL1", ["yt0", "yt1", "yt2"]) == {
+        "yt0": "item-yt0", "yt1": "item-yt1", "yt2": "item-yt2",
+    }
+    assert youtube.batches == [3, 1]
+
+    with pytest.raises(QuotaExceededError):
+        add_to_playlist(youtube, "PL1", ["yt3", "yt4"])
+
+
+def test_update_snippets_books_quota_and_records_titles(store):
+    """Snippet updates are refused up front when they don't fit in the budget."""
+    youtube = _fake_youtube(lambda request: {"id": request[1]["body"]["id"]})
+    scheduler = QuotaScheduler(store, daily_budget=120)
+
+    result = update_snippets(youtube, store, {"1": {"title": "New one"}, "2": {"title": "New two"}}, scheduler)
+
+    assert result == {"1": True, "2": True}
+    assert store.get_video("1")["title"] == "New one"
+    assert scheduler.used() == 100
+    with pytest.raises(QuotaExceededError):
+        update_snippets(youtube, store, {"3": {"title": "Too much"}}, scheduler)
+    assert youtube.batches == [2]
+
+
+def test_reconcile_updates_snippets_that_no_longer_match_the_templates(store):
+    """The snippets come back with videos.list; only the ones that differ from the templates are updated."""
+    templates = MetadataTemplates(title="Clip {video_id}", description="", tags=["Shorts"])
+    updates = []
+
+    def respond(request):
+        kind, kwargs = request
+        if kind == "update":
+            updates.append(kwargs["body"])
+            return {"id": kwargs["body"]["id"]}
+        assert kwargs["part"] == "id,status,snippet"
+        return {"items": [
+            {"id": i, "status": {"uploadStatus": "processed"}, "snippet": {
+                # yt5 was uploaded with other metadata and is kept in its category.
+                "title": f"Clip {i[2:]}" if i != "yt5" else "Old title", "description": "", "tags": ["Shorts"],
+                "categoryId": "24" if i == "yt5" else "22",
+            }}
+            for i in kwargs["id"].split(",")
+        ]}
+
+    youtube = _fake_youtube(respond)
+    summary = reconcile_uploads(youtube, store, templates=templates)
+
+    assert summary["updated"] == 1
+    assert updates == [{"id": "yt5", "snippet": {
+        "title": "Clip 5", "description": "", "tags": ["Shorts"], "categoryId": "24",
+    }}]
+    assert store.get_video("5")["title"] == "Clip 5"
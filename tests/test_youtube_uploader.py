@@ -22,21 +22,24 @@ def mock_download_dir(tmp_path):
     
     return tmp_path
 
-def test_successful_upload(mock_youtube_service):
+def test_successful_upload(mock_youtube_service, tmp_path):
     """Test a successful video upload."""
-    video_path = "test_video.mp4"
+    video_path = tmp_path / "test_video.mp4"
+    video_path.write_bytes(b"dummy video content")
     title = "Test Video Title"
     description = "Test Video Description"
     
     # Mock YouTube API response
-    mock_youtube_service.videos().insert().execute.return_value = {"id": "12345"}
+    request = mock_youtube_service.videos.return_value.insert.return_value
+    request.next_chunk.return_value = (None, {"id": "12345"})
     
     # Call the upload function
-    upload_to_youtube(mock_youtube_service, video_path, title, description)
+    youtube_id = upload_to_youtube(mock_youtube_service, str(video_path), title, description)
     
     # Assert that the API was called with the correct parameters
+    assert youtube_id == "12345"
     mock_youtube_service.videos().insert.assert_called_once()
-    mock_youtube_service.videos().insert().execute.assert_called_once()
+    request.next_chunk.assert_called_once()
 
 def test_invalid_video_file(mock_youtube_service):
     """Test behavior when the video file does not exist."""
@@ -71,3 +74,199 @@ def test_quota_exceeded_error(mock_youtube_service):
     # Expect an exception and ensure error is logged
     with pytest.raises(Exception, match="Quota Exceeded"):
         upload_to_youtube(mock_youtube_service, video_path, title, description)
+
+def test_process_and_upload_clips_records_state(mocker, tmp_path, mp4_bytes):
+    """Uploads pending videos from the state store and records the result."""
+    from state_store import StateStore
+
+    store = StateStore.for_download_dir(str(tmp_path))
+    store.record_metadata([
+        {"video_id": "1", "author_username": "user", "video_description": "one"},
+        {"video_id": "2", "author_username": "user", "video_description": "two"},
+    ])
+    for vid in ("1", "2"):
+        (tmp_path / f"@user_video_{vid}.mp4").write_bytes(mp4_bytes())
+        store.mark_downloaded(vid, f"@user_video_{vid}.mp4")
+    store.mark_uploaded("2", "yt2", "two")
+
+    mocker.patch("youtube_uploader.get_authenticated_service", return_value=MagicMock())
+    upload = mocker.patch("youtube_uploader.upload_to_youtube", return_value="yt1")
+
+    process_and_upload_clips(str(tmp_path), store=store)
+
+    upload.assert_called_once()
+    assert store.is_uploaded("1")
+    assert store.get_video("1")["youtube_id"] == "yt1"
+
+
+def _http_error(status):
+    import httplib2
+    from googleapiclient.errors import HttpError
+    return HttpError(httplib2.Response({"status": status}), b"")
+
+
+def _progress(sent, total):
+    from googleapiclient.http import MediaUploadProgress
+    return MediaUploadProgress(sent, total)
+
+
+def test_chunked_upload_retries_transient_errors(mock_youtube_service, tmp_path, mocker):
+    """5xx and socket errors between chunks are retried with backoff."""
+    sleep = mocker.patch("youtube_uploader.time.sleep")
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"x" * 10)
+
+    request = mock_youtube_service.videos.return_value.insert.return_value
+    request.resumable_uri = None
+    request.next_chunk.side_effect = [
+        (_progress(5, 10), None),
+        _http_error(503),
+        ConnectionResetError("socket reset"),
+        (None, {"id": "yt1"}),
+    ]
+
+    youtube_id = upload_to_youtube(mock_youtube_service, str(video_path), "t", "d", chunksize=256 * 1024)
+
+    assert youtube_id == "yt1"
+    assert request.next_chunk.call_count == 4
+    assert sleep.call_count == 2
+
+
+def test_upload_session_is_persisted_and_resumed(mock_youtube_service, tmp_path, mocker):
+    """An interrupted upload resumes from the persisted session URI after a restart."""
+    from state_store import StateStore
+
+    mocker.patch("youtube_uploader.time.sleep")
+    store = StateStore.for_download_dir(str(tmp_path))
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"x" * 10)
+
+    # First run: one chunk goes through, then the connection keeps failing.
+    request = mock_youtube_service.videos.return_value.insert.return_value
+    request.resumable_uri = "https://upload.example/session-1"
+    request.resumable_progress = 5
+    request.next_chunk.side_effect = [(_progress(5, 10), None)] + [ConnectionResetError()] * 3
+
+    assert upload_to_youtube(
+        mock_youtube_service, str(video_path), "t", "d", store=store, video_id="42", max_retries=2
+    ) is None
+    session = store.get_upload_session("42")
+    assert session["session_uri"] == "https://upload.example/session-1"
+    assert session["bytes_sent"] == 5
+
+    # Second run: YouTube is asked what it has, and only the rest is sent.
+    http = _resumed_insert(mock_youtube_service, ({"status": "308", "range": "bytes=0-4"}, ""))
+
+    assert upload_to_youtube(
+        mock_youtube_service, str(video_path), "t", "d", store=store, video_id="42"
+    ) == "yt42"
+    (query_uri, query_method, _, query_headers), (uri, _, _, headers) = http.request_sequence
+    assert (query_uri, query_method) == ("https://upload.example/session-1", "PUT")
+    assert query_headers["Content-Range"] == "bytes */10"
+    assert uri == "https://upload.example/session-1"
+    assert headers["Content-Range"] == "bytes 5-9/10"
+    assert store.get_upload_session("42") is None
+
+
+def _resumed_insert(youtube, status_response):
+    """Makes youtube.videos().insert() build real requests, answered by the status query and then success."""
+    from googleapiclient.http import HttpMockSequence, HttpRequest
+    from googleapiclient.model import JsonModel
+
+    http = HttpMockSequence([status_response, ({"status": "200"}, '{"id": "yt42"}')])
+    youtube.videos.return_value.insert.side_effect = lambda part, body, media_body: HttpRequest(
+        http, JsonModel().response, "https://upload.example/start", method="POST", resumable=media_body,
+    )
+    return http
+
+
+def test_resumed_upload_books_no_quota(mocker, tmp_path, mp4_bytes):
+    """Resuming a stored session continues the insert already paid for."""
+    from quota import QuotaScheduler
+    from state_store import StateStore
+    from youtube_uploader import upload_video_record
+
+    store = StateStore.for_download_dir(str(tmp_path))
+    store.record_metadata([{"video_id": "42", "author_username": "user", "video_description": "clip"}])
+    video_path = tmp_path / "@user_video_42.mp4"
+    video_path.write_bytes(mp4_bytes())
+    store.mark_downloaded("42", video_path.name)
+    stat = video_path.stat()
+    store.save_upload_session("42", str(video_path), stat.st_size, stat.st_mtime, "https://upload.example/s", 0)
+    scheduler = QuotaScheduler(store, daily_budget=10000)
+    youtube = MagicMock()
+    _resumed_insert(youtube, ({"status": "308"}, ""))
+
+    assert upload_video_record(youtube, str(tmp_path), store.get_video("42"), store, scheduler) == "yt42"
+    assert scheduler.used() == 0
+
+
+def test_duplicate_content_skips_upload_and_quota(mocker, tmp_path, mp4_bytes):
+    """A repost of an uploaded video is marked duplicate without spending quota."""
+    from state_store import StateStore, UPLOAD_DUPLICATE
+    from youtube_uploader import upload_video_record
+
+    store = StateStore.for_download_dir(str(tmp_path))
+    store.record_metadata([
+        {"video_id": "1", "author_username": "user"},
+        {"video_id": "2", "author_username": "other"},
+    ])
+    for vid, user in (("1", "user"), ("2", "other")):
+        (tmp_path / f"@{user}_video_{vid}.mp4").write_bytes(mp4_bytes(b"same clip"))
+        store.mark_downloaded(vid, f"@{user}_video_{vid}.mp4")
+    scheduler = MagicMock()
+    mocker.patch("youtube_uploader.upload_to_youtube", return_value="yt1")
+
+    assert upload_video_record(MagicMock(), str(tmp_path), store.get_video("1"), store, scheduler) == "yt1"
+    assert upload_video_record(MagicMock(), str(tmp_path), store.get_video("2"), store, scheduler) is None
+
+    assert scheduler.try_reserve.call_count == 1
+    assert store.get_video("2")["upload_status"] == UPLOAD_DUPLICATE
+    assert store.get_video("2")["youtube_id"] == "yt1"
+    assert store.get_fingerprint("2")["duplicate_of"] == "1"
+    assert store.pending_uploads() == []
+
+
+def test_cancel_stops_after_current_chunk(mock_youtube_service, tmp_path):
+    """A cancelled upload finishes its chunk, keeps its session and raises."""
+    import threading
+    from state_store import StateStore
+    from youtube_uploader import UploadInterrupted
+
+    store = StateStore.for_download_dir(str(tmp_path))
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"x" * 10)
+    cancel = threading.Event()
+
+    request = mock_youtube_service.videos.return_value.insert.return_value
+    request.resumable_uri = "https://upload.example/session-1"
+    request.resumable_progress = 5
+
+    def next_chunk():
+        cancel.set()
+        return _progress(5, 10), None
+
+    request.next_chunk.side_effect = next_chunk
+
+    with pytest.raises(UploadInterrupted):
+        upload_to_youtube(mock_youtube_service, str(video_path), "t", "d", store=store, video_id="42", cancel=cancel)
+    assert request.next_chunk.call_count == 1
+    assert store.get_upload_session("42")["bytes_sent"] == 5
+
+
+def test_throttle_is_paid_before_each_chunk(mock_youtube_service, tmp_path):
+    """Every chunk's bytes are booked against the shared bandwidth limiter before it is sent."""
+    video_path = tmp_path / "video.mp4"
+    video_path.write_bytes(b"x" * 10)
+    throttle = MagicMock()
+
+    request = mock_youtube_service.videos.return_value.insert.return_value
+    request.resumable_uri = None
+    request.resumable.chunksize.return_value = 6
+    request.resumable.size.return_value = 10
+    progress = iter([0, 6])
+    type(request).resumable_progress = property(lambda _: next(progress))
+    request.next_chunk.side_effect = [(_progress(6, 10), None), (None, {"id": "yt1"})]
+
+    assert upload_to_youtube(mock_youtube_service, str(video_path), "t", "d", throttle=throttle) == "yt1"
+    assert [call.args[0] for call in throttle.consume.call_args_list] == [6, 4]
@@ -1,8 +1,31 @@
 import os
+import csv
 import shutil
+import random
+import asyncio
+import inspect
 import logging
+from typing import Optional
 import pyktok as pyk
+from concurrent.futures import ProcessPoolExecutor
 from urllib.parse import urlparse
+import metrics
+from logger import log_context
+from metadata_reader import METADATA_FILE, column_indexes, project, read_header, remap_row
+from mp4_probe import MAX_REDOWNLOADS
+from tiktok_throttle import NOT_FOUND, AccountThrottle, CircuitOpenError
+from state_store import DOWNLOAD_EVICTED, UPLOAD_DONE, UPLOAD_DUPLICATE, StateStore
+from scheduling import DEFAULT_REQUESTS_PER_SECOND, FairLimiter, HostRateLimiter
+
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_RETRIES = 3
+DEFAULT_BACKOFF_BASE = 1.0
+
+MAX_LISTED_VIDEOS = 500
+LISTING_PAGE_SIZE = 30
+
+STAGING_DIR_NAME = ".staging"
+STAGED_METADATA_FILE = "metadata.csv"
 
 def tiktok_url_to_filename(url: str) -> str:
     """
@@ -18,77 +41,384 @@ def tiktok_url_to_filename(url: str) -> str:
     
     raise ValueError("Invalid TikTok video URL format")
 
-def move_videos_to_download_dir(root_dir, download_dir):
-    """Moves all .mp4 files from the root directory to the download directory."""
-    logging.info(f"Moving video files to {download_dir}...")
-    logging.debug(f"Searching for .mp4 files in: {root_dir}")
-    
-    found_videos = False
-    for filename in os.listdir(root_dir):
-        if filename.endswith(".mp4"):
-            found_videos = True
-            source = os.path.join(root_dir, filename)
-            destination = os.path.join(download_dir, filename)
-            logging.debug(f"Found video: {source}")
-            
+def _video_id_from_url(url: str) -> Optional[int]:
+    parts = urlparse(url).path.strip("/").split("/")
+    if len(parts) >= 3 and parts[1] == "video" and parts[2].isdigit():
+        return int(parts[2])
+    return None
+
+
+async def _get_video_urls(username, count, throttle=None):
+    """One pyktok listing call, admitted by and reported to the account's throttle."""
+    if throttle is None:
+        return await pyk.get_video_urls(username, ent_type='user', video_ct=count)
+    async with throttle.slot():
+        await throttle.ready()
+        try:
+            urls = await pyk.get_video_urls(username, ent_type='user', video_ct=count)
+        except Exception as e:
+            throttle.record_failure(e)
+            raise
+        throttle.record_success()
+        return urls
+
+
+async def _list_video_urls(username, since_id=None, page_size=LISTING_PAGE_SIZE, max_videos=MAX_LISTED_VIDEOS,
+                           throttle=None):
+    """
+    Lists an account's videos, newest first.
+
+    With a `since_id` high-water mark only videos newer than it are returned.
+    The listing starts with one page and doubles until it reaches known content
+    (the last listed id is at or below the mark), the end of the feed or
+    `max_videos`. Only the tail of the page counts: pinned videos sit at the
+    top of the feed whatever their age, so an old id before newer ones does
+    not mean the listing has caught up.
+    """
+    if since_id is None:
+        with metrics.span("tiktok_list", username=username, requested=max_videos) as span:
+            urls = await _get_video_urls(username, max_videos, throttle)
+            span.set(listed=len(urls))
+        return urls
+
+    count = min(page_size, max_videos)
+    while True:
+        with metrics.span("tiktok_list", username=username, requested=count) as span:
+            urls = await _get_video_urls(username, count, throttle)
+            span.set(listed=len(urls))
+        ids = [_video_id_from_url(url) for url in urls if url]
+        ids = [i for i in ids if i is not None]
+        if not ids or ids[-1] <= since_id or len(urls) < count or count >= max_videos:
+            new_urls = [url for url in urls if url and (_video_id_from_url(url) or 0) > since_id]
+            logging.info(
+                f"Incremental listing for {username}: {len(new_urls)} new videos since {since_id} "
+                f"({len(urls)} listed)."
+            )
+            return new_urls
+        count = min(count * 2, max_videos)
+
+
+def _next_sync_mark(settled, unsettled) -> Optional[int]:
+    """
+    The newest video_id such that it and every older listed video is on disk.
+    Anything that failed or was never attempted holds the mark below it, so it
+    is listed again on the next incremental run.
+    """
+    if unsettled:
+        floor = min(unsettled)
+        settled = [i for i in settled if i < floor]
+    return max(settled) if settled else None
+
+
+def _staged_save_tiktok(video_url: str, staging_dir: str) -> None:
+    """
+    Runs pyktok's save_tiktok with staging_dir as the working directory.
+
+    pyktok always writes the video into the cwd, which is process-wide state,
+    so this runs in a worker process where nothing else can move the cwd.
+    """
+    previous_cwd = os.getcwd()
+    os.chdir(staging_dir)
+    try:
+        result = pyk.save_tiktok(video_url, save_video=True, metadata_fn=STAGED_METADATA_FILE)
+        # Older pyktok releases expose save_tiktok as a coroutine.
+        if inspect.isawaitable(result):
+            asyncio.run(result)
+    finally:
+        os.chdir(previous_cwd)
+
+
+def _promote_staged_video(staging_dir: str, filename: str, download_dir: str) -> str:
+    """Atomically renames a worker's own output file from its staging dir into download_dir."""
+    source = os.path.join(staging_dir, filename)
+    destination = os.path.join(download_dir, filename)
+    if not os.path.exists(source):
+        raise FileNotFoundError(f"pyktok did not produce {filename} in {staging_dir}")
+    # The staging dir lives inside download_dir, so this is a same-filesystem rename.
+    os.replace(source, destination)
+    logging.info(f"Moved {filename} to {download_dir}")
+    return destination
+
+
+def _video_id_from_filename(filename: str) -> str:
+    return filename.rsplit("_video_", 1)[-1][:-len(".mp4")]
+
+
+def _merge_metadata(part_path: str, metadata_path: str) -> list:
+    """
+    Appends the rows of a per-video metadata file to the shared metadata.csv
+    and returns them projected onto the columns the state store uses.
+
+    Rows go under the shared file's header: if the pyktok that wrote the part
+    file names or orders columns differently, they are matched up by name.
+    """
+    if not os.path.exists(part_path):
+        return []
+    with open(part_path, "r", newline="", encoding="utf-8") as f:
+        rows = list(csv.reader(f))
+    os.remove(part_path)
+    if not rows:
+        return []
+
+    header, body = rows[0], rows[1:]
+    existing_header = read_header(metadata_path) if os.path.exists(metadata_path) else None
+    with open(metadata_path, "a", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        if existing_header is None:
+            writer.writerow(header)
+        elif existing_header != header:
+            body = [remap_row(existing_header, header, row) for row in body]
+        writer.writerows(body)
+    indexes = column_indexes(header)
+    return [project(indexes, row) for row in rows[1:]]
+
+
+def _already_have(store, filename: str, download_path: str) -> bool:
+    """
+    Whether a listed video needs no download. The state record decides first,
+    since the files of settled uploads may have been evicted from disk; a file
+    on disk without such a record (e.g. from before the state store) counts too.
+    """
+    row = store.get_video(_video_id_from_filename(filename))
+    if row is not None and (
+        row["download_status"] == DOWNLOAD_EVICTED or row["upload_status"] in (UPLOAD_DONE, UPLOAD_DUPLICATE)
+    ):
+        return True
+    return os.path.exists(download_path)
+
+
+async def _download_with_retry(
+    video_url, filename, download_dir, limiter, executor, store, max_retries, backoff_base, throttle
+):
+    """
+    Downloads a single video, retrying failures with exponential backoff.
+    Each attempt waits for the account's throttle and reports back to it;
+    videos that are gone are not retried.
+    """
+    video_id = _video_id_from_filename(filename)
+    staging_dir = os.path.join(download_dir, STAGING_DIR_NAME, video_id)
+    loop = asyncio.get_running_loop()
+
+    try:
+        for attempt in range(max_retries + 1):
+            await throttle.ready()
+            await limiter.wait(video_url)
+            # Start every attempt from an empty staging dir; pyktok appends to an
+            # existing metadata file and would duplicate rows from a failed attempt.
+            shutil.rmtree(staging_dir, ignore_errors=True)
+            os.makedirs(staging_dir)
             try:
-                if os.path.exists(destination):
-                    logging.warning(f"File {filename} already exists in destination. Skipping move.")
-                    continue
-                shutil.move(source, destination)
-                logging.info(f"Moved {filename} to {download_dir}")
-            except FileNotFoundError:
-                logging.warning(f"Video file {source} not found, skipping move.")
+                with metrics.span("tiktok_save", video_id=video_id, attempt=attempt):
+                    await loop.run_in_executor(executor, _staged_save_tiktok, video_url, staging_dir)
+                throttle.record_success()
+                break
             except Exception as e:
-                logging.error(f"Failed to move file {filename}: {e}")
+                kind = throttle.record_failure(e)
+                if attempt >= max_retries or kind == NOT_FOUND:
+                    metrics.inc("tiktok_download_failures_total")
+                    raise
+                metrics.inc("tiktok_download_retries_total")
+                delay = backoff_base * 2 ** attempt * random.uniform(0.5, 1.5)
+                logging.warning(
+                    f"Download attempt {attempt + 1} for {video_url} failed: {e}. Retrying in {delay:.1f}s."
+                )
+                await asyncio.sleep(delay)
+
+        with metrics.span("tiktok_promote", video_id=video_id):
+            destination = _promote_staged_video(staging_dir, filename, download_dir)
+        metrics.inc("tiktok_downloaded_videos_total")
+        metrics.inc("tiktok_download_bytes_total", os.path.getsize(destination))
+        rows = _merge_metadata(
+            os.path.join(staging_dir, STAGED_METADATA_FILE),
+            os.path.join(download_dir, METADATA_FILE),
+        )
+        store.record_metadata(rows)
+        store.mark_downloaded(video_id, filename)
+        return destination
+    finally:
+        shutil.rmtree(staging_dir, ignore_errors=True)
 
-    if not found_videos:
-        logging.info("No .mp4 files found in the root directory to move.")
 
+async def download_tiktok_clips(
+    username,
+    download_dir,
+    max_workers=DEFAULT_MAX_WORKERS,
+    max_retries=DEFAULT_MAX_RETRIES,
+    requests_per_second=DEFAULT_REQUESTS_PER_SECOND,
+    backoff_base=DEFAULT_BACKOFF_BASE,
+    executor=None,
+    store=None,
+    on_downloaded=None,
+    stop_event=None,
+    slots=None,
+    listing_semaphore=None,
+    full_resync=False,
+    max_videos=MAX_LISTED_VIDEOS,
+    cache=None,
+    limiter=None,
+):
+    """
+    Download TikTok clips and metadata.
+
+    Up to `max_workers` videos are fetched at once, request starts are limited
+    to `requests_per_second` per host, and each video is retried up to
+    `max_retries` times with exponential backoff starting at `backoff_base`
+    seconds. Returns the paths of the videos downloaded during this call.
+
+    Each video is saved into its own staging dir under download_dir by a
+    worker process and then renamed into place. Pass `executor` to share a
+    pool across calls; otherwise one is created for this call. Metadata and
+    download status are recorded in `store` (defaults to the state store in
+    download_dir).
+
+    `on_downloaded`, if given, is awaited with each new video_id while the
+    download slot is still held, so a slow consumer throttles downloading.
+    Once `stop_event` is set no new downloads start; in-flight ones finish.
+
+    To share workers between accounts, pass one FairLimiter as `slots` (and an
+    asyncio.Semaphore as `listing_semaphore` to cap concurrent listings) to
+    every call; download slots are then handed out round-robin per username.
+    Likewise pass one HostRateLimiter as `limiter` so the per-host rate holds
+    across accounts rather than per account (`requests_per_second` is then
+    ignored).
 
-async def download_tiktok_clips(username, download_dir):
-    """Download TikTok clips and metadata."""
+    Listing is incremental: only videos newer than the account's high-water
+    mark in the state store are listed, and the mark moves forward as videos
+    land. `full_resync=True` ignores the mark and lists the whole feed. At
+    most `max_videos` of the newest videos are listed.
+
+    With a DiskCache as `cache`, each download first reserves room in its
+    byte budget; downloads wait (holding their slot) while the cache is full.
+    Videos whose files were evicted after upload are not downloaded again.
+
+    Requests go through the account's AccountThrottle (see tiktok_throttle),
+    which cuts concurrency and backs off when TikTok rate-limits or blocks,
+    and stops the account's downloads for this run once its circuit opens;
+    the skipped videos are listed again next time. The throttle's state is
+    kept in `store` for the next run.
+
+    Videos the uploader quarantined as broken (see mp4_probe.quarantine) are
+    downloaded again, up to MAX_REDOWNLOADS times, whether or not the
+    listing still includes them.
+    """
+    downloaded = []
+    throttle = None
+    own_executor = executor is None
+    if own_executor:
+        executor = ProcessPoolExecutor(max_workers=max_workers)
     try:
         os.makedirs(download_dir, exist_ok=True)
+        if store is None:
+            store = StateStore.for_download_dir(download_dir)
         logging.info(f"Downloading TikTok videos for user: {username}")
         
-        video_list = await pyk.get_video_urls(
-            username,
-            ent_type='user',
-            video_ct=500,
-        )
+        if listing_semaphore is None:
+            listing_semaphore = asyncio.Semaphore(1)
+        throttle = AccountThrottle.load(store, username, max_workers, backoff_base=backoff_base)
+        since_id = None if full_resync else store.get_sync_mark(username)
+        try:
+            async with listing_semaphore:
+                video_list = await _list_video_urls(username, since_id, max_videos=max_videos, throttle=throttle)
+        except CircuitOpenError as e:
+            logging.warning(f"{e}; skipping {username} this run.")
+            return downloaded
 
         logging.info(f"Found {len(video_list)} videos for user {username}.")
 
-        for video in video_list:
-            try:
-                filename = tiktok_url_to_filename(video)
-                root_path = os.path.join(os.getcwd(), filename)
-                download_path = os.path.join(download_dir, filename)
+        listed = {_video_id_from_url(url) for url in video_list if url}
+        redownloads = [
+            int(row["video_id"]) for row in store.redownload_candidates(username, MAX_REDOWNLOADS)
+            if row["video_id"].isdigit() and int(row["video_id"]) not in listed
+        ]
+        if redownloads:
+            logging.info(f"Downloading {len(redownloads)} quarantined videos of {username} again.")
+            video_list = video_list + [f"https://www.tiktok.com/@{username}/video/{i}" for i in redownloads]
 
-                if os.path.exists(root_path) or os.path.exists(download_path):
-                    logging.info(f"Video already exists: {filename}. Skipping download.")
-                    continue
+        if slots is None:
+            slots = FairLimiter(max_workers)
+        if limiter is None:
+            limiter = HostRateLimiter(requests_per_second)
+        claimed = set()
+        settled = []
+        unsettled = []
+        total = len(video_list)
 
+        async def worker(video):
+            video_id = _video_id_from_url(video) if video else None
+            with log_context(account=username, video_id=video_id):
+                await download_one(video)
+
+        async def download_one(video):
+            filename = None
+            video_id = None
+            try:
                 if video is None:
                     logging.warning("Received None for video URL, skipping.")
-                    continue
+                    return
 
-                logging.info(f"Processing video: {video}")
-                await pyk.save_tiktok(
-                    video,
-                    save_video=True,
-                    metadata_fn=os.path.join(download_dir, "metadata.csv")
-                )
+                filename = tiktok_url_to_filename(video)
+                video_id = _video_id_from_url(video)
+                download_path = os.path.join(download_dir, filename)
+
+                # The check and the claim happen without yielding to the event
+                # loop, so two workers can never both pick up the same video.
+                if filename in claimed or _already_have(store, filename, download_path):
+                    logging.info(f"Video already exists: {filename}. Skipping download.")
+                    if video_id is not None:
+                        settled.append(video_id)
+                    return
+                claimed.add(filename)
 
-                move_videos_to_download_dir(os.getcwd(), download_dir)
+                async with throttle.slot(), slots.slot(username):
+                    if stop_event is not None and stop_event.is_set():
+                        if video_id is not None:
+                            unsettled.append(video_id)
+                        return
+                    reservation = None
+                    if cache is not None:
+                        reservation = await cache.reserve(stop_event)
+                        if reservation is None:
+                            logging.info(f"No room in the download cache for {filename}; leaving it for later.")
+                            if video_id is not None:
+                                unsettled.append(video_id)
+                            return
+                    logging.info(f"Processing video: {video}")
+                    path = None
+                    try:
+                        path = await _download_with_retry(
+                            video, filename, download_dir, limiter, executor, store, max_retries, backoff_base,
+                            throttle,
+                        )
+                    finally:
+                        if cache is not None:
+                            cache.commit(reservation, path)
+                    downloaded.append(path)
+                    if video_id is not None:
+                        settled.append(video_id)
+                    logging.info(f"Downloaded {filename} ({len(downloaded)} new of {total} listed).")
+                    if on_downloaded is not None:
+                        await on_downloaded(_video_id_from_filename(filename))
 
+            except CircuitOpenError:
+                # Logged once by the throttle; the video is listed again next run.
+                if video_id is not None:
+                    unsettled.append(video_id)
             except Exception as e:
                 logging.error(f"Failed to download video {video}: {e}", exc_info=True)
-                continue
+                if filename:
+                    store.mark_download_failed(_video_id_from_filename(filename), str(e))
+                if video_id is not None:
+                    unsettled.append(video_id)
+
+        await asyncio.gather(*(worker(video) for video in video_list))
+
+        # Re-downloads are older than the mark and must not hold it back.
+        mark = _next_sync_mark(
+            [i for i in settled if i not in redownloads], [i for i in unsettled if i not in redownloads]
+        )
+        if mark is not None:
+            store.set_sync_mark(username, mark)
 
-        
-     
         logging.info(f"TikTok clips and metadata downloaded successfully to {download_dir}.")
 
     except PermissionError as e:
@@ -96,3 +426,10 @@ async def download_tiktok_clips(username, download_dir):
         raise
     except Exception as e:
         logging.error(f"An unexpected error occurred during download: {e}")
+    finally:
+        if throttle is not None:
+            throttle.save()
+        if own_executor:
+            executor.shutdown(wait=True)
+
+    return downloaded
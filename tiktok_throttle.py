@@ -0,0 +1,260 @@
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+import metrics
+from state_store import StateStore
+
+
+# How a failed TikTok request is treated.
+RATE_LIMITED = "rate_limited"  # 429: slow down
+BLOCKED = "blocked"  # 403, captcha or a page pyktok could not parse: slow down
+NOT_FOUND = "not_found"  # gone or private: that video only, not retried
+TRANSIENT = "transient"  # network errors and 5xx: retry
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+DEFAULT_FAILURE_THRESHOLD = 5
+DEFAULT_OPEN_SECONDS = 5 * 60
+MAX_OPEN_SECONDS = 6 * 60 * 60
+MAX_BACKOFF_SECONDS = 5 * 60
+
+META_PREFIX = "tiktok_throttle:"
+
+_TEXT_PATTERNS = (
+    (RATE_LIMITED, re.compile(r"\b429\b|too many requests|rate.?limit", re.I)),
+    (NOT_FOUND, re.compile(r"\b404\b|not found|private|removed|deleted", re.I)),
+    (BLOCKED, re.compile(r"\b403\b|forbidden|captcha|verify|access denied|blocked", re.I)),
+)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of sending a request while an account's circuit is open."""
+
+
+def classify_failure(error: BaseException) -> str:
+    """Sorts an exception from pyktok (or what it calls) into one of the failure kinds above."""
+    status = getattr(error, "status", None) or getattr(error, "code", None)
+    status = status or getattr(getattr(error, "response", None), "status_code", None)
+    if isinstance(status, int):
+        if status == 429:
+            return RATE_LIMITED
+        if status == 404:
+            return NOT_FOUND
+        if status in (401, 403):
+            return BLOCKED
+        return TRANSIENT
+    text = str(error)
+    for kind, pattern in _TEXT_PATTERNS:
+        if pattern.search(text):
+            return kind
+    # pyktok reads the data embedded in TikTok's page; a captcha or login
+    # wall instead of the video page shows up as a parse error.
+    if isinstance(error, (KeyError, IndexError, AttributeError, ValueError)):
+        return BLOCKED
+    return TRANSIENT
+
+
+class AccountThrottle:
+    """
+    Adapts how hard one TikTok account is hit to how TikTok responds.
+
+    Concurrency follows AIMD: each success adds 1/limit to the limit (about
+    one more worker per round of successful requests, up to
+    `max_concurrency`); a rate-limit or block halves it, at most once per
+    backoff window, and pauses every request for the account for an
+    exponentially growing, jittered backoff.
+
+    `failure_threshold` failures in a row (not counting videos that are
+    gone) open the circuit: requests raise CircuitOpenError instead of
+    reaching TikTok until the cool-down ends, which doubles every time the
+    circuit opens again. After it, one half-open probe request is let
+    through; its success closes the circuit at concurrency 1, its failure
+    opens it again.
+
+    The state is saved in the state store's meta table, so the next run or
+    daemon sync starts where this one stopped, not at full speed into a
+    known block.
+    """
+
+    def __init__(
+        self,
+        account: str,
+        max_concurrency: int,
+        store: Optional[StateStore] = None,
+        failure_threshold: int = DEFAULT_FAILURE_THRESHOLD,
+        open_seconds: float = DEFAULT_OPEN_SECONDS,
+        backoff_base: float = 1.0,
+        clock=time.time,
+    ):
+        self.account = account
+        self.max_concurrency = max(1, max_concurrency)
+        self.store = store
+        self.failure_threshold = failure_threshold
+        self.open_seconds = open_seconds
+        self.backoff_base = backoff_base
+        self.clock = clock
+        self.state = CLOSED
+        self.limit = float(self.max_concurrency)
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.open_count = 0
+        self._not_before = 0.0
+        self._last_decrease = 0.0
+        self._active = 0
+        self._probing = False
+        self._changed = None
+
+    @classmethod
+    def load(cls, store: StateStore, account: str, max_concurrency: int, **kwargs) -> "AccountThrottle":
+        """The account's throttle as the last run left it."""
+        throttle = cls(account, max_concurrency, store, **kwargs)
+        saved = store.get_meta(META_PREFIX + account)
+        if saved:
+            state = json.loads(saved)
+            throttle.state = state["state"]
+            throttle.limit = min(float(throttle.max_concurrency), max(1.0, state["limit"]))
+            throttle.consecutive_failures = state["consecutive_failures"]
+            throttle.open_until = state["open_until"]
+            throttle.open_count = state["open_count"]
+        return throttle
+
+    def save(self) -> None:
+        if self.store is None:
+            return
+        self.store.set_meta(META_PREFIX + self.account, json.dumps({
+            "state": self.state,
+            "limit": self.limit,
+            "consecutive_failures": self.consecutive_failures,
+            "open_until": self.open_until,
+            "open_count": self.open_count,
+            "updated_at": self.clock(),
+        }))
+
+    def _report(self) -> None:
+        metrics.set_gauge("tiktok_concurrency_limit", int(self.limit), username=self.account)
+        metrics.set_gauge("tiktok_circuit_open", int(self.state != CLOSED), username=self.account)
+
+    # -- admission ------------------------------------------------------------
+
+    def _check_circuit(self) -> None:
+        if self.state != OPEN:
+            return
+        if self.clock() < self.open_until:
+            until = datetime.fromtimestamp(self.open_until).strftime("%H:%M:%S")
+            raise CircuitOpenError(f"TikTok requests for @{self.account} are paused until {until}")
+        self.state = HALF_OPEN
+        logging.info("Cool-down for @%s is over; probing TikTok with one request.", self.account)
+
+    def _wake(self) -> None:
+        if self._changed is not None:
+            self._changed.set()
+
+    async def _wait_for_change(self) -> None:
+        if self._changed is None or self._changed.is_set():
+            self._changed = asyncio.Event()
+        await self._changed.wait()
+
+    @asynccontextmanager
+    async def slot(self):
+        """
+        Holds one of the account's `limit` concurrent request slots (just the
+        probe while half-open). Raises CircuitOpenError while the circuit is open.
+        """
+        probe = False
+        while True:
+            self._check_circuit()
+            if self.state == HALF_OPEN:
+                if not self._probing:
+                    self._probing = probe = True
+                    break
+            elif self._active < int(self.limit):
+                break
+            await self._wait_for_change()
+        self._active += 1
+        try:
+            yield
+        finally:
+            self._active -= 1
+            if probe:
+                self._probing = False
+            self._wake()
+
+    async def ready(self) -> None:
+        """Waits out the account's backoff; call before each request. Raises CircuitOpenError."""
+        while True:
+            self._check_circuit()
+            delay = self._not_before - self.clock()
+            if delay <= 0:
+                return
+            await asyncio.sleep(delay)
+
+    # -- feedback -------------------------------------------------------------
+
+    def record_success(self) -> None:
+        self.consecutive_failures = 0
+        if self.state != CLOSED:
+            self.state = CLOSED
+            self.open_count = 0
+            self.limit = 1.0
+            logging.info("TikTok answered @%s again; resuming at concurrency 1.", self.account)
+            self.save()
+        else:
+            self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+        self._report()
+        self._wake()
+
+    def record_failure(self, error: BaseException) -> str:
+        """Adjusts to a failed request and returns its kind (see classify_failure)."""
+        kind = classify_failure(error)
+        metrics.inc("tiktok_failures_total", kind=kind, username=self.account)
+        if kind == NOT_FOUND:
+            # TikTok answered; only this video is affected.
+            self.consecutive_failures = 0
+            return kind
+
+        now = self.clock()
+        self.consecutive_failures += 1
+        if kind in (RATE_LIMITED, BLOCKED):
+            delay = min(MAX_BACKOFF_SECONDS, self.backoff_base * 2 ** min(self.consecutive_failures - 1, 10))
+            delay *= random.uniform(0.5, 1.5)
+            self._not_before = max(self._not_before, now + delay)
+            if now - self._last_decrease >= delay:
+                self._last_decrease = now
+                self.limit = max(1.0, self.limit / 2)
+                logging.warning(
+                    "TikTok %s @%s; backing off %.1fs and dropping to %d concurrent requests.",
+                    kind.replace("_", " "), self.account, delay, int(self.limit),
+                )
+        if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+            self._open(now, kind)
+        self._report()
+        self._wake()
+        return kind
+
+    def _open(self, now: float, kind: str) -> None:
+        self.open_count += 1
+        cool_down = min(MAX_OPEN_SECONDS, self.open_seconds * 2 ** (self.open_count - 1))
+        self.open_until = now + cool_down * random.uniform(1.0, 1.2)
+        self.state = OPEN
+        metrics.inc("tiktok_circuit_opens_total", username=self.account)
+        logging.error(
+            "Pausing TikTok requests for @%s for %.0fs after %d failures in a row (last: %s).",
+            self.account, self.open_until - now, self.consecutive_failures, kind,
+        )
+        self.save()
+
+
+def saved_states(store: StateStore) -> Dict[str, Dict]:
+    """The persisted throttle state of every account in a store, keyed by account."""
+    return {
+        key[len(META_PREFIX):]: json.loads(value) for key, value in store.meta_items(META_PREFIX).items()
+    }
@@ -0,0 +1,178 @@
+import os
+import json
+import logging
+import subprocess
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import metrics
+from fingerprint import content_hash
+from mp4_probe import probe_boxes
+from state_store import StateStore
+
+
+PROCESSED_DIR_NAME = ".processed"
+# ffmpeg is CPU-bound, so the transcode pool gets one worker per core.
+DEFAULT_TRANSCODE_WORKERS = os.cpu_count() or 1
+
+FFMPEG = "ffmpeg"
+FFPROBE = "ffprobe"
+
+ACTION_NONE = "none"
+ACTION_REMUX = "remux"
+ACTION_TRANSCODE = "transcode"
+
+
+@dataclass(frozen=True)
+class ShortsLimits:
+    """What a video must satisfy to go up unchanged as a YouTube Short."""
+
+    max_duration: float = 180.0
+    max_bitrate: int = 10_000_000
+    width: int = 1080
+    height: int = 1920
+
+
+def _moov_before_mdat(path: str) -> Optional[bool]:
+    """
+    Whether the index (moov) comes before the media data (mdat), i.e.
+    whether the file is "faststart". None if the file has neither box.
+    """
+    return probe_boxes(path)["faststart"]
+
+
+def probe(path: str) -> Dict:
+    """Reads duration, dimensions, bitrate and box order of an mp4 with ffprobe."""
+    output = subprocess.run(
+        [FFPROBE, "-v", "error", "-print_format", "json", "-show_format", "-show_streams", path],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    info = json.loads(output)
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), {})
+    fmt = info.get("format", {})
+    return {
+        "duration": float(fmt.get("duration") or 0),
+        "bit_rate": int(fmt.get("bit_rate") or 0),
+        "width": int(video.get("width") or 0),
+        "height": int(video.get("height") or 0),
+        "faststart": _moov_before_mdat(path),
+    }
+
+
+def plan(info: Dict, limits: ShortsLimits) -> Dict:
+    """
+    Decides the cheapest fix for a probed video: nothing, a stream-copy remux
+    (moov placement, trimming to the duration limit) or a full transcode
+    (horizontal video, bitrate over the ceiling).
+    """
+    remux, transcode = [], []
+    if info["faststart"] is False:
+        remux.append("moov after mdat")
+    if info["duration"] > limits.max_duration:
+        remux.append(f"longer than {limits.max_duration:g}s")
+    if info["width"] > info["height"]:
+        transcode.append("not vertical")
+    if info["bit_rate"] > limits.max_bitrate:
+        transcode.append(f"bitrate above {limits.max_bitrate}")
+
+    if transcode:
+        return {"action": ACTION_TRANSCODE, "reasons": transcode + remux}
+    if remux:
+        return {"action": ACTION_REMUX, "reasons": remux}
+    return {"action": ACTION_NONE, "reasons": []}
+
+
+def _ffmpeg_command(source: str, output: str, info: Dict, action: str, limits: ShortsLimits) -> List[str]:
+    command = [FFMPEG, "-y", "-v", "error", "-i", source]
+    if info["duration"] > limits.max_duration:
+        command += ["-t", f"{limits.max_duration:g}"]
+    if action == ACTION_REMUX:
+        command += ["-c", "copy"]
+    else:
+        if info["width"] > info["height"]:
+            # Letterbox into a vertical frame rather than cropping the picture.
+            w, h = limits.width, limits.height
+            command += ["-vf", f"scale={w}:{h}:force_original_aspect_ratio=decrease,pad={w}:{h}:(ow-iw)/2:(oh-ih)/2"]
+        command += [
+            "-c:v", "libx264", "-preset", "veryfast", "-crf", "23",
+            "-maxrate", str(limits.max_bitrate), "-bufsize", str(limits.max_bitrate * 2),
+            "-c:a", "aac", "-b:a", "128k",
+        ]
+    # Explicit format: the output is written under a ".part" name first.
+    return command + ["-movflags", "+faststart", "-f", "mp4", output]
+
+
+def normalize_video(source: str, output: str, limits: ShortsLimits = ShortsLimits()) -> Dict:
+    """
+    Probes `source` and, if needed, writes a Shorts-compliant copy to
+    `output`. Runs in a worker process. Returns the plan that was applied.
+    """
+    info = probe(source)
+    result = plan(info, limits)
+    if result["action"] == ACTION_NONE:
+        return result
+
+    partial = output + ".part"
+    command = _ffmpeg_command(source, partial, info, result["action"], limits)
+    try:
+        subprocess.run(command, check=True, capture_output=True, text=True)
+        os.replace(partial, output)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+    return result
+
+
+def processed_dir(download_dir: str) -> str:
+    return os.path.join(download_dir, PROCESSED_DIR_NAME)
+
+
+def prepare_for_upload(
+    store: StateStore,
+    download_dir: str,
+    video_id: str,
+    video_path: str,
+    executor: Executor,
+    limits: ShortsLimits = ShortsLimits(),
+) -> str:
+    """
+    Returns the file to upload for a downloaded video: the original, or a
+    remuxed/transcoded copy made in `executor`.
+
+    Results are cached by the source's content hash, in the state store and
+    as <hash>.mp4 under the download dir's .processed folder, so the same
+    content is probed and encoded at most once. If ffmpeg fails the original
+    is uploaded and the video is tried again on the next run.
+    """
+    digest = content_hash(store, video_id, video_path)
+    cached = store.get_transcode(digest)
+    if cached is not None:
+        if cached["output_file"] is None:
+            return video_path
+        output = os.path.join(download_dir, cached["output_file"])
+        if os.path.exists(output):
+            return output
+
+    output_file = os.path.join(PROCESSED_DIR_NAME, f"{digest}.mp4")
+    os.makedirs(processed_dir(download_dir), exist_ok=True)
+    try:
+        with metrics.span("transcode", video_id=video_id) as span:
+            result = executor.submit(
+                normalize_video, video_path, os.path.join(download_dir, output_file), limits
+            ).result()
+            span.set(action=result["action"])
+    except (OSError, subprocess.CalledProcessError, ValueError) as e:
+        stderr = getattr(e, "stderr", None)
+        logging.warning("Could not normalize %s, uploading it as is: %s %s", video_path, e, stderr or "")
+        metrics.inc("transcode_failures_total")
+        return video_path
+
+    metrics.inc("transcode_results_total", action=result["action"])
+    if result["action"] == ACTION_NONE:
+        store.save_transcode(digest, ACTION_NONE, None, [])
+        return video_path
+    logging.info("%s %s (%s).", result["action"].capitalize(), video_path, ", ".join(result["reasons"]))
+    store.save_transcode(digest, result["action"], output_file, result["reasons"])
+    return os.path.join(download_dir, output_file)
+
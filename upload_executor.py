@@ -0,0 +1,223 @@
+import os
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass
+from typing import Callable, Dict, List, Optional, Sequence, Union
+
+import metrics
+from bandwidth import BandwidthLimiter
+from mp4_probe import check_download
+from metadata_templates import DEFAULT_TEMPLATES, MetadataTemplates
+from quota import DEFAULT_PRIORITY, QuotaScheduler
+from state_store import StateStore
+from transcoder import prepare_for_upload
+from youtube_uploader import QuotaExceededError, UploadInterrupted, downloaded_path, upload_video_record
+
+
+DEFAULT_UPLOAD_WORKERS = 2
+
+# "priority" keeps each channel's quota priority order; the other two put
+# small files first among the uploads that fit today's quota, so more videos
+# go live sooner. "interleaved" also alternates between channels.
+UPLOAD_ORDERS = ("priority", "shortest_first", "interleaved")
+DEFAULT_UPLOAD_ORDER = "shortest_first"
+
+
+@dataclass
+class UploadJob:
+    """One pending video and everything needed to upload it to its channel."""
+
+    channel: str
+    download_dir: str
+    row: Dict
+    store: StateStore
+    scheduler: QuotaScheduler
+    service_factory: Callable
+    size: int = 0
+    templates: MetadataTemplates = DEFAULT_TEMPLATES
+
+    @property
+    def video_id(self) -> str:
+        return self.row["video_id"]
+
+
+def channel_jobs(
+    channel: str,
+    download_dir: str,
+    store: StateStore,
+    scheduler: QuotaScheduler,
+    service_factory: Callable,
+    priority: Union[str, Sequence[str]] = DEFAULT_PRIORITY,
+    templates: MetadataTemplates = DEFAULT_TEMPLATES,
+) -> List[UploadJob]:
+    """The pending uploads in a channel's state store, in quota priority order."""
+    jobs = []
+    for row in scheduler.plan(store.pending_uploads(), priority):
+        path = downloaded_path(download_dir, row)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        jobs.append(UploadJob(channel, download_dir, row, store, scheduler, service_factory, size, templates))
+    return jobs
+
+
+def order_uploads(jobs: List[UploadJob], order: str = DEFAULT_UPLOAD_ORDER) -> List[UploadJob]:
+    """
+    Orders jobs (each channel's already in priority order) for the executor.
+
+    Size-aware orders only reorder the jobs that fit in what is left of their
+    project's quota today, so priority still decides which videos are
+    uploaded when the budget runs out; the rest follow in priority order.
+    """
+    if order not in UPLOAD_ORDERS:
+        raise ValueError(f"Unknown upload order: {order}")
+    if order == "priority":
+        return list(jobs)
+
+    fits: Dict[int, int] = {}
+    today, later = [], []
+    for job in jobs:
+        key = id(job.scheduler)
+        if key not in fits:
+            fits[key] = job.scheduler.remaining() // job.scheduler.cost("videos.insert")
+        if fits[key] > 0:
+            fits[key] -= 1
+            today.append(job)
+        else:
+            later.append(job)
+
+    today.sort(key=lambda job: job.size)
+    if order == "interleaved":
+        by_channel = OrderedDict()
+        for job in today:
+            by_channel.setdefault(job.channel, []).append(job)
+        queues = list(by_channel.values())
+        today = []
+        while queues:
+            today += [queue.pop(0) for queue in queues]
+            queues = [queue for queue in queues if queue]
+    return today + later
+
+
+class UploadExecutor:
+    """
+    Runs uploads on `workers` threads at once, across any number of channels.
+
+    Each thread builds its own YouTube client per channel with the job's
+    `service_factory` (httplib2 transports must not be shared between
+    threads), so uploads overlap each other's API round trips. A shared
+    `throttle` caps their combined upload rate.
+
+    Jobs run in `order` (see order_uploads). QuotaExceededError from a job
+    stops every channel of that Google project; the others carry on. With
+    `wait_for_reset` the worker sleeps until the Pacific-time quota reset and
+    retries instead. Other failures are logged and the next job starts.
+    Setting `cancel` stops in-flight uploads after their current chunk and
+    starts no new ones.
+    """
+
+    def __init__(
+        self,
+        workers: int = DEFAULT_UPLOAD_WORKERS,
+        throttle: Optional[BandwidthLimiter] = None,
+        order: str = DEFAULT_UPLOAD_ORDER,
+        wait_for_reset: bool = False,
+        transcode_executor: Optional[Executor] = None,
+        cancel: Optional[threading.Event] = None,
+    ):
+        if workers < 1:
+            raise ValueError("UploadExecutor needs at least 1 worker")
+        self.workers = workers
+        self.throttle = throttle
+        self.order = order
+        self.wait_for_reset = wait_for_reset
+        self.transcode_executor = transcode_executor
+        self.cancel = cancel if cancel is not None else threading.Event()
+        self._lock = threading.Lock()
+        self._jobs: List[UploadJob] = []
+        self._halted_projects = set()
+        self._halted_channels = set()
+        self._uploaded: List[str] = []
+
+    def _next_job(self) -> Optional[UploadJob]:
+        with self._lock:
+            while self._jobs and not self.cancel.is_set():
+                job = self._jobs.pop(0)
+                if job.scheduler.project in self._halted_projects or job.channel in self._halted_channels:
+                    continue
+                metrics.set_gauge("upload_executor_pending", len(self._jobs))
+                return job
+            return None
+
+    def _client(self, clients: Dict, job: UploadJob):
+        if job.channel not in clients:
+            clients[job.channel] = job.service_factory()
+        return clients[job.channel]
+
+    def _upload(self, clients: Dict, job: UploadJob) -> None:
+        try:
+            youtube = self._client(clients, job)
+        except Exception as e:
+            logging.exception("Failed to authenticate YouTube client for %s: %s", job.channel, e)
+            with self._lock:
+                self._halted_channels.add(job.channel)
+            return
+
+        upload_path = None
+        video_path = downloaded_path(job.download_dir, job.row)
+        if self.transcode_executor is not None and os.path.exists(video_path):
+            # A broken download is quarantined before it is hashed or sent to ffmpeg.
+            if not check_download(job.store, job.download_dir, job.video_id, video_path):
+                return
+            upload_path = prepare_for_upload(
+                job.store, job.download_dir, job.video_id, video_path, self.transcode_executor
+            )
+        while True:
+            try:
+                youtube_id = upload_video_record(
+                    youtube, job.download_dir, job.row, job.store, job.scheduler, upload_path,
+                    self.cancel, self.throttle, job.templates,
+                )
+            except QuotaExceededError:
+                if self.wait_for_reset:
+                    job.scheduler.sleep_until_reset()
+                    continue
+                logging.error("Halting uploads due to quota limits. Last attempted TikTok: %s", job.video_id)
+                with self._lock:
+                    self._halted_projects.add(job.scheduler.project)
+                return
+            if youtube_id:
+                with self._lock:
+                    self._uploaded.append(youtube_id)
+            return
+
+    def _worker(self) -> None:
+        clients = {}
+        while True:
+            job = self._next_job()
+            if job is None:
+                return
+            try:
+                self._upload(clients, job)
+            except UploadInterrupted as e:
+                logging.info("%s; it resumes on the next run.", e)
+            except Exception as e:
+                # As a safety net (shouldn't happen often), keep going
+                logging.exception("Unexpected failure for TikTok %s: %s", job.video_id, e)
+
+    def run(self, jobs: List[UploadJob]) -> int:
+        """Uploads `jobs` and returns how many were uploaded."""
+        self._jobs = order_uploads(jobs, self.order)
+        self._uploaded = []
+        if not self._jobs:
+            return 0
+        logging.info("Uploading %d videos with %d workers in %s order.", len(self._jobs), self.workers, self.order)
+        threads = [
+            threading.Thread(target=self._worker, name=f"uploader-{n}", daemon=True)
+            for n in range(min(self.workers, len(self._jobs)))
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        return len(self._uploaded)
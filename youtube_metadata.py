@@ -0,0 +1,284 @@
+import logging
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from googleapiclient.errors import HttpError
+
+import metrics
+from metadata_templates import MetadataTemplates
+from quota import QuotaScheduler
+from state_store import StateStore
+from youtube_uploader import QuotaExceededError, _parse_reason_from_http_error
+
+
+# videos.list accepts up to 50 ids per call, and YouTube recommends keeping
+# batches to 50 calls as well.
+VIDEOS_LIST_MAX_IDS = 50
+BATCH_SIZE = 50
+
+# Responses that are worth sending again in the next batch.
+RETRIABLE_BATCH_STATUS_CODES = (500, 502, 503, 504)
+MAX_BATCH_ROUNDS = 3
+
+
+class BatchQuotaExceededError(QuotaExceededError):
+    """QuotaExceededError from execute_batched, carrying the results gathered before it."""
+
+    def __init__(self, message: str, responses: Dict[str, Dict], errors: Dict[str, Exception]):
+        super().__init__(message)
+        self.responses = responses
+        self.errors = errors
+
+
+def _chunks(items: List, size: int) -> Iterable[List]:
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def execute_batched(
+    youtube,
+    method: str,
+    calls: List[Tuple[str, Callable]],
+    scheduler: Optional[QuotaScheduler] = None,
+    batch_size: int = BATCH_SIZE,
+) -> Tuple[Dict[str, Dict], Dict[str, Exception]]:
+    """
+    Runs API calls through the batch endpoint, `batch_size` per HTTP request.
+
+    `calls` pairs a key with a function building the request (requests can't
+    be re-sent, so retries build fresh ones). The quota cost of each batch,
+    one `method` call per entry, is booked against `scheduler` before it is
+    sent; BatchQuotaExceededError is raised when the budget is spent or
+    YouTube reports quotaExceeded, with the responses and errors gathered so
+    far (calls that never ran are in neither). Entries that fail with a 5xx
+    are retried in later batches.
+
+    Returns (responses, errors), both keyed like `calls`.
+    """
+    responses: Dict[str, Dict] = {}
+    errors: Dict[str, Exception] = {}
+    pending = list(calls)
+
+    for _ in range(MAX_BATCH_ROUNDS):
+        retry = []
+        for chunk in _chunks(pending, batch_size):
+            if scheduler is not None and not scheduler.try_reserve(method, len(chunk)):
+                raise BatchQuotaExceededError(
+                    f"Daily quota budget for {scheduler.project} is spent", responses, errors
+                )
+
+            builders = dict(chunk)
+            quota_hit = []
+
+            def callback(key, response, exception):
+                if exception is None:
+                    responses[key] = response
+                    errors.pop(key, None)
+                    return
+                errors[key] = exception
+                if _parse_reason_from_http_error(exception) == "quotaExceeded":
+                    quota_hit.append(key)
+                elif isinstance(exception, HttpError) and exception.resp.status in RETRIABLE_BATCH_STATUS_CODES:
+                    retry.append((key, builders[key]))
+
+            batch = youtube.new_batch_http_request(callback=callback)
+            for key, build in chunk:
+                batch.add(build(), request_id=key)
+            with metrics.span("youtube_batch", method=method, calls=len(chunk)):
+                batch.execute()
+            metrics.inc("youtube_batch_requests_total", method=method)
+            metrics.inc("youtube_batched_calls_total", len(chunk), method=method)
+
+            if quota_hit:
+                if scheduler is not None:
+                    scheduler.mark_exhausted()
+                raise BatchQuotaExceededError("YouTube Data API quota exceeded", responses, errors)
+        if not retry:
+            break
+        logging.warning("Retrying %d %s calls that failed with server errors.", len(retry), method)
+        pending = retry
+    return responses, errors
+
+
+def reconcile_uploads(
+    youtube,
+    store: StateStore,
+    scheduler: Optional[QuotaScheduler] = None,
+    author_username: Optional[str] = None,
+    requeue_missing: bool = False,
+    templates: Optional[MetadataTemplates] = None,
+) -> Dict[str, int]:
+    """
+    Checks that every upload recorded in the state store still exists on
+    YouTube, with videos.list calls of 50 ids each, sent 50 calls per batch.
+
+    Videos YouTube no longer returns are marked missing, or with
+    `requeue_missing` put back in the upload queue. Uploads YouTube rejected
+    or failed to process are logged. Returns counts of checked, present,
+    missing and rejected videos.
+
+    With `templates`, the snippets come back in the same calls, and every
+    video whose title, description or tags differ from what the templates
+    render for it now is updated (see update_snippets); the count of those
+    is returned as "updated".
+
+    If the quota runs out part way, the calls that came back are still acted
+    on and the BatchQuotaExceededError is re-raised; no snippets are updated.
+    """
+    uploaded = store.uploaded_videos(author_username)
+    by_youtube_id = {row["youtube_id"]: row["video_id"] for row in uploaded}
+    part = "id,status,snippet" if templates is not None else "id,status"
+    youtube_ids = list(by_youtube_id)
+
+    ids_by_call = dict(enumerate(_chunks(youtube_ids, VIDEOS_LIST_MAX_IDS)))
+    calls = [
+        (str(n), lambda ids=ids: youtube.videos().list(part=part, id=",".join(ids)))
+        for n, ids in ids_by_call.items()
+    ]
+    quota_error = None
+    try:
+        responses, errors = execute_batched(youtube, "videos.list", calls, scheduler)
+    except BatchQuotaExceededError as e:
+        # Act on the chunks that came back; the rest stay unchecked.
+        responses, errors, quota_error = e.responses, e.errors, e
+
+    found = {}
+    for response in responses.values():
+        for item in response.get("items", []):
+            found[item["id"]] = item
+    # Ids whose call failed or never ran are neither present nor missing.
+    unchecked = set()
+    for key, error in errors.items():
+        logging.error("videos.list batch entry %s failed: %s", key, error)
+    for n, ids in ids_by_call.items():
+        if str(n) not in responses:
+            unchecked.update(ids)
+
+    missing = [by_youtube_id[y] for y in youtube_ids if y not in found and y not in unchecked]
+    rejected = [
+        by_youtube_id[y] for y, item in found.items()
+        if item.get("status", {}).get("uploadStatus") in ("rejected", "failed")
+    ]
+    if missing:
+        store.mark_upload_missing(missing, requeue=requeue_missing)
+        logging.warning("%d uploaded videos no longer exist on YouTube: %s", len(missing), ", ".join(missing))
+    if rejected:
+        logging.warning("YouTube rejected or failed to process %d uploads: %s", len(rejected), ", ".join(rejected))
+
+    summary = {
+        "checked": len(youtube_ids) - len(unchecked),
+        "present": len(found),
+        "missing": len(missing),
+        "rejected": len(rejected),
+    }
+    if quota_error is not None:
+        logging.warning("Quota ran out while reconciling uploads in %s: %s", store.path, summary)
+        raise quota_error
+    if templates is not None:
+        stale = outdated_snippets(uploaded, found, templates)
+        if stale:
+            results = update_snippets(youtube, store, stale, scheduler)
+            summary["updated"] = sum(results.values())
+        else:
+            summary["updated"] = 0
+    logging.info("Reconciled uploads in %s: %s", store.path, summary)
+    return summary
+
+
+def outdated_snippets(
+    uploaded: Iterable[Dict], found: Dict[str, Dict], templates: MetadataTemplates
+) -> Dict[str, Dict]:
+    """
+    Renders `templates` for each uploaded row and returns the snippets, keyed
+    by TikTok video_id, that differ from the one YouTube has (`found`, the
+    videos.list items by YouTube id). The item's categoryId is kept.
+    """
+    stale = {}
+    with metrics.span("render_snippets", videos=len(found)):
+        for row in uploaded:
+            item = found.get(row["youtube_id"])
+            if item is None or "snippet" not in item:
+                continue
+            current = item["snippet"]
+            snippet = templates.render(row)
+            if (
+                snippet["title"] != current.get("title")
+                or snippet["description"] != current.get("description", "")
+                or snippet["tags"] != current.get("tags", [])
+            ):
+                if current.get("categoryId"):
+                    snippet["categoryId"] = current["categoryId"]
+                stale[row["video_id"]] = snippet
+    return stale
+
+
+def add_to_playlist(
+    youtube,
+    playlist_id: str,
+    youtube_ids: List[str],
+    scheduler: Optional[QuotaScheduler] = None,
+) -> Dict[str, Optional[str]]:
+    """
+    Adds videos to a playlist with batched playlistItems.insert calls.
+    Returns the playlist item id per video, or None where the insert failed.
+    Failures are logged before a BatchQuotaExceededError is re-raised.
+    """
+    calls = [
+        (youtube_id, lambda youtube_id=youtube_id: youtube.playlistItems().insert(
+            part="snippet",
+            body={"snippet": {"playlistId": playlist_id, "resourceId": {"kind": "youtube#video", "videoId": youtube_id}}},
+        ))
+        for youtube_id in youtube_ids
+    ]
+    quota_error = None
+    try:
+        responses, errors = execute_batched(youtube, "playlistItems.insert", calls, scheduler)
+    except BatchQuotaExceededError as e:
+        responses, errors, quota_error = e.responses, e.errors, e
+    for youtube_id, error in errors.items():
+        logging.error("Could not add %s to playlist %s: %s", youtube_id, playlist_id, error)
+    if quota_error is not None:
+        raise quota_error
+    return {youtube_id: (responses.get(youtube_id) or {}).get("id") for youtube_id in youtube_ids}
+
+
+def update_snippets(
+    youtube,
+    store: StateStore,
+    snippets: Dict[str, Dict],
+    scheduler: Optional[QuotaScheduler] = None,
+) -> Dict[str, bool]:
+    """
+    Rewrites the snippet (title, description, tags, ...) of uploaded videos
+    with batched videos.update calls. `snippets` is keyed by TikTok video_id;
+    a snippet without categoryId keeps the uploader's default. New titles are
+    recorded in the state store, also for the updates that went through
+    before a BatchQuotaExceededError. Returns whether each update succeeded.
+    """
+    targets = {}
+    for video_id, snippet in snippets.items():
+        row = store.get_video(video_id)
+        if not row or not row.get("youtube_id"):
+            logging.warning("Cannot update TikTok %s: it has no YouTube upload.", video_id)
+            continue
+        targets[video_id] = (row["youtube_id"], dict({"categoryId": "22"}, **snippet))
+
+    calls = [
+        (video_id, lambda youtube_id=youtube_id, snippet=snippet: youtube.videos().update(
+            part="snippet", body={"id": youtube_id, "snippet": snippet},
+        ))
+        for video_id, (youtube_id, snippet) in targets.items()
+    ]
+    quota_error = None
+    try:
+        responses, errors = execute_batched(youtube, "videos.update", calls, scheduler)
+    except BatchQuotaExceededError as e:
+        responses, errors, quota_error = e.responses, e.errors, e
+    for video_id, error in errors.items():
+        logging.error("Could not update the snippet of TikTok %s: %s", video_id, error)
+    for video_id in responses:
+        title = targets[video_id][1].get("title")
+        if title:
+            store.set_title(video_id, title)
+    if quota_error is not None:
+        raise quota_error
+    return {video_id: video_id in responses for video_id in snippets}
@@ -1,62 +1,42 @@
 import os
-import csv
 import json
+import time
+import socket
+import random
 import logging
-from typing import Optional, Set
+import threading
+from concurrent.futures import Executor
+from typing import Callable, Dict, Optional, Sequence, Union
 
+import httplib2
 from googleapiclient.http import MediaFileUpload
 from googleapiclient.errors import HttpError
+import metrics
+from logger import log_context
 from auth import get_authenticated_service
+from state_store import StateStore
+from fingerprint import find_uploaded_duplicate
+from mp4_probe import check_download
+from quota import DEFAULT_PRIORITY, QuotaScheduler
+from bandwidth import BandwidthLimiter
+from metadata_templates import DEFAULT_TAGS, DEFAULT_TEMPLATES, MetadataTemplates
 
 
-YOUTUBE_TITLE_MAX = 100
+# Resumable chunk sizes must be a multiple of 256 KiB.
+DEFAULT_CHUNK_SIZE = 8 * 1024 * 1024
+MAX_CHUNK_RETRIES = 8
+MAX_RETRY_DELAY = 64
+RETRIABLE_STATUS_CODES = (500, 502, 503, 504)
+RETRIABLE_EXCEPTIONS = (httplib2.HttpLib2Error, ConnectionError, socket.timeout, TimeoutError)
+EXPIRED_SESSION_STATUS_CODES = (404, 410)
 
 
 class QuotaExceededError(Exception):
     """Raised when YouTube Data API quota is exceeded."""
 
 
-def _ensure_upload_log(path: str) -> None:
-    os.makedirs(os.path.dirname(path), exist_ok=True)
-    if not os.path.exists(path):
-        with open(path, "w", newline="", encoding="utf-8") as f:
-            writer = csv.writer(f)
-            writer.writerow(["tiktok_video_id", "youtube_video_id", "title"])
-
-
-def _load_uploaded_ids(path: str) -> Set[str]:
-    if not os.path.exists(path):
-        return set()
-    uploaded = set()
-    with open(path, "r", newline="", encoding="utf-8") as f:
-        reader = csv.DictReader(f)
-        for row in reader:
-            vid = (row.get("tiktok_video_id") or "").strip()
-            if vid:
-                uploaded.add(vid)
-    return uploaded
-
-
-def _append_upload_log(path: str, tiktok_id: str, youtube_id: str, title: str) -> None:
-    _ensure_upload_log(path)
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.writer(f)
-        writer.writerow([tiktok_id, youtube_id, title])
-
-
-def _sanitize_title(title: Optional[str], username: str, video_id: str) -> str:
-    raw = (title or "").strip()
-    if not raw:
-        raw = f"TikTok by @{username} ({video_id})"
-
-    # Collapse whitespace
-    raw = " ".join(raw.split())
-
-    # Hard cap to YouTube’s 100 char limit
-    if len(raw) > YOUTUBE_TITLE_MAX:
-        raw = raw[:YOUTUBE_TITLE_MAX]
-
-    return raw
+class UploadInterrupted(Exception):
+    """Raised between chunks when an upload is cancelled; its resumable session is kept."""
 
 
 def _parse_reason_from_http_error(err: Exception) -> Optional[str]:
@@ -83,11 +63,154 @@ def _parse_reason_from_http_error(err: Exception) -> Optional[str]:
         return None
 
 
-def upload_to_youtube(youtube, video_path: str, title: str, description: str) -> Optional[str]:
+def _resumable_session(store: StateStore, video_id: str, video_path: str) -> Optional[Dict]:
+    """The persisted upload session of a video, if there is one and its file is unchanged."""
+    session = store.get_upload_session(video_id)
+    if not session:
+        return None
+    stat = os.stat(video_path)
+    if session["file_size"] != stat.st_size or session["file_mtime"] != stat.st_mtime:
+        return None
+    return session
+
+
+def _resume_session(request, session_uri: str, video_path: str) -> Optional[Dict]:
+    """
+    Asks YouTube how many bytes a persisted session already has (an empty PUT
+    with "Content-Range: bytes */size") and points a fresh insert request at
+    it, so next_chunk() carries on from there. Returns the finished upload's
+    response instead if YouTube already has the whole file.
+    """
+    size = os.path.getsize(video_path)
+    resp, content = request.http.request(
+        session_uri, "PUT", headers={"Content-Range": f"bytes */{size}", "Content-Length": "0"}
+    )
+    if resp.status in (200, 201):
+        return request.postproc(resp, content)
+    if resp.status != 308:
+        raise HttpError(resp, content, uri=session_uri)
+    # "range: bytes=0-N" lists what arrived; no header means nothing did.
+    received = resp.get("range")
+    request.resumable_uri = session_uri
+    request.resumable_progress = int(received.rsplit("-", 1)[1]) + 1 if received else 0
+    return None
+
+
+def _next_chunk_with_retry(request, video_path: str, max_retries: int, on_progress,
+                           cancel: Optional[threading.Event] = None,
+                           throttle: Optional[BandwidthLimiter] = None) -> Dict:
+    """
+    Drives next_chunk() to completion, retrying transient failures with
+    backoff. Raises UploadInterrupted before the next chunk once `cancel` is
+    set. Each chunk (and each retry of it) is paid for from `throttle` first.
+    """
+    response = None
+    retry = 0
+    while response is None:
+        if cancel is not None and cancel.is_set():
+            raise UploadInterrupted(f"Upload of {video_path} stopped at byte {request.resumable_progress}")
+        if throttle is not None:
+            media = request.resumable
+            throttle.consume(min(media.chunksize(), media.size() - request.resumable_progress), cancel)
+            if cancel is not None and cancel.is_set():
+                continue
+        error = None
+        try:
+            status, response = request.next_chunk()
+            if status:
+                on_progress(status.resumable_progress)
+                logging.debug(
+                    "Uploaded %d%% of %s", int(status.progress() * 100), video_path
+                )
+            retry = 0
+        except HttpError as e:
+            if e.resp.status not in RETRIABLE_STATUS_CODES:
+                raise
+            error = e
+        except RETRIABLE_EXCEPTIONS as e:
+            error = e
+
+        if error is not None:
+            metrics.inc("youtube_upload_retries_total")
+            retry += 1
+            if retry > max_retries:
+                raise error
+            if request.resumable_uri:
+                on_progress(request.resumable_progress)
+            delay = min(2 ** retry, MAX_RETRY_DELAY) * random.uniform(0.5, 1.0)
+            logging.warning(
+                "Retriable error uploading %s (%s); retry %d/%d in %.1fs",
+                video_path, error, retry, max_retries, delay,
+            )
+            time.sleep(delay)
+    return response
+
+
+def _send_video(youtube, video_path: str, body: Dict, chunksize: int, store: Optional[StateStore],
+                video_id: Optional[str], max_retries: int, cancel: Optional[threading.Event] = None,
+                throttle: Optional[BandwidthLimiter] = None) -> Dict:
+    """Runs the resumable insert, resuming or persisting its session in `store`."""
+    media = MediaFileUpload(video_path, chunksize=chunksize, resumable=True)
+    request = youtube.videos().insert(part="snippet,status", body=body, media_body=media)
+
+    persist = store is not None and video_id is not None
+    session = _resumable_session(store, video_id, video_path) if persist else None
+    resumed = session is not None
+
+    def on_progress(bytes_sent):
+        if persist and request.resumable_uri:
+            stat = os.stat(video_path)
+            store.save_upload_session(
+                video_id, video_path, stat.st_size, stat.st_mtime, request.resumable_uri, bytes_sent
+            )
+
+    try:
+        response = None
+        if resumed:
+            logging.info("Resuming interrupted upload of %s", video_path)
+            response = _resume_session(request, session["session_uri"], video_path)
+        if response is None:
+            response = _next_chunk_with_retry(request, video_path, max_retries, on_progress, cancel, throttle)
+    except HttpError as e:
+        if not (resumed and e.resp.status in EXPIRED_SESSION_STATUS_CODES):
+            raise
+        # The persisted session is gone on YouTube's side; start a new one.
+        logging.warning("Upload session for %s expired; restarting upload", video_path)
+        store.clear_upload_session(video_id)
+        request = youtube.videos().insert(part="snippet,status", body=body, media_body=media)
+        response = _next_chunk_with_retry(request, video_path, max_retries, on_progress, cancel, throttle)
+
+    if persist:
+        store.clear_upload_session(video_id)
+    return response
+
+
+def upload_to_youtube(
+    youtube,
+    video_path: str,
+    title: str,
+    description: str,
+    chunksize: int = DEFAULT_CHUNK_SIZE,
+    store: Optional[StateStore] = None,
+    video_id: Optional[str] = None,
+    max_retries: int = MAX_CHUNK_RETRIES,
+    cancel: Optional[threading.Event] = None,
+    throttle: Optional[BandwidthLimiter] = None,
+    tags: Sequence[str] = DEFAULT_TAGS,
+) -> Optional[str]:
     """
     Returns YouTube video ID on success.
     Raises QuotaExceededError if quota is exceeded.
     Returns None for any other failure (and logs it).
+
+    The file is sent in `chunksize` pieces and transient 5xx/socket errors are
+    retried with exponential backoff. When `store` and `video_id` are given,
+    the resumable session URI and byte offset are persisted after every chunk,
+    so an interrupted upload continues from the last confirmed byte on the
+    next attempt, even after a restart. Setting `cancel` stops the upload
+    after the chunk in flight and raises UploadInterrupted. A `throttle`
+    (bandwidth.BandwidthLimiter) shared between uploads caps their combined
+    upload rate.
     """
     try:
         logging.info("Uploading video: %s with title: %s", video_path, title)
@@ -95,7 +218,7 @@ def upload_to_youtube(youtube, video_path: str, title: str, description: str) ->
             "snippet": {
                 "title": title,
                 "description": description,
-                "tags": ["TikTok", "Shorts", "Reels"],
+                "tags": list(tags),
                 "categoryId": "22",  # People & Blogs
             },
             "status": {
@@ -103,17 +226,23 @@ def upload_to_youtube(youtube, video_path: str, title: str, description: str) ->
                 "selfDeclaredMadeForKids": False,
             },
         }
-        media = MediaFileUpload(video_path, chunksize=-1, resumable=True)
-        request = youtube.videos().insert(part="snippet,status", body=body, media_body=media)
-        response = request.execute()  # will raise HttpError on 4xx/5xx
+        with metrics.span("youtube_upload", video_id=video_id, bytes=os.path.getsize(video_path)):
+            response = _send_video(
+                youtube, video_path, body, chunksize, store, video_id, max_retries, cancel, throttle
+            )
+        metrics.inc("youtube_uploaded_videos_total")
+        metrics.inc("youtube_upload_bytes_total", os.path.getsize(video_path))
         yt_id = response["id"]
         logging.info("Uploaded successfully: Video ID %s", yt_id)
         return yt_id
 
+    except UploadInterrupted:
+        raise
     except Exception as e:
         # Detect quota exceeded specifically
         reason = _parse_reason_from_http_error(e)
         if reason == "quotaExceeded":
+            metrics.inc("youtube_quota_exceeded_total")
             logging.error(
                 "YouTube quota exceeded. Stopping gracefully. "
                 "Check your Cloud Console -> YouTube Data API v3 -> Quotas."
@@ -121,72 +250,153 @@ def upload_to_youtube(youtube, video_path: str, title: str, description: str) ->
             raise QuotaExceededError("YouTube Data API quota exceeded") from e
 
         # Keep going for everything else, but include full stack trace
+        metrics.inc("youtube_upload_failures_total")
         logging.exception("Error uploading video: %s", e)
         return None
 
 
-def process_and_upload_clips(download_dir: str) -> None:
-    """
-    Reads tiktok metadata.csv in download_dir, skips already uploaded items
-    recorded in youtube_uploads.csv, uploads the rest.
+def downloaded_path(download_dir: str, row: Dict) -> str:
+    """Path of the downloaded mp4 described by a state store row."""
+    filename = row.get("filename") or f"@{(row.get('author_username') or '').strip()}_video_{row['video_id']}.mp4"
+    return os.path.join(download_dir, filename)
 
-    Continues on non-quota errors; gracefully stops if quota is exceeded.
+
+def upload_video_record(
+    youtube,
+    download_dir: str,
+    row: Dict,
+    store: StateStore,
+    scheduler: Optional[QuotaScheduler] = None,
+    upload_path: Optional[str] = None,
+    cancel: Optional[threading.Event] = None,
+    throttle: Optional[BandwidthLimiter] = None,
+    templates: MetadataTemplates = DEFAULT_TEMPLATES,
+) -> Optional[str]:
     """
-    try:
-        youtube = get_authenticated_service()
-    except Exception as e:
-        logging.exception("Failed to authenticate YouTube client: %s", e)
-        return
+    Uploads the video described by a state store row and records the outcome.
+
+    Returns the YouTube video ID on success and None if the video was skipped
+    or failed. Raises QuotaExceededError if quota is exceeded. With a
+    `scheduler`, the insert's quota cost is reserved first and
+    QuotaExceededError is raised without calling the API once today's budget
+    is spent. A video whose content matches one already uploaded (see
+    fingerprint.find_uploaded_duplicate) is marked as a duplicate and skipped
+    without booking any quota. `upload_path` sends a different file than the
+    downloaded one, e.g. its transcoded copy. An upload stopped through
+    `cancel` raises UploadInterrupted and stays pending, to resume later;
+    resuming its stored session books no quota a second time.
+    `throttle` caps the upload rate (see upload_to_youtube). The title,
+    description and tags are rendered from the row by the channel's
+    `templates` (see metadata_templates.MetadataTemplates).
+
+    The downloaded file's mp4 structure is checked first (see
+    mp4_probe.validate_video): an empty, cut-off or otherwise broken file is
+    quarantined and queued for download again instead of being uploaded.
+    """
+    video_id = row["video_id"]
+    username = (row.get("author_username") or "").strip()
+
+    if not username:
+        logging.warning("Skipping record with missing username: %s", video_id)
+        return None
+
+    with log_context(account=username, video_id=video_id):
+        video_path = downloaded_path(download_dir, row)
+
+        snippet = templates.render(row)
+
+        if not os.path.exists(video_path):
+            logging.warning("Video file not found for ID %s: %s", video_id, video_path)
+            return None
+
+        if not check_download(store, download_dir, video_id, video_path):
+            return None
 
-    metadata_path = os.path.join(download_dir, "metadata.csv")
-    upload_log_path = os.path.join(download_dir, "youtube_uploads.csv")
+        # Reposts and clips shared between accounts are caught here, before any
+        # quota is booked for them.
+        original = find_uploaded_duplicate(store, download_dir, video_id, video_path)
+        if original is not None:
+            store.mark_duplicate(video_id, original)
+            metrics.inc("youtube_duplicates_skipped_total")
+            return None
 
-    if not os.path.exists(metadata_path):
-        logging.error("Metadata file not found: %s", metadata_path)
-        return
+        # Resuming a stored session continues an insert whose quota is already booked.
+        resuming = _resumable_session(store, video_id, upload_path or video_path) is not None
+        if scheduler is not None and not resuming and not scheduler.try_reserve("videos.insert"):
+            raise QuotaExceededError(f"Daily quota budget for {scheduler.project} is spent")
 
-    uploaded_ids = _load_uploaded_ids(upload_log_path)
-    logging.info("Loaded %d previously uploaded TikToks from %s", len(uploaded_ids), upload_log_path)
+        try:
+            youtube_id = upload_to_youtube(
+                youtube, upload_path or video_path, snippet["title"], snippet["description"], store=store,
+                video_id=video_id, cancel=cancel, throttle=throttle, tags=snippet["tags"],
+            )
+        except QuotaExceededError:
+            if scheduler is not None:
+                scheduler.mark_exhausted()
+            raise
+        if youtube_id:
+            store.mark_uploaded(video_id, youtube_id, snippet["title"])
+        else:
+            store.mark_upload_failed(video_id, "upload_to_youtube returned no video id")
+        return youtube_id
+
+
+def process_and_upload_clips(
+    download_dir: str,
+    store: Optional[StateStore] = None,
+    scheduler: Optional[QuotaScheduler] = None,
+    priority: Union[str, Sequence[str]] = DEFAULT_PRIORITY,
+    wait_for_reset: bool = False,
+    transcode_executor: Optional[Executor] = None,
+    service_factory: Optional[Callable] = None,
+    workers: int = 1,
+    throttle: Optional[BandwidthLimiter] = None,
+    order: Optional[str] = None,
+    templates: MetadataTemplates = DEFAULT_TEMPLATES,
+) -> None:
+    """
+    Uploads every downloaded TikTok in download_dir's state store that has not
+    been uploaded yet. Legacy metadata.csv / youtube_uploads.csv files are
+    imported into the store the first time it is opened.
+
+    Uploads are ordered by `priority` (see quota.PRIORITY_RULES) and their
+    quota cost is booked against `scheduler` (a default one for the store if
+    not given). Continues on non-quota errors. When the budget is spent it
+    stops gracefully, or with `wait_for_reset` sleeps until the Pacific-time
+    quota reset and carries on. With a `transcode_executor` each video is
+    first normalized for Shorts (see transcoder.prepare_for_upload).
+    `service_factory` builds the YouTube client instead of the default
+    get_authenticated_service(), e.g. for another channel.
+
+    `workers` uploads run at once (see upload_executor.UploadExecutor), at
+    most `throttle` bytes per second between them, in `order` (by default
+    priority order for one worker and smallest file first for more).
+    `templates` renders each video's title, description and tags.
+    """
+    # Imported here: upload_executor builds on this module.
+    from upload_executor import UploadExecutor, channel_jobs
 
     try:
-        with open(metadata_path, mode="r", encoding="utf-8") as csv_file:
-            reader = csv.DictReader(csv_file)
-            for row in reader:
-                video_id = (row.get("video_id") or "").strip()
-                username = (row.get("author_username") or "").strip()
-
-                if not video_id or not username:
-                    logging.warning("Skipping row with missing video_id/username: %s", row)
-                    continue
-
-                if video_id in uploaded_ids:
-                    logging.info("Already uploaded TikTok %s; skipping.", video_id)
-                    continue
-
-                filename = f"@{username}_video_{video_id}.mp4"
-                video_path = os.path.join(download_dir, filename)
-
-                title = _sanitize_title(row.get("video_description"), username, video_id)
-                description = f"Credit to @{username} on TikTok."
-
-                if not os.path.exists(video_path):
-                    logging.warning("Video file not found for ID %s: %s", video_id, video_path)
-                    continue
-
-                try:
-                    youtube_id = upload_to_youtube(youtube, video_path, title, description)
-                except QuotaExceededError:
-                    # Graceful stop on quota, no stack trace beyond what's already logged
-                    logging.error("Halting uploads due to quota limits. Last attempted TikTok: %s", video_id)
-                    break  # exit the loop gracefully
-                except Exception as e:
-                    # As a safety net (shouldn’t happen often), keep going
-                    logging.exception("Unexpected failure for TikTok %s: %s", video_id, e)
-                    continue
-
-                if youtube_id:
-                    _append_upload_log(upload_log_path, video_id, youtube_id, title)
-                    uploaded_ids.add(video_id)
+        if store is None:
+            store = StateStore.for_download_dir(download_dir)
+        if scheduler is None:
+            scheduler = QuotaScheduler(store)
+        store.import_csv_history(download_dir)
+
+        jobs = channel_jobs(
+            "default", download_dir, store, scheduler, service_factory or get_authenticated_service, priority,
+            templates,
+        )
+        logging.info("Found %d downloaded TikToks waiting for upload in %s", len(jobs), store.path)
+
+        executor = UploadExecutor(
+            workers,
+            throttle=throttle,
+            order=order or ("priority" if workers == 1 else "shortest_first"),
+            wait_for_reset=wait_for_reset,
+            transcode_executor=transcode_executor,
+        )
+        executor.run(jobs)
 
     except Exception as e:
         logging.exception("An unexpected error occurred in the process: %s", e)